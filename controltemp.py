@@ -4,7 +4,7 @@ class FermenterTempControl:
        and the working status of the cooler and heater are indicated by the RGB LED.
 
        Note that the temperature readings here are not realtime measured.
-       The realtime temp measurements are done in the main logic at a higher frequency.
+       The realtime temp measurements are done by the sensor scheduler (Ds18Sensors) at a higher frequency.
     """
 
     def __init__(self, cooler_obj, heater_obj, wort_sensor_obj, chamber_sensor_obj, pid_obj, led_obj):
@@ -96,6 +96,27 @@ class FermenterTempControl:
             # LED为绿色表示发酵箱处于待机状态（制热制冷均不工作）
             self.led.set_color('green')
 
+    def force_actuator(self, element, action):
+        """
+        手动控制制冷压缩机或制热器，主要用于测试
+        :param element: str; 'heater' or 'cooler'
+        :param action: bool; True to switch on, False to switch off
+        """
+        actuator = self.heater if element == 'heater' else self.cooler
+        if action:
+            actuator.force_on()
+        else:
+            actuator.force_off()
+        if self.heater.is_on() and not self.cooler.is_on():
+            led_color = 'red'
+        elif not self.heater.is_on() and self.cooler.is_on():
+            led_color = 'blue'
+        elif not self.heater.is_on() and not self.cooler.is_on():
+            led_color = 'green'
+        else:
+            led_color = 'orange'
+        self.led.set_color(led_color)
+
     def accomplished(self):
         self.job_done = True
 
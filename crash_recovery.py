@@ -1,5 +1,6 @@
 import uos
 import ujson
+from jsonwriter import JSONWriter
 from logger import init_logger
 
 
@@ -21,8 +22,8 @@ class CrashRecovery:
 
     def backing_up(self, process_info):
         logger.debug('Backing up current progress for crash recovery.')
-        with open(self.filename, 'w') as f:
-            ujson.dump(process_info, f)
+        with open(self.filename, 'wb') as f:
+            JSONWriter(f.write).dump(process_info).flush()
 
     def remove_backup(self):
         if self.is_needed():
@@ -0,0 +1,354 @@
+import _thread
+import uos
+import ustruct
+import utime
+
+from logger import init_logger
+from telemetry import (to_temp, to_gravity, sample_values, FLAG_HEATING, FLAG_COOLING, TEMP_SCALE, GRAVITY_SCALE,
+                       NO_TEMP, NO_GRAVITY)
+
+logger = init_logger(__name__)
+
+# timestamp, set temp, wort temp, chamber temp, gravity, flags, padded to 16 bytes
+# fixed-point values as in telemetry, a timestamp of 0 marks a padding record
+RECORD_FORMAT = '<IhhhHB3x'
+RECORD_SIZE = 16
+# timestamp & number of an indexed record
+INDEX_FORMAT = '<II'
+INDEX_SIZE = 8
+
+# exported records are lines of a fixed width, missing values are blank (CSV) or null (NDJSON)
+CSV_HEADER = b'time,setTemp,wortTemp,chamberTemp,gravity,heating,cooling\n'
+CSV_LINE = '%10s,%7s,%7s,%7s,%6s,%1s,%1s\n'
+NDJSON_LINE = '{"time":%10s,"setTemp":%7s,"wortTemp":%7s,"chamberTemp":%7s,"gravity":%6s,"heating":%5s,"cooling":%5s}\n'
+# utime.time() counts from 2000-01-01 on MicroPython, the exports use the Unix time
+UNIX_EPOCH_OFFSET = 946684800 if utime.localtime(0)[0] == 2000 else 0
+
+
+class DataLog:
+    """
+    Append-only log of every sample of a batch on the SD card, eg. /sd/log/619876543.bin,
+    one segment per batch named after its start time
+    Records have a fixed width, so record n is at offset n * RECORD_SIZE, and every index_every records
+    an entry is added to the sidecar index (.idx): a time range query looks up its first record by
+    binary search in the index and seeks there, instead of reading the log from the beginning.
+    Records are written a page at a time, to save the SD card from small writes.
+
+    Usage example:
+
+    datalog = DataLog('/sd/log')
+    datalog.open_batch()  # when the fermentation starts
+    datalog.sample(process.get_process_info())  # called by the control loop
+    for record in datalog.read_range(batch, start_time, end_time):
+        timestamp, set_temp, wort_temp, chamber_temp, gravity, flags = record
+    """
+    def __init__(self, path='/sd/log', page_size=512, index_every=64):
+        """
+        :param path: str; directory of the segments
+        :param page_size: int; bytes buffered before writing, a multiple of RECORD_SIZE
+        :param index_every: int; number of records between two index entries
+        """
+        self.path = path
+        self.page_size = page_size
+        self.index_every = index_every
+        self.buf = bytearray(page_size)
+        self.buf_len = 0
+        self.index_buf = b''
+        # start time of the open segment, None if there is none
+        self.batch = None
+        # records of the open segment, including the buffered ones
+        self.count = 0
+        self.lock = _thread.allocate_lock()
+
+    def _filename(self, batch, ext):
+        return '%s/%d.%s' % (self.path, batch, ext)
+
+    def get_batches(self):
+        """
+        :return: list; start times of the batches logged, oldest first
+        """
+        try:
+            names = uos.listdir(self.path)
+        except OSError:
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith('.bin') and name[:-4].isdigit())
+
+    def open_batch(self, resume=False):
+        """
+        Start a new segment, or carry on with the last one after a crash recovery
+        Logging is disabled if the SD card can't be written.
+        """
+        with self.lock:
+            self._flush()
+            batches = self.get_batches() if resume else []
+            try:
+                if batches:
+                    self.batch = batches[-1]
+                    size = uos.stat(self._filename(self.batch, 'bin'))[6]
+                    self.count = (size + RECORD_SIZE - 1) // RECORD_SIZE
+                    if size % RECORD_SIZE:
+                        # a record cut by the crash, blanked to a padding record so the next ones stay aligned
+                        with open(self._filename(self.batch, 'bin'), 'r+b') as f:
+                            f.seek(size - size % RECORD_SIZE)
+                            f.write(bytes(RECORD_SIZE))
+                else:
+                    try:
+                        uos.mkdir(self.path)
+                    except OSError:
+                        pass  # exists already
+                    self.batch = utime.time()
+                    self.count = 0
+                    for ext in ('bin', 'idx'):
+                        open(self._filename(self.batch, ext), 'wb').close()
+            except OSError as e:
+                self.batch = None
+                logger.warning('Data log disabled, failed to open a segment in ' + self.path + ': ' + str(e))
+                return
+        logger.info('Logging to ' + self._filename(self.batch, 'bin'))
+
+    def close_batch(self):
+        with self.lock:
+            self._flush()
+            self.batch = None
+
+    def append(self, timestamp, set_temp, wort_temp, chamber_temp, gravity, flags=0):
+        """
+        :param timestamp: int; seconds, utime.time()
+        :param set_temp, wort_temp, chamber_temp: float; °C, None if unknown
+        :param gravity: float; specific gravity, None if unknown
+        :param flags: int; FLAG_HEATING | FLAG_COOLING
+        """
+        with self.lock:
+            if self.batch is None:
+                return
+            if self.count % self.index_every == 0:
+                self.index_buf += ustruct.pack(INDEX_FORMAT, timestamp, self.count)
+            ustruct.pack_into(RECORD_FORMAT, self.buf, self.buf_len, timestamp, to_temp(set_temp),
+                              to_temp(wort_temp), to_temp(chamber_temp), to_gravity(gravity), flags)
+            self.buf_len += RECORD_SIZE
+            self.count += 1
+            if self.buf_len >= self.page_size:
+                self._flush()
+
+    def sample(self, process_info):
+        """
+        Append a sample of the process info
+        :param process_info: dict; a snapshot of Process
+        """
+        self.append(utime.time(), *sample_values(process_info))
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.batch is None or not self.buf_len:
+            return
+        try:
+            # the records first: an index entry never points past the end of the log
+            with open(self._filename(self.batch, 'bin'), 'ab') as f:
+                f.write(memoryview(self.buf)[:self.buf_len])
+            if self.index_buf:
+                with open(self._filename(self.batch, 'idx'), 'ab') as f:
+                    f.write(self.index_buf)
+        except OSError as e:
+            logger.warning('Failed to write the data log: ' + str(e))
+        self.buf_len = 0
+        self.index_buf = b''
+
+    def get_count(self, batch):
+        """
+        :param batch: int; start time of the batch, see get_batches()
+        :return: int; number of records of the batch, including the ones not written yet, None if there is no such batch
+        """
+        with self.lock:
+            if batch == self.batch:
+                return self.count
+        try:
+            # a record cut by a crash is left out
+            return uos.stat(self._filename(batch, 'bin'))[6] // RECORD_SIZE
+        except OSError:
+            return None
+
+    def _find_indexed(self, batch, timestamp):
+        """
+        Last indexed record logged at or before a time, by binary search in the index
+        :return: int; record number
+        """
+        record = 0
+        try:
+            filename = self._filename(batch, 'idx')
+            lo = 0
+            hi = uos.stat(filename)[6] // INDEX_SIZE
+            entry = bytearray(INDEX_SIZE)
+            with open(filename, 'rb') as f:
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    f.seek(mid * INDEX_SIZE)
+                    f.readinto(entry)
+                    indexed_time, number = ustruct.unpack(INDEX_FORMAT, entry)
+                    if indexed_time <= timestamp:
+                        record = number
+                        lo = mid + 1
+                    else:
+                        hi = mid
+        except OSError:
+            pass  # no index, read from the beginning
+        return record
+
+    def find_record(self, batch, timestamp):
+        """
+        First record logged at or after a time: a binary search in the index, then at most index_every records read
+        :return: int; record number, get_count() if there is none
+        """
+        record = self._find_indexed(batch, timestamp)
+        records = self.read_records(batch, record)
+        try:
+            for values in records:
+                if values[0] >= timestamp:
+                    break
+                record += 1
+        finally:
+            records.close()
+        return record
+
+    def read_records(self, batch, first=0, last=None):
+        """
+        Records of a batch by number, including the ones not written yet, padding records have a timestamp of 0
+        :param first, last: int; range of record numbers, last excluded, None up to the last record
+        :return: generator; tuples (timestamp, set temp, wort temp, chamber temp, gravity, flags) in fixed-point
+        """
+        with self.lock:
+            if batch == self.batch:
+                # what is on the card now, then the buffer as it is now
+                file_count = self.count - self.buf_len // RECORD_SIZE
+                pending = bytes(self.buf[:self.buf_len])
+            else:
+                file_count = None
+                pending = b''
+        if file_count is None:
+            file_count = self.get_count(batch) or 0
+        count = file_count + len(pending) // RECORD_SIZE
+        last = count if last is None else min(last, count)
+        buf = bytearray(self.page_size)
+        if first < file_count:
+            with open(self._filename(batch, 'bin'), 'rb') as f:
+                f.seek(first * RECORD_SIZE)
+                record = first
+                while record < min(last, file_count):
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    for offset in range(0, n - n % RECORD_SIZE, RECORD_SIZE):
+                        if record >= min(last, file_count):
+                            break
+                        yield ustruct.unpack_from(RECORD_FORMAT, buf, offset)
+                        record += 1
+        for record in range(max(first, file_count), last):
+            yield ustruct.unpack_from(RECORD_FORMAT, pending, (record - file_count) * RECORD_SIZE)
+
+    def read_range(self, batch, start_time=0, end_time=None):
+        """
+        Records of a batch logged in a time range, including the ones not written yet
+        :param batch: int; start time of the batch, see get_batches()
+        :param start_time, end_time: int; time range, utime.time()
+        :return: generator; tuples (timestamp, set temp, wort temp, chamber temp, gravity, flags) in fixed-point
+        """
+        first = self.find_record(batch, start_time) if start_time else 0
+        for values in self.read_records(batch, first):
+            if end_time is not None and values[0] > end_time:
+                return
+            if values[0]:
+                yield values
+
+
+class LogExport:
+    """
+    A batch, or part of it, as CSV or NDJSON text
+    Every record takes a line of the same width, so the length of the text is known without formatting it,
+    and the text can be written from any byte offset by seeking to the record at that offset:
+    an interrupted download resumes with a Range request.
+
+    Usage example:
+
+    export = LogExport(datalog, batch, 'csv')
+    for chunk in export.iter_chunks(start=0, end=export.get_length() - 1):
+        sock.write(chunk)
+    """
+    FORMATS = ('csv', 'ndjson')
+
+    def __init__(self, datalog, batch, fmt='csv', start_time=0, end_time=None):
+        """
+        :param datalog: Class; the instance of DataLog
+        :param batch: int; start time of the batch, see DataLog.get_batches()
+        :param fmt: str; 'csv' or 'ndjson'
+        :param start_time, end_time: int; time range, utime.time()
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError('Unknown format ' + str(fmt))
+        self.datalog = datalog
+        self.batch = batch
+        self.fmt = fmt
+        self.first = datalog.find_record(batch, start_time) if start_time else 0
+        if end_time is None:
+            self.last = datalog.get_count(batch) or 0
+        else:
+            self.last = datalog.find_record(batch, end_time + 1)
+        self.header = CSV_HEADER if fmt == 'csv' else b''
+        self.line_len = len(self._format((0, 0, 0, 0, 0, 0)))
+
+    def get_length(self):
+        return len(self.header) + (self.last - self.first) * self.line_len
+
+    def _format(self, values):
+        timestamp, set_temp, wort_temp, chamber_temp, gravity, flags = values
+        if self.fmt == 'csv':
+            line, missing, on, off = CSV_LINE, '', '1', '0'
+        else:
+            line, missing, on, off = NDJSON_LINE, 'null', 'true', 'false'
+        if not timestamp:
+            # padding record
+            return (line % ((missing,) * 7)).encode()
+        temps = ['%.2f' % (temp / TEMP_SCALE) if temp != NO_TEMP else missing
+                 for temp in (set_temp, wort_temp, chamber_temp)]
+        return (line % (str(timestamp + UNIX_EPOCH_OFFSET), temps[0], temps[1], temps[2],
+                        '%.4f' % (gravity / GRAVITY_SCALE) if gravity != NO_GRAVITY else missing,
+                        on if flags & FLAG_HEATING else off,
+                        on if flags & FLAG_COOLING else off)).encode()
+
+    def iter_chunks(self, start=0, end=None, chunk_size=512):
+        """
+        The text from byte start to byte end included, in chunks of at most chunk_size bytes
+        :return: generator; bytes
+        """
+        length = self.get_length()
+        end = length - 1 if end is None else min(end, length - 1)
+        buf = bytearray(chunk_size)
+        buf_len = 0
+        pos = start
+        header_len = len(self.header)
+        if pos < header_len:
+            piece = self.header[pos:end + 1]
+            buf[:len(piece)] = piece
+            buf_len = len(piece)
+            pos += len(piece)
+        if pos <= end:
+            record = self.first + (pos - header_len) // self.line_len
+            skip = (pos - header_len) % self.line_len
+            records = self.datalog.read_records(self.batch, record, self.last)
+            try:
+                for values in records:
+                    piece = self._format(values)[skip:skip + end + 1 - pos]
+                    if buf_len + len(piece) > chunk_size:
+                        yield bytes(buf[:buf_len])
+                        buf_len = 0
+                    buf[buf_len:buf_len + len(piece)] = piece
+                    buf_len += len(piece)
+                    pos += len(piece)
+                    skip = 0
+                    if pos > end:
+                        break
+            finally:
+                records.close()
+        if buf_len:
+            yield bytes(buf[:buf_len])
@@ -0,0 +1,185 @@
+import _thread
+import utime
+import ujson
+
+from logger import init_logger
+
+logger = init_logger(__name__)
+
+
+class SSESubscriber:
+    """
+    A client of the /events route, the events are written in the text/event-stream format
+    on the socket detached from the web server
+    """
+    def __init__(self, sock, send_timeout=1):
+        """
+        :param sock: socket; the connection detached from MicroWebSrv
+        :param send_timeout: int; seconds, a client not accepting the data in time is dropped
+        """
+        self.sock = sock
+        self.sock.settimeout(send_timeout)
+        # MicroPython sockets are streams, CPython sockets are not
+        self._write = getattr(sock, 'write', None) or sock.sendall
+
+    def send(self, event, json_text):
+        self._write(b'event: ' + event + b'\ndata: ' + json_text + b'\n\n')
+
+    def send_heartbeat(self):
+        # a comment line keeps the connection (and the proxies) alive, EventSource ignores it
+        self._write(b': ping\n\n')
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class WSSubscriber:
+    """
+    A client of the /ws channel, every event is sent as a {"event": ..., "data": ...} text message
+    """
+    def __init__(self, web_socket):
+        """
+        :param web_socket: Class; the instance of MicroWebSocket
+        """
+        self.ws = web_socket
+
+    def send(self, event, json_text):
+        if not self.ws.SendText(b'{"event": "' + event + b'", "data": ' + json_text + b'}'):
+            raise OSError('WebSocket closed')
+
+    def send_heartbeat(self):
+        if not self.ws.SendPing():
+            raise OSError('WebSocket closed')
+
+    def close(self):
+        self.ws.Close()
+
+
+class EventHub:
+    """
+    Pushes the live state of the fermenter to the subscribed clients
+    A client first gets the whole state as a 'state' event, then only the changed keys as 'delta' events,
+    with heartbeats in between when nothing changes.
+    publish() only flags a change, the events are sent by a thread of the hub, so a slow client never
+    delays the caller, eg. the timer callback of the sensors.
+
+    Usage example:
+
+    hub = EventHub(process.get_live_state)
+    hub.subscribe(SSESubscriber(sock))  # or WSSubscriber(web_socket)
+    hub.publish()  # called periodically, eg. after each temperature conversion
+    """
+    def __init__(self, state_func, max_subscribers=4, heartbeat_ms=15000):
+        """
+        :param state_func: callable; returns the current state as a flat dict
+        :param max_subscribers: int; every subscriber holds a socket open
+        :param heartbeat_ms: int; idle time after which a heartbeat is sent
+        """
+        self.state_func = state_func
+        self.max_subscribers = max_subscribers
+        self.heartbeat_ms = heartbeat_ms
+        self.subscribers = []
+        self.state = None
+        self.last_send = utime.ticks_ms()
+        self.lock = _thread.allocate_lock()
+        # held until publish() wakes up the sender thread
+        self.wake = _thread.allocate_lock()
+        self.wake.acquire()
+        self.pending = False
+        _thread.start_new_thread(self._sender, ())
+
+    def is_full(self):
+        return len(self.subscribers) >= self.max_subscribers
+
+    def subscribe(self, subscriber):
+        """
+        :param subscriber: object; has send(event, json_text), send_heartbeat() and close()
+        :return: bool; False if there is no room for another subscriber
+        """
+        with self.lock:
+            if self.is_full():
+                return False
+            try:
+                if self.state is None:
+                    self.state = self.state_func()
+                subscriber.send(b'state', ujson.dumps(self.state).encode())
+            except Exception:
+                subscriber.close()
+                return False
+            self.subscribers.append(subscriber)
+        logger.debug('Event subscriber added, %d connected.' % len(self.subscribers))
+        return True
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self._remove(subscriber)
+
+    def _remove(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+            subscriber.close()
+            logger.debug('Event subscriber removed, %d connected.' % len(self.subscribers))
+
+    def _diff(self, new_state):
+        if self.state is None:
+            return new_state
+        return {key: value for key, value in new_state.items() if self.state.get(key) != value}
+
+    def publish(self):
+        """
+        Have the changes pushed to all subscribers, returns at once
+        """
+        if not self.subscribers:
+            self.state = None
+            return
+        self.pending = True
+        try:
+            self.wake.release()
+        except RuntimeError:
+            pass  # the sender is awake already, it checks pending again before sleeping
+
+    def _sender(self):
+        while True:
+            self.wake.acquire()
+            while self.pending:
+                self.pending = False
+                try:
+                    self._send_changes()
+                except Exception as e:
+                    logger.exception(e, 'Failed to send the events.')
+
+    def _send_changes(self):
+        """
+        Compare the current state with the last one and push the changes to all subscribers
+        The state is only read when somebody listens.
+        """
+        if not self.subscribers:
+            self.state = None
+            return
+        with self.lock:
+            try:
+                new_state = self.state_func()
+            except Exception as e:
+                logger.exception(e, 'Failed to read the live state.')
+                return
+            delta = self._diff(new_state)
+            self.state = new_state
+            if delta:
+                payload = ujson.dumps(delta).encode()
+            elif utime.ticks_diff(utime.ticks_ms(), self.last_send) < self.heartbeat_ms:
+                return
+            else:
+                payload = None
+            for subscriber in self.subscribers[:]:
+                try:
+                    if payload is None:
+                        subscriber.send_heartbeat()
+                    else:
+                        subscriber.send(b'delta', payload)
+                except Exception:
+                    # the client has gone away or is too slow to keep up
+                    self._remove(subscriber)
+            self.last_send = utime.ticks_ms()
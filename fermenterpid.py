@@ -10,6 +10,14 @@ class FermenterPID:
         self.integration = 0
         self.last_output = 0
 
+    def set_gains(self, kp, ki, kd):
+        """
+        Change the gains while running, eg. after the settings have been updated
+        """
+        self.k_p = self.k_p_backup = float(kp)
+        self.k_i = self.k_i_backup = float(ki)
+        self.k_d = self.k_d_backup = float(kd)
+
     def update(self, temp, setpoint):
         """
         temp: float; real-time temperature measured by ds18 sensor
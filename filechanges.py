@@ -0,0 +1,24 @@
+"""
+Functions called with the absolute path of a file changed on the device, eg. by an FTP client,
+to refresh what has been cached about it
+Unlike uftpd, which starts the FTP server once imported, this module can be imported at any time.
+
+Usage example:
+
+filechanges.subscribe(web_server.InvalidateStaticCache)
+filechanges.notify('/sd/www/index.html')  # called by uftpd
+"""
+callbacks = []
+
+
+def subscribe(callback):
+    """
+    :param callback: callable; called with the path of every changed file
+    """
+    if callback not in callbacks:
+        callbacks.append(callback)
+
+
+def notify(path):
+    for callback in callbacks:
+        callback(path)
@@ -1,11 +1,35 @@
 from microWebSrv import MicroWebSrv
+from datalog import LogExport, UNIX_EPOCH_OFFSET
+from lttb import downsample
+from telemetry import TEMP_SCALE, GRAVITY_SCALE
+from eventhub import SSESubscriber, WSSubscriber
+from settings import SettingsConflict
+import filechanges
+import gc
 import machine
 import ujson
+import utime
 
 
 class HttpServer:
-    def __init__(self, process_obj, wifi_obj, rtc_obj, user_settings_dict):
+    def __init__(self, process_obj, wifi_obj, rtc_obj, user_settings_dict, engine='threaded', event_hub=None,
+                 workers=2, queue_len=4, telemetry=None, datalog=None):
+        """
+        :param engine: str; 'threaded' for the classic MicroWebSrv accept thread,
+                            'async' for the uasyncio engine serving clients concurrently
+        :param event_hub: Class; the instance of EventHub serving /events, None disables the route
+        :param workers: int; threads serving the requests with the threaded engine, 0 serves them in the accept thread
+        :param queue_len: int; connections waiting for a worker, the next ones get a 503
+        :param telemetry: Class; the instance of Telemetry serving /history, None disables the route
+        :param datalog: Class; the instance of DataLog serving /export, None disables the route
+        """
         self.process = process_obj
+        self.events = event_hub
+        self.telemetry = telemetry
+        self.datalog = datalog
+        self.workers = workers
+        self.queue_len = queue_len
+        self.engine = engine
         self.wifi = wifi_obj
         self.rtc = rtc_obj
         self.settings = user_settings_dict
@@ -21,8 +45,19 @@ class HttpServer:
         wifi = self.wifi
         rtc = self.rtc
         settings = self.settings
+        events = self.events
+        telemetry = self.telemetry
+        datalog = self.datalog
         this = self
 
+        def push_events():
+            """
+            推送状态变化，不必等待下一次温度测量
+            """
+            process.refresh_snapshot(read_sensors=False)
+            if events:
+                events.publish()
+
         @MicroWebSrv.route('/connecttest')
         def test_get(httpClient, httpResponse):
             """
@@ -69,11 +104,15 @@ class HttpServer:
                 process.set_beer_name(beerName)
                 process.load_steps(fermentationSteps)
                 process.start()
+            except ValueError as e:
+                # invalid steps, see Schedule
+                httpResponse.WriteResponseJSONError(400, obj={'error': str(e)})
             except:
                 # throw 500 error code
                 httpResponse.WriteResponseInternalServerError()
             else:
                 httpResponse.WriteResponseOk()
+                push_events()
 
         @MicroWebSrv.route('/abort')
         def abort_get(httpClient, httpResponse):
@@ -84,17 +123,19 @@ class HttpServer:
                 httpResponse.WriteResponseInternalServerError()
             else:
                 httpResponse.WriteResponseOk()
+                push_events()
 
         @MicroWebSrv.route('/settings')
         def settings_get(httpClient, httpResponse):
             """
             从后台读取设置参数
+            WIFI热点列表取自缓存，?refresh=1时在后台重新扫描
             """
-            wifi_list = wifi.scan_wifi_list()
-            temp_sensor_list = process.fermenter_temp_ctrl.chamber_sensor.ds_obj.get_device_list()
-            # open user_settings.json and read settings
-            with open('user_settings.json', 'r') as f:
-                settings_dict = ujson.load(f)
+            refresh = httpClient.GetRequestQueryParams().get('refresh') == '1'
+            wifi_list = wifi.get_cached_wifi_list(refresh=refresh)
+            temp_sensors = process.fermenter_temp_ctrl.chamber_sensor.ds_obj
+            temp_sensor_list = temp_sensors.get_device_list()
+            settings_dict = settings.get_all()
             wort_sensor_dev_num = settings_dict.get('wortSensorDev')
             chamber_sensor_dev_num = settings_dict.get('chamberSensorDev')
             wort_sensor_rom_code = ''
@@ -116,11 +157,19 @@ class HttpServer:
             }
             settings_added = {
                 'wifiList': wifi_list,
+                'scanAgeMs': wifi.get_scan_age_ms(),
+                'isScanning': wifi.is_scanning,
                 'wortSensorDev': wort_sensor_dev,
                 'chamberSensorDev': chamber_sensor_dev,
-                'tempSensorList': temp_sensor_list
+                'tempSensorList': temp_sensor_list,
+                'tempSensorGeneration': temp_sensors.generation,
+                'tempSensorScanAgeMs': temp_sensors.get_scan_age_ms(),
+                # 最慢的传感器决定转换时间和最高采样率
+                'tempConversionMs': temp_sensors.conversion_ms,
+                'tempSampleIntervalMs': temp_sensors.interval_ms,
+                'tempMaxSampleRate': temp_sensors.get_max_sample_rate()
             }
-            settings_combined = settings_dict.copy()
+            settings_combined = settings_dict
             settings_combined.update(settings_added)
             # settings_json = ujson.dumps(settings_combined)
             httpResponse.WriteResponseJSONOk(obj=settings_combined, headers=None)
@@ -134,20 +183,28 @@ class HttpServer:
         @MicroWebSrv.route('/settings', 'POST')
         def settings_post(httpClient, httpResponse):
             """
-            向后台保存设置参数，并且重启ESP32
+            向后台保存设置参数，PID、温感编号和MQTT设置立即生效，其他设置（WIFI等）需要重启ESP32
+            带上GET得到的version时，若设置已被修改则返回409
             """
-            # json = httpClient.ReadRequestContentAsJSON()
-            # settings_dict = ujson.loads(json)
             settings_dict = httpClient.ReadRequestContentAsJSON()
-            settings_dict['wortSensorDev'] = settings_dict['wortSensorDev']['value']
-            settings_dict['chamberSensorDev'] = settings_dict['chamberSensorDev']['value']
             try:
-                with open('user_settings.json', 'w') as f:
-                    ujson.dump(settings_dict, f)
+                for key in ('wortSensorDev', 'chamberSensorDev'):
+                    if isinstance(settings_dict.get(key), dict):
+                        settings_dict[key] = settings_dict[key].get('value')
+                changed = settings.update(settings_dict, version=settings_dict.get('version'))
+            except SettingsConflict as e:
+                httpResponse.WriteResponseJSONError(409, obj={'error': str(e), 'version': settings.version})
+            except (ValueError, TypeError, AttributeError) as e:
+                httpResponse.WriteResponseJSONError(400, obj={'error': str(e)})
             except:
                 httpResponse.WriteResponseInternalServerError()
             else:
-                httpResponse.WriteResponseOk()
+                result = {
+                    'version': settings.version,
+                    'changed': changed,
+                    'rebootRequired': settings.needs_reboot(changed)
+                }
+                httpResponse.WriteResponseJSONOk(obj=result, headers=None)
 
         @MicroWebSrv.route('/reboot')
         def reboot_get(httpClient, httpResponse):
@@ -163,9 +220,15 @@ class HttpServer:
         def wifi_get(httpClient, httpResponse):
             """
             获取WIFI热点列表，用于刷新热点列表
+            列表取自缓存，?refresh=1时在后台重新扫描，前端可在isScanning为false后再次读取
             """
-            wifi_list = wifi.scan_wifi_list()
-            wifi_dict = {'wifiList': wifi_list}
+            refresh = httpClient.GetRequestQueryParams().get('refresh') == '1'
+            wifi_list = wifi.get_cached_wifi_list(refresh=refresh)
+            wifi_dict = {
+                'wifiList': wifi_list,
+                'scanAgeMs': wifi.get_scan_age_ms(),
+                'isScanning': wifi.is_scanning
+            }
             httpResponse.WriteResponseJSONOk(obj=wifi_dict, headers=None)
 
         @MicroWebSrv.route('/wifi', 'POST')
@@ -218,11 +281,10 @@ class HttpServer:
             Send test message to MQTT server
             """
             settings_dict = httpClient.ReadRequestContentAsJSON()
-            test_msg = ujson.dumps({'test-message': 200})
             from mqtt_client import MQTT
             try:
                 test_mqtt = MQTT(settings_dict)
-                test_mqtt.publish(test_msg)
+                test_mqtt.publish_json({'test-message': 200})
             except:
                 httpResponse.WriteResponseInternalServerError()
             else:
@@ -234,32 +296,13 @@ class HttpServer:
             手动控制制冷压缩机或制热器，主要用于测试
             """
             actuactor_dict = httpClient.ReadRequestContentAsJSON()
-            heater = process.fermenter_temp_ctrl.heater
-            cooler = process.fermenter_temp_ctrl.cooler
-            led = process.fermenter_temp_ctrl.led
             try:
-                if actuactor_dict.get('element') == 'heater':
-                    element = heater
-                else:
-                    element = cooler
-                action = actuactor_dict.get('action')
-                if action:
-                    element.force_on()
-                else:
-                    element.force_off()
-                if heater.is_on() and not cooler.is_on():
-                    led_color = 'red'
-                elif not heater.is_on() and cooler.is_on():
-                    led_color = 'blue'
-                elif not heater.is_on() and not cooler.is_on():
-                    led_color = 'green'
-                else:
-                    led_color = 'orange'
-                led.set_color(led_color)
+                process.fermenter_temp_ctrl.force_actuator(actuactor_dict.get('element'), actuactor_dict.get('action'))
             except:
                 httpResponse.WriteResponseInternalServerError()
             else:
                 httpResponse.WriteResponseOk()
+                push_events()
 
         @MicroWebSrv.route('/tempsensors', 'POST')
         def temp_post(httpClient, httpResponse):
@@ -277,7 +320,7 @@ class HttpServer:
             wort_sensor.update_romcode(new_wort_romcode)
             chamber_sensor.update_romcode(new_chamber_romcode)
             try:
-                # 测量温度
+                # 最近一次测量的温度，不访问OneWire总线，已连接的新设备同样有读数
                 wort_temp = wort_sensor.read_temp()
                 chamber_temp = chamber_sensor.read_temp()
             except:
@@ -286,7 +329,10 @@ class HttpServer:
             else:
                 temp_dict = {
                     'wortTemp': wort_temp,
-                    'chamberTemp': chamber_temp
+                    'chamberTemp': chamber_temp,
+                    # 读数距今的毫秒数
+                    'wortTempAgeMs': wort_sensor.get_age_ms(),
+                    'chamberTempAgeMs': chamber_sensor.get_age_ms()
                 }
                 httpResponse.WriteResponseJSONOk(obj=temp_dict, headers=None)
 
@@ -295,9 +341,53 @@ class HttpServer:
             hydrometer_dict = httpClient.ReadRequestContentAsJSON()
             process.save_hydrometer_data(hydrometer_dict)
             httpResponse.WriteResponseOk()
+            push_events()
+
+        @MicroWebSrv.route('/events')
+        def events_get(httpClient, httpResponse):
+            """
+            Server-Sent Events: 保持连接，状态有变化时推送，取代前端的定时轮询
+            """
+            if events is None or events.is_full():
+                httpResponse.WriteResponseError(503, headers={'Retry-After': 30})
+                return
+            sock = httpClient.DetachSocket()
+            if sock is None:
+                # the async engine can't hand the connection over, keep polling
+                httpResponse.WriteResponseError(503, headers={'Retry-After': 30})
+                return
+            httpResponse.WriteResponseEventStream()
+            events.subscribe(SSESubscriber(sock))
 
         @MicroWebSrv.route('/chart')
         def chart_get(httpClient, httpResponse):
+            """
+            /chart?from=<时间>&to=<时间>&points=<n>: 从SD卡读取整个批次的记录，用LTTB算法降采样为每条曲线最多n个点，
+            保留制冷过冲等峰值；不带参数时返回最新的一组数据
+            from/to和返回的time均为Unix时间（秒）
+            """
+            params = httpClient.GetRequestQueryParams()
+            if datalog and ('from' in params or 'to' in params or 'points' in params):
+                batches = datalog.get_batches()
+                try:
+                    batch = int(params['batch']) if 'batch' in params else (batches[-1] if batches else None)
+                    start_time = int(params['from']) - UNIX_EPOCH_OFFSET if 'from' in params else 0
+                    end_time = int(params['to']) - UNIX_EPOCH_OFFSET if 'to' in params else None
+                    points = max(3, min(int(params.get('points', 300)), 500))
+                except ValueError:
+                    httpResponse.WriteResponseJSONError(400, obj={'error': 'parameters must be integers'})
+                    return
+                if batch not in batches:
+                    httpResponse.WriteResponseNotFound()
+                    return
+                first = datalog.find_record(batch, max(start_time, 0)) if start_time > 0 else 0
+                last = datalog.get_count(batch) if end_time is None else datalog.find_record(batch, end_time + 1)
+                chart = downsample(datalog, batch, first, last, points)
+                chart['batch'] = batch
+                chart['tempScale'] = TEMP_SCALE
+                chart['gravityScale'] = GRAVITY_SCALE
+                httpResponse.WriteResponseJSONOk(obj=chart, headers=None)
+                return
             data = {
                 'timeMark': this.time_mark,
                 'setTemp': this.set_temp,
@@ -307,8 +397,171 @@ class HttpServer:
             }
             httpResponse.WriteResponseJSONOk(obj=data, headers=None)
 
+        @MicroWebSrv.route('/history')
+        def history_get(httpClient, httpResponse):
+            """
+            设备内存中的历史数据，按时间范围from~to和数据点数points选择1分钟/15分钟/1小时汇总数据，
+            /history?tier=<秒>&since=<seq>只返回seq之后的新数据，前端重新连接后一次补齐
+            from/to和返回的time/now均为Unix时间（秒），与/chart、/export相同
+            """
+            if not telemetry:
+                httpResponse.WriteResponseNotFound()
+                return
+            params = httpClient.GetRequestQueryParams()
+            try:
+                since = int(params.get('since', 0))
+                points = min(int(params.get('points', 200)), 300)
+                # Unix time to the time of the device
+                start_time = max(int(params['from']) - UNIX_EPOCH_OFFSET, 0) if 'from' in params else None
+                end_time = int(params['to']) - UNIX_EPOCH_OFFSET if 'to' in params else None
+                period = int(params['tier']) if 'tier' in params else None
+            except ValueError:
+                httpResponse.WriteResponseJSONError(400, obj={'error': 'parameters must be integers'})
+                return
+            if 'since' in params and period is None:
+                # since is a sequence number of one tier only
+                httpResponse.WriteResponseJSONError(400, obj={'error': 'since requires tier'})
+                return
+            if period is not None:
+                tier = telemetry.get_tier(period)
+                if tier is None:
+                    httpResponse.WriteResponseJSONError(400, obj={'error': 'unknown tier'})
+                    return
+            else:
+                if start_time is None:
+                    # the whole batch
+                    start_time = telemetry.get_oldest_time() or 0
+                tier = telemetry.select_tier((end_time or utime.time()) - start_time, points)
+            history = telemetry.get_history(tier, since, start_time or 0, end_time, points)
+            history['now'] += UNIX_EPOCH_OFFSET
+            history['time'] = [timestamp + UNIX_EPOCH_OFFSET for timestamp in history['time']]
+            httpResponse.WriteResponseJSONOk(obj=history, headers=None)
+
+        def parse_range(range_header, length):
+            """
+            解析Range请求头，只支持单个范围：bytes=a-b、bytes=a-、bytes=-n
+            :return: tuple; 第一个和最后一个字节的位置，无法满足时抛出ValueError
+            """
+            unit, _, byte_range = range_header.partition('=')
+            if unit.strip() != 'bytes' or ',' in byte_range:
+                raise ValueError('Unsupported range')
+            first, _, last = byte_range.strip().partition('-')
+            if first:
+                start = int(first)
+                end = int(last) if last else length - 1
+            else:
+                start = length - int(last)
+                end = length - 1
+            if start < 0 or start > end or start >= length:
+                raise ValueError('Unsatisfiable range')
+            return start, min(end, length - 1)
+
+        @MicroWebSrv.route('/export')
+        def export_get(httpClient, httpResponse):
+            """
+            从SD卡流式导出一个批次的全部记录，/export?batch=<id>&format=csv|ndjson&from=<时间>&to=<时间>，
+            内存占用固定，支持Range请求断点续传
+            from/to和导出的time均为Unix时间（秒）
+            """
+            if not datalog:
+                httpResponse.WriteResponseNotFound()
+                return
+            params = httpClient.GetRequestQueryParams()
+            batches = datalog.get_batches()
+            fmt = params.get('format', 'csv')
+            try:
+                batch = int(params['batch']) if 'batch' in params else (batches[-1] if batches else None)
+                # the export is in Unix time
+                start_time = int(params['from']) - UNIX_EPOCH_OFFSET if 'from' in params else 0
+                end_time = int(params['to']) - UNIX_EPOCH_OFFSET if 'to' in params else None
+                if batch not in batches:
+                    httpResponse.WriteResponseNotFound()
+                    return
+                export = LogExport(datalog, batch, fmt, max(start_time, 0), end_time)
+            except ValueError as e:
+                httpResponse.WriteResponseJSONError(400, obj={'error': str(e)})
+                return
+            length = export.get_length()
+            headers = {
+                'Accept-Ranges': 'bytes',
+                'Content-Disposition': 'attachment; filename="%d.%s"' % (batch, fmt)
+            }
+            start, end = 0, length - 1
+            code = 200
+            range_header = httpClient.GetRequestHeaders().get('range')
+            if range_header:
+                try:
+                    start, end = parse_range(range_header, length)
+                except ValueError:
+                    httpResponse.WriteResponseError(416, headers={'Content-Range': 'bytes */%d' % length})
+                    return
+                code = 206
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, length)
+            content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+            chunks = export.iter_chunks(start, end) if length else ()
+            httpResponse.WriteResponseChunkedIter(code, headers, content_type, 'UTF-8', chunks)
+
+        @MicroWebSrv.route('/stats')
+        def stats_get(httpClient, httpResponse):
+            """
+            Web服务器负载统计，用于诊断
+            """
+            stats = {
+                'http': this.app.GetWorkersStats(),
+                'webSockets': this.app.GetWebSocketsStats(),
+                'eventSubscribers': len(events.subscribers) if events else 0,
+                'memFree': gc.mem_free()
+            }
+            httpResponse.WriteResponseJSONOk(obj=stats, headers=None)
+
+        def ws_command(web_socket, msg):
+            """
+            执行WebSocket发来的控制命令，并回复执行结果
+            """
+            cmd = None
+            try:
+                command = ujson.loads(msg)
+                cmd = command.get('cmd')
+                if cmd == 'abort':
+                    process.abort()
+                elif cmd == 'actuator':
+                    process.fermenter_temp_ctrl.force_actuator(command.get('element'), command.get('action'))
+                elif cmd == 'setTemp':
+                    process.set_target_temp(command.get('temp'))
+                else:
+                    raise ValueError('Unknown command')
+            except Exception:
+                ok = False
+            else:
+                ok = True
+            web_socket.SendText(ujson.dumps({'event': 'ack', 'data': {'cmd': cmd, 'ok': ok}}))
+            if ok:
+                push_events()
+
+        def ws_accept(web_socket, httpClient):
+            """
+            /ws: 推送状态变化，同时接收控制命令
+            """
+            if httpClient.GetRequestPath() != '/ws':
+                web_socket.Close()
+                return
+            web_socket.RecvTextCallback = ws_command
+            if events:
+                subscriber = WSSubscriber(web_socket)
+                web_socket.ClosedCallback = lambda ws: events.unsubscribe(subscriber)
+                events.subscribe(subscriber)
+
         # Initialize the Web server
-        self.app = MicroWebSrv(webPath='/sd/www')
+        if self.engine == 'async':
+            from microWebSrvAsync import MicroWebSrvAsync
+            self.app = MicroWebSrvAsync(webPath='/sd/www')
+        else:
+            self.app = MicroWebSrv(webPath='/sd/www')
+        self.app.AcceptWebSocketCallback = ws_accept
+        # files uploaded over FTP must not be served from stale cached metadata, however the FTP server is started
+        filechanges.subscribe(self.app.InvalidateStaticCache)
+        self.app.WorkersCount = self.workers
+        self.app.AcceptQueueMaxLen = self.queue_len
         self.app.Start(threaded=True)  # Starts the server
 
     def stop(self):
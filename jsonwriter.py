@@ -0,0 +1,102 @@
+try:
+    import ujson
+except ImportError:
+    import json as ujson
+
+
+class JSONWriter:
+    """
+    Streaming JSON encoder
+    Dicts, lists and scalars are serialised incrementally into a small fixed buffer,
+    which is handed to the write function each time it is full, so the whole JSON text
+    never exists in RAM.
+
+    Usage example:
+
+    with open('recovery.json', 'wb') as f:
+        JSONWriter(f.write).dump(process_info).flush()
+    """
+    def __init__(self, write_func, buf_size=256):
+        """
+        :param write_func: callable; receives the encoded bytes, None only counts them
+        :param buf_size: int; size of the encoding buffer in bytes
+        """
+        self.write_func = write_func
+        self.buf = bytearray(buf_size)
+        self.pos = 0
+        self.written = 0
+
+    @staticmethod
+    def measure(obj):
+        """
+        Length of the JSON text of obj, computed without building it
+        :return: int; length in bytes
+        """
+        writer = JSONWriter(None, 64)
+        writer.dump(obj)
+        return writer.written + writer.pos
+
+    def get_buffered(self):
+        """
+        :return: memoryview; the encoded bytes not flushed yet
+        """
+        return memoryview(self.buf)[:self.pos]
+
+    def flush(self):
+        if self.pos:
+            if self.write_func:
+                self.write_func(memoryview(self.buf)[:self.pos])
+            self.written += self.pos
+            self.pos = 0
+        return self
+
+    def write(self, data):
+        if type(data) is str:
+            data = data.encode()
+        size = len(data)
+        if self.pos + size > len(self.buf):
+            self.flush()
+            if size > len(self.buf):
+                # longer than the whole buffer, eg. a long string
+                if self.write_func:
+                    self.write_func(data)
+                self.written += size
+                return
+        self.buf[self.pos:self.pos + size] = data
+        self.pos += size
+
+    def dump(self, obj):
+        """
+        Serialise obj into the buffer, call flush() to hand over the rest of it
+        :return: self
+        """
+        if obj is None:
+            self.write(b'null')
+        elif obj is True:
+            self.write(b'true')
+        elif obj is False:
+            self.write(b'false')
+        elif isinstance(obj, dict):
+            self.write(b'{')
+            first = True
+            for key in obj:
+                if not first:
+                    self.write(b',')
+                first = False
+                self.write(ujson.dumps(key if isinstance(key, str) else str(key)))
+                self.write(b':')
+                self.dump(obj[key])
+            self.write(b'}')
+        elif isinstance(obj, (list, tuple)):
+            self.write(b'[')
+            first = True
+            for item in obj:
+                if not first:
+                    self.write(b',')
+                first = False
+                self.dump(item)
+            self.write(b']')
+        else:
+            # str, int and float: ujson takes care of escaping & number formats
+            self.write(ujson.dumps(obj))
+        return self
@@ -0,0 +1,155 @@
+from datalog import UNIX_EPOCH_OFFSET
+from telemetry import NO_TEMP, NO_GRAVITY
+
+# name, field of the log record & value of a missing reading
+SERIES = (
+    ('setTemp', 1, NO_TEMP),
+    ('wortTemp', 2, NO_TEMP),
+    ('chamberTemp', 3, NO_TEMP),
+    ('gravity', 4, NO_GRAVITY)
+)
+
+
+def _bucket(x, count, points):
+    # the first and the last records have a bucket of their own, the others are shared evenly
+    if x == 0:
+        return 0
+    if x == count - 1:
+        return points - 1
+    return (x * (points - 2) + count - 3) // (count - 2)
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+class _Bucket:
+    """
+    The points of a series in a bucket, reduced to their convex hull: the area of a triangle is the absolute
+    value of a linear function of the point, so the largest one is always made by a vertex of the hull.
+    Points come in x order, the upper & lower hulls are built as they come (monotone chain).
+    """
+    def __init__(self):
+        self.upper = []
+        self.lower = []
+        self.sum_x = 0
+        self.sum_v = 0
+        self.count = 0
+
+    def add(self, point):
+        """
+        :param point: tuple; x, value & timestamp
+        """
+        upper = self.upper
+        while len(upper) > 1 and _cross(upper[-2], upper[-1], point) >= 0:
+            upper.pop()
+        upper.append(point)
+        lower = self.lower
+        while len(lower) > 1 and _cross(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+        self.sum_x += point[0]
+        self.sum_v += point[1]
+        self.count += 1
+
+    def average(self):
+        return self.sum_x / self.count, self.sum_v / self.count
+
+    def candidates(self):
+        # vertices of the hull in x order, the first & the last ones are in both hulls
+        upper = self.upper
+        lower = self.lower
+        i = j = 0
+        while i < len(upper) or j < len(lower):
+            if j == len(lower) or (i < len(upper) and upper[i][0] < lower[j][0]):
+                yield upper[i]
+                i += 1
+            else:
+                if i < len(upper) and upper[i][0] == lower[j][0]:
+                    i += 1
+                yield lower[j]
+                j += 1
+
+    def pick(self, previous, following):
+        """
+        :param previous: tuple; the point picked in the previous bucket, None for the first one of the series
+        :param following: _Bucket; the next bucket having some points, None for the last one of the series
+        :return: tuple; the point making the largest triangle, the first point of the series or its last one
+        """
+        if previous is None:
+            return self.lower[0]
+        if following is None:
+            return self.lower[-1]
+        cx, cv = following.average()
+        ax, av = previous[0], previous[1]
+        best = None
+        best_area = -1
+        for point in self.candidates():
+            area = abs((ax - cx) * (point[1] - av) - (ax - point[0]) * (cv - av))
+            if area > best_area:
+                best = point
+                best_area = area
+        return best
+
+
+def downsample(datalog, batch, first, last, points=300):
+    """
+    Largest-Triangle-Three-Buckets downsampling of every series of a batch log, the peaks are kept
+    The records are read once from the SD card, with a one bucket lookahead: the point of a bucket is picked
+    when the next bucket having some values is complete, from the point picked in the previous bucket and the
+    average of the next one. Only the convex hulls of these two buckets are kept in RAM.
+    Records are evenly spaced in time, their number is used as the x axis.
+    :param datalog: Class; the instance of DataLog
+    :param batch: int; start time of the batch, see DataLog.get_batches()
+    :param first, last: int; range of record numbers, last excluded, see DataLog.find_record()
+    :param points: int; max number of points per series, at least 3
+    :return: dict; {series: {'time': [Unix time, ...], 'value': [fixed-point value, ...]}}
+    """
+    count = last - first
+    chart = {name: {'time': [], 'value': []} for name, _, _ in SERIES}
+    if count <= 0:
+        return chart
+    points = count if count <= points else max(points, 3)
+    # per series: the point picked last, the bucket waiting for its lookahead & the bucket being filled
+    previous = [None] * len(SERIES)
+    pending = [None] * len(SERIES)
+    current = [None] * len(SERIES)
+    bucket = 0
+    for x, values in enumerate(datalog.read_records(batch, first, last)):
+        b = _bucket(x, count, points)
+        if b != bucket:
+            for s in range(len(SERIES)):
+                _close(chart, s, previous, pending, current)
+            bucket = b
+        if not values[0]:
+            continue  # padding record
+        for s, (_, field, missing) in enumerate(SERIES):
+            v = values[field]
+            if v == missing:
+                continue
+            if current[s] is None:
+                current[s] = _Bucket()
+            current[s].add((x, v, values[0]))
+    for s in range(len(SERIES)):
+        _close(chart, s, previous, pending, current)
+        if pending[s] is not None:
+            _emit(chart, s, previous, pending[s].pick(previous[s], None))
+    return chart
+
+
+def _close(chart, s, previous, pending, current):
+    # the bucket being filled becomes the lookahead of the pending one, buckets without values are skipped
+    if current[s] is None:
+        return
+    if pending[s] is not None:
+        _emit(chart, s, previous, pending[s].pick(previous[s], current[s]))
+    pending[s] = current[s]
+    current[s] = None
+
+
+def _emit(chart, s, previous, point):
+    x, v, timestamp = point
+    series = chart[SERIES[s][0]]
+    series['time'].append(timestamp + UNIX_EPOCH_OFFSET)
+    series['value'].append(v)
+    previous[s] = (x, v)
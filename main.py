@@ -36,6 +36,8 @@ else:
 from actuator import Actuator
 from controltemp import FermenterTempControl
 from crash_recovery import CrashRecovery
+from datalog import DataLog
+from eventhub import EventHub
 from fermenterpid import FermenterPID
 from httpserver import HttpServer
 from led import RgbLed
@@ -44,6 +46,8 @@ from microDNSSrv import MicroDNSSrv
 from mqtt_client import MQTT
 from process import Process
 from rtc import RealTimeClock
+from settings import Settings
+from telemetry import Telemetry
 from tempsensor import Ds18Sensors, SingleTempSensor
 from wifi import WiFi
 
@@ -58,9 +62,7 @@ with open('hardware_config.json', 'r') as f:
 config = ujson.loads(json)
 
 logger.debug('Loading user settings...')
-with open('user_settings.json', 'r') as f:
-    json = f.read()
-settings = ujson.loads(json)
+settings = Settings('user_settings.json')
 
 OW_PIN = config['onewire_pin']
 COOLER_PIN = config['cooler_pin']
@@ -72,6 +74,10 @@ SSD1306_SCL_PIN = config['ssd1306_pins']['scl_pin']
 SSD1306_SDA_PIN = config['ssd1306_pins']['sda_pin']
 COOLER_INTERVAL = config['cooler_interval']
 HEATER_INTERVAL = config['heater_interval']
+HTTP_ENGINE = config.get('http_engine', 'threaded')
+HTTP_WORKERS = config.get('http_workers', 2)
+HTTP_QUEUE_LEN = config.get('http_queue_len', 4)
+HISTORY_TIERS = config.get('history_tiers', [[60, 120], [900, 96], [3600, 504]])
 
 # initialize the LED
 logger.debug('Initializing RgbLED...')
@@ -81,11 +87,11 @@ led.set_color('magenta')  # LED初始化后设置为粉色
 # initialize onewire devices
 logger.debug('Initializing DS18B20 sensors...')
 temp_sensors = Ds18Sensors(pin=OW_PIN)
-utime.sleep(1)
 # initialize ds18 sensors
-wort_sensor = SingleTempSensor(temp_sensors, settings['wortSensorDev'])
-utime.sleep(1)
-chamber_sensor = SingleTempSensor(temp_sensors, settings['chamberSensorDev'])
+wort_sensor = SingleTempSensor(temp_sensors, settings['wortSensorDev'],
+                               resolution=settings.get('wortSensorResolution'))
+chamber_sensor = SingleTempSensor(temp_sensors, settings['chamberSensorDev'],
+                                  resolution=settings.get('chamberSensorResolution'))
 
 # initialize the actuators
 logger.debug('Initializing Cooler...')
@@ -99,6 +105,13 @@ heater = Actuator(pin=HEATER_PIN,
 logger.debug('Initializing PID controller...')
 pid = FermenterPID(kp=settings['pid']['kp'], ki=settings['pid']['ki'], kd=settings['pid']['kd'])
 
+# apply the updated settings without rebooting
+settings.subscribe('pid', lambda pid_settings: pid.set_gains(pid_settings['kp'], pid_settings['ki'], pid_settings['kd']))
+settings.subscribe('wortSensorDev', wort_sensor.update_romcode)
+settings.subscribe('chamberSensorDev', chamber_sensor.update_romcode)
+settings.subscribe('wortSensorResolution', wort_sensor.set_resolution)
+settings.subscribe('chamberSensorResolution', chamber_sensor.set_resolution)
+
 # create a fermenter temp control instance
 logger.debug('Initializing temperature control logic...')
 fermenter_temp_ctrl = FermenterTempControl(cooler, heater, wort_sensor, chamber_sensor, pid, led)
@@ -111,22 +124,30 @@ logger.debug('Initializing crash recovery mechanism...')
 recovery = CrashRecovery()
 
 
-def measure_realtime_temps():
+# created once the process is initialized
+main_process = None
+# pushes the live state to the /events clients
+event_hub = None
+
+
+def publish_temps():
     """
-    Measure wort temp & chamber temp in realtime
-    This is a callback function which is called by a timer
+    Called by the sensor scheduler after every measurement of wort temp & chamber temp
     """
-    while True:
-        # get realtime temperature from sensors
-        temp_sensors.get_realtime_temp()
-        # update temperature readings every 2s
-        utime.sleep_ms(2000)
+    # take the new readings once for all the readers of the process info,
+    # the changes are pushed by the thread of the event hub, not from this timer callback
+    if main_process:
+        main_process.refresh_snapshot()
+    if event_hub:
+        event_hub.publish()
+
 
+# measure the temperatures every 2s, in the background of a timer
+temp_sensors.start(machine.Timer(2), interval_ms=2000, on_update=publish_temps)
 
-# run measure temp function in a new thread
+# stack of the web server threads
 logger.debug('Allocating stack for thread task...')
 _thread.stack_size(7 * 1024)
-temp_th = _thread.start_new_thread(measure_realtime_temps, ())
 
 logger.debug('Initializing RTC...')
 rtc = RealTimeClock(tz=8, update_period=86400)
@@ -150,14 +171,22 @@ logger.debug('Time: ' + rtc.get_localtime())
 # initialize the MQTT module
 logger.debug('Initializing MQTT...')
 mqtt = MQTT(settings)
+settings.subscribe('mqtt', mqtt.apply_settings)
 
 # initialize the fermentation process
 logger.debug('Initializing main process logic...')
-main_process = Process(fermenter_temp_ctrl, process_tim, recovery, wifi, mqtt)
+# keep the history on the device: 2 hours by the minute, 1 day by 15 minutes, 3 weeks by the hour
+telemetry = Telemetry(tiers=HISTORY_TIERS)
+# and the whole batch on the SD card
+datalog = DataLog('/sd/log')
+main_process = Process(fermenter_temp_ctrl, process_tim, recovery, wifi, mqtt, telemetry_obj=telemetry,
+                       datalog_obj=datalog)
+event_hub = EventHub(main_process.get_live_state)
 
 # Set up HTTP server
 logger.debug('Initializing Web server...')
-web = HttpServer(main_process, wifi, rtc, settings)
+web = HttpServer(main_process, wifi, rtc, settings, engine=HTTP_ENGINE, event_hub=event_hub,
+                 workers=HTTP_WORKERS, queue_len=HTTP_QUEUE_LEN, telemetry=telemetry, datalog=datalog)
 web.start()
 utime.sleep(3)
 if web.is_started():
@@ -177,10 +206,9 @@ if recovery.is_needed():
     recovered_process_info = recovery.retrieve_backup()
     beer_name = recovered_process_info['beerName']
     fermentation_steps = recovered_process_info['fermentationSteps']
-    current_step_index = recovered_process_info['currentFermentationStepIndex']
-    step_hours_left = recovered_process_info['stepHoursLeft']
+    total_hours_left = recovered_process_info['totalHoursLeft']
     hydrometer_data = recovered_process_info['hydrometerData']
     main_process.set_beer_name(beer_name)
     main_process.save_hydrometer_data(hydrometer_data)
     main_process.load_steps(fermentation_steps)
-    main_process.start(step_index=current_step_index, step_hours_left=step_hours_left)
+    main_process.resume(total_hours_left)
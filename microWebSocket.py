@@ -0,0 +1,294 @@
+"""
+The MIT License (MIT)
+Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
+"""
+
+
+from    _thread     import start_new_thread, allocate_lock
+from    struct      import pack, unpack
+import  select
+import  gc
+
+try :
+    from uhashlib   import sha1
+    from ubinascii  import b2a_base64
+except :
+    from hashlib    import sha1
+    from binascii   import b2a_base64
+
+class MicroWebSocket :
+
+    # ============================================================================
+    # ===( Constants )============================================================
+    # ============================================================================
+
+    _handshakeSign = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    _opContFrame   = 0x0
+    _opTextFrame   = 0x1
+    _opBinFrame    = 0x2
+    _opCloseFrame  = 0x8
+    _opPingFrame   = 0x9
+    _opPongFrame   = 0xA
+
+    _msgTypeText   = 1
+    _msgTypeBin    = 2
+
+    _closeProtocolError = 1002
+    _closeTooBig   = 1009
+
+    # ============================================================================
+    # ===( Utils  )===============================================================
+    # ============================================================================
+
+    @staticmethod
+    def _tryStartThread(func, args=()) :
+        try :
+            start_new_thread(func, args)
+        except :
+            global _mws_thread_id
+            try :
+                _mws_thread_id += 1
+            except :
+                _mws_thread_id = 0
+            try :
+                start_new_thread('MWS_THREAD_%s' % _mws_thread_id, func, args)
+            except :
+                return False
+        return True
+
+    # ============================================================================
+    # ===( Constructor )==========================================================
+    # ============================================================================
+
+    def __init__(self, socket, httpClient, httpResponse, maxRecvLen, threaded, acceptCallback, sendTimeout=1, releaseCallback=None) :
+        self._socket            = socket
+        self._socketfile        = httpClient._socketfile
+        # frames are read from the socket itself, the file buffer only held the handshake request
+        self._recv              = getattr(socket, 'read', None) or socket.recv
+        self._httpCli           = httpClient
+        self._closed            = True
+        self._lock              = allocate_lock()
+        self.RecvTextCallback   = None
+        self.RecvBinaryCallback = None
+        self.ClosedCallback     = None
+        self._releaseCallback   = releaseCallback
+
+        if self._handshake(httpResponse) :
+            self._msgBuf  = bytearray(maxRecvLen)
+            self._msgType = None
+            self._msgLen  = 0
+            self._closed  = False
+            # a client not accepting a frame in time is closed, the wait for
+            # the next message is done by _waitFrame() without any timeout.
+            self._socket.settimeout(sendTimeout)
+            if not threaded or not MicroWebSocket._tryStartThread(self._wsProcess, (acceptCallback, )) :
+                self._wsProcess(acceptCallback)
+        else :
+            self._closeSocket()
+            self._release()
+
+    # ============================================================================
+    # ===( Functions )============================================================
+    # ============================================================================
+
+    def _handshake(self, httpResponse) :
+        try :
+            key = self._httpCli.GetRequestHeaders().get('sec-websocket-key', None)
+            if key :
+                key += self._handshakeSign
+                r = sha1(key.encode()).digest()
+                r = b2a_base64(r).decode().strip()
+                httpResponse.WriteSwitchProto("websocket", { "Sec-WebSocket-Accept" : r })
+                return True
+        except :
+            pass
+        return False
+
+    # ----------------------------------------------------------------------------
+
+    def _wsProcess(self, acceptCallback) :
+        try :
+            acceptCallback(self, self._httpCli)
+        except Exception as ex :
+            print("MicroWebSocket : Error on accept callback (%s)." % str(ex))
+        while not self._closed :
+            if not self._waitFrame() or not self._receiveFrame() :
+                self.Close()
+        if self.ClosedCallback :
+            try :
+                self.ClosedCallback(self)
+            except Exception as ex :
+                print("MicroWebSocket : Error on closed callback (%s)." % str(ex))
+        self._release()
+        gc.collect()
+
+    # ----------------------------------------------------------------------------
+
+    def _release(self) :
+        if self._releaseCallback :
+            self._releaseCallback()
+            self._releaseCallback = None
+
+    # ----------------------------------------------------------------------------
+
+    def _waitFrame(self) :
+        # the connection stays idle between the messages
+        try :
+            p = select.poll()
+            p.register(self._socket, select.POLLIN)
+            p.poll()
+            return True
+        except :
+            return False
+
+    # ----------------------------------------------------------------------------
+
+    def _recvData(self, size) :
+        data = b''
+        while len(data) < size :
+            b = self._recv(size - len(data))
+            if not b :
+                raise OSError('Connection closed')
+            data += b
+        return data
+
+    # ----------------------------------------------------------------------------
+
+    def _receiveFrame(self) :
+        try :
+            b = self._recvData(2)
+            fin    = b[0] & 0x80 > 0
+            opcode = b[0] & 0x0F
+            masked = b[1] & 0x80 > 0
+            length = b[1] & 0x7F
+            if length == 0x7E :
+                length = unpack('>H', self._recvData(2))[0]
+            elif length == 0x7F :
+                length = unpack('>Q', self._recvData(8))[0]
+            if not masked :
+                return False    # the frames of a client are always masked
+            if opcode == self._opContFrame :
+                msgType = self._msgType
+                if not msgType :
+                    # no message to continue
+                    self._sendFrame(self._opCloseFrame, pack('>H', self._closeProtocolError))
+                    return False
+            elif opcode == self._opTextFrame :
+                msgType = self._msgTypeText
+                self._msgLen = 0
+            elif opcode == self._opBinFrame :
+                msgType = self._msgTypeBin
+                self._msgLen = 0
+            elif opcode in (self._opCloseFrame, self._opPingFrame, self._opPongFrame) :
+                msgType = None
+                # control frames are never fragmented nor longer than 125 bytes (RFC 6455, 5.5)
+                if length > 125 or not fin :
+                    self._sendFrame(self._opCloseFrame, pack('>H', self._closeProtocolError))
+                    return False
+            else :
+                # unknown opcode, its payload is not read
+                self._sendFrame(self._opCloseFrame, pack('>H', self._closeProtocolError))
+                return False
+            # checked before anything is read or allocated
+            if msgType and self._msgLen + length > len(self._msgBuf) :
+                self._sendFrame(self._opCloseFrame, pack('>H', self._closeTooBig))
+                return False
+            mask = self._recvData(4)
+            data = bytearray(self._recvData(length)) if length else bytearray()
+            for i in range(length) :
+                data[i] ^= mask[i & 3]
+        except :
+            return False
+
+        if msgType :
+            self._msgBuf[self._msgLen:self._msgLen+length] = data
+            self._msgLen += length
+            self._msgType = msgType
+            if fin :
+                self._msgType = None
+                msg = bytes(self._msgBuf[:self._msgLen])
+                try :
+                    if msgType == self._msgTypeText :
+                        if self.RecvTextCallback :
+                            self.RecvTextCallback(self, msg.decode())
+                    elif self.RecvBinaryCallback :
+                        self.RecvBinaryCallback(self, msg)
+                except Exception as ex :
+                    print("MicroWebSocket : Error on recv callback (%s)." % str(ex))
+        elif opcode == self._opCloseFrame :
+            self._sendFrame(self._opCloseFrame, data)
+            return False
+        elif opcode == self._opPingFrame :
+            return self._sendFrame(self._opPongFrame, data)
+        return True
+
+    # ----------------------------------------------------------------------------
+
+    def _sendFrame(self, opcode, data=None, fin=True) :
+        if not self._closed and opcode >= 0x00 and opcode <= 0x0F :
+            dataLen = len(data) if data else 0
+            if dataLen <= 0xFFFF :
+                b1 = (0x80 if fin else 0x00) | opcode
+                if dataLen < 0x7E :
+                    frame = pack('>BB', b1, dataLen)
+                else :
+                    frame = pack('>BBH', b1, 0x7E, dataLen)
+                if data :
+                    frame += data
+                # the frames of several threads must not interleave
+                with self._lock :
+                    try :
+                        self._socketfile.write(frame)
+                        if self._socketfile is not self._socket :
+                            self._socketfile.flush()
+                        return True
+                    except :
+                        pass
+        return False
+
+    # ----------------------------------------------------------------------------
+
+    def _closeSocket(self) :
+        try :
+            self._socket.shutdown(2)    # wakes up a thread blocked in a read
+        except :
+            pass
+        try :
+            self._socket.close()
+        except :
+            pass
+
+    # ----------------------------------------------------------------------------
+
+    def SendText(self, msg) :
+        if type(msg) == str :
+            msg = msg.encode()
+        return self._sendFrame(self._opTextFrame, msg)
+
+    # ----------------------------------------------------------------------------
+
+    def SendBinary(self, data) :
+        return self._sendFrame(self._opBinFrame, bytes(data))
+
+    # ----------------------------------------------------------------------------
+
+    def SendPing(self) :
+        return self._sendFrame(self._opPingFrame)
+
+    # ----------------------------------------------------------------------------
+
+    def IsClosed(self) :
+        return self._closed
+
+    # ----------------------------------------------------------------------------
+
+    def Close(self) :
+        if not self._closed :
+            self._sendFrame(self._opCloseFrame)
+            self._closed = True
+            self._closeSocket()
+
+    # ============================================================================
+    # ============================================================================
+    # ============================================================================
@@ -4,13 +4,21 @@ Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
 """
 
 
-from    json        import loads, dumps
+from    json        import load, dumps
 from    os          import stat
-from    _thread     import start_new_thread
+from    time        import time
+from    _thread     import start_new_thread, allocate_lock
 import  socket
-import  gc
+import  select
 import  re
 
+try :
+    from uhashlib   import sha256
+    from ubinascii  import hexlify
+except :
+    from hashlib    import sha256
+    from binascii   import hexlify
+
 try :
     from microWebTemplate import MicroWebTemplate
 except :
@@ -21,6 +29,21 @@ try :
 except :
     pass
 
+try :
+    from jsonwriter import JSONWriter
+except :
+    pass
+
+try :
+    from workerpool import WorkerPool
+except :
+    pass
+
+try :
+    from io import IOBase
+except :
+    IOBase = object
+
 class MicroWebSrvRoute :
     def __init__(self, route, method, func, routeArgNames, routeRegex) :
         self.route         = route        
@@ -30,6 +53,51 @@ class MicroWebSrvRoute :
         self.routeRegex    = routeRegex   
 
 
+class MicroWebSrvStaticFile :
+    def __init__(self, physPath, size, contentType, etag, immutable, gzPath, gzSize) :
+        self.physPath    = physPath
+        self.size        = size
+        self.contentType = contentType
+        self.etag        = etag
+        self.immutable   = immutable
+        self.gzPath      = gzPath
+        self.gzSize      = gzSize
+
+
+class MicroWebSrvContentStream(IOBase) :
+    """ The request content as a stream, read from the socket on demand
+        through a small buffer, as ujson.load() reads it byte by byte """
+    _bufLen = 256
+
+    def __init__(self, client) :
+        self._client = client
+        self._buf    = memoryview(bytearray(self._bufLen))
+        self._pos    = 0
+        self._len    = 0
+
+    def readinto(self, buf) :
+        if self._pos >= self._len :
+            self._pos = 0
+            self._len = self._client._readContentInto(self._buf)
+            if not self._len :
+                return 0
+        n = min(len(buf), self._len - self._pos)
+        buf[:n] = self._buf[self._pos:self._pos+n]
+        self._pos += n
+        return n
+
+    def read(self, size=-1) :
+        avail = self._len - self._pos
+        if size is not None and 0 <= size <= avail :
+            data = bytes(self._buf[self._pos:self._pos+size])
+            self._pos += size
+            return data
+        data = bytes(self._buf[self._pos:self._len])
+        self._pos = self._len
+        more = self._client.ReadRequestContent(size - avail if size is not None and size >= 0 else -1)
+        return data + more if data else more
+
+
 class MicroWebSrv :
 
     # ============================================================================
@@ -80,6 +148,15 @@ class MicroWebSrv :
 
     _pyhtmlPagesExt = '.pyhtml'
 
+    _gzipExt = '.gz'
+
+    _headerBufSize = 256
+
+    _rejectResponse = "HTTP/1.1 503 Service Unavailable\r\n" \
+                      "Retry-After: %d\r\n"                  \
+                      "Content-Length: 0\r\n"                \
+                      "Connection: close\r\n\r\n"
+
     # ============================================================================
     # ===( Class globals  )=======================================================
     # ============================================================================
@@ -154,6 +231,45 @@ class MicroWebSrv :
 
     # ----------------------------------------------------------------------------
 
+    @staticmethod
+    def _statFile(path) :
+        try :
+            st = stat(path)
+            if not st[0] & 0x4000 :   # not a directory
+                return st
+        except :
+            pass
+        return None
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _getFilenameHash(path) :
+        # Quasar build output names its content, eg. "vendor.3a06946c.js"
+        parts = path[path.rfind('/')+1:].split('.')
+        if len(parts) >= 3 and len(parts[-2]) == 8 :
+            for c in parts[-2] :
+                if c not in '0123456789abcdef' :
+                    return None
+            return parts[-2]
+        return None
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _hashFile(path) :
+        h   = sha256()
+        buf = bytearray(1024)
+        with open(path, 'rb') as file :
+            while True :
+                x = file.readinto(buf)
+                if not x :
+                    break
+                h.update(buf if x == len(buf) else memoryview(buf)[:x])
+        return hexlify(h.digest()).decode()[:16]
+
+    # ----------------------------------------------------------------------------
+
     @staticmethod
     def _isPyHTMLFile(filename) :
         return filename.lower().endswith(MicroWebSrv._pyhtmlPagesExt)
@@ -175,11 +291,35 @@ class MicroWebSrv :
 
         self.MaxWebSocketRecvLen        = 1024
         self.WebSocketThreaded          = True
+        self.WebSocketSendTimeout       = 1
+        self.MaxWebSockets              = 2
         self.AcceptWebSocketCallback    = None
         self.LetCacheStaticContentLevel = 2
-
+        self.ServeGzipContent           = True
+        self.KeepAliveTimeout           = 6
+        self.MaxRequestsPerConnection   = 32
+        self.StaticCacheMaxEntries      = 128
+        self.StaticContentMaxAge        = 60
+        self.SmallContentMaxLen         = 1024
+        self.WorkersCount               = 0
+        self.AcceptQueueMaxLen          = 4
+        self.RetryAfterSec              = 5
+        self.MaxRequestContentLength    = 8192
+        self.RequestContentTimeout      = 5
+
+        self._staticCache   = { }
+        self._workers       = None
+        # every websocket runs in a thread of its own, out of the workers
+        self._wsLock        = allocate_lock()
+        self._wsCount       = 0
+        self._wsRejected    = 0
+
+        # Literal routes are indexed by (method, path) and their path is also
+        # indexed alone with its allowed methods, only the routes having
+        # <arg> parts are scanned with their regex.
+        self._routeIndex    = { }
         self._routeHandlers = []
-        routeHandlers += self._docoratedRouteHandlers
+        routeHandlers = routeHandlers + self._docoratedRouteHandlers
         for route, method, func in routeHandlers :
             routeParts = route.split('/')
             # -> ['', 'users', '<uID>', 'addresses', '<addrID>', 'test', '<anotherID>']
@@ -191,11 +331,18 @@ class MicroWebSrv :
                     routeRegex += '/(\\w*)'
                 elif s :
                     routeRegex += '/' + s
-            routeRegex += '$'
-            # -> '/users/(\w*)/addresses/(\w*)/test/(\w*)$'
-            routeRegex = re.compile(routeRegex)
-
-            self._routeHandlers.append(MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex))
+            if routeArgNames :
+                routeRegex += '$'
+                # -> '/users/(\w*)/addresses/(\w*)/test/(\w*)$'
+                routeRegex = re.compile(routeRegex)
+                self._routeHandlers.append(MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex))
+            else :
+                # -> '/users/addresses'
+                rh = MicroWebSrvRoute(route, method, func, routeArgNames, None)
+                self._routeIndex.setdefault((method, routeRegex), rh)
+                methods = self._routeIndex.setdefault(routeRegex, [])
+                if method not in methods :
+                    methods.append(method)
 
     # ============================================================================
     # ===( Server Process )=======================================================
@@ -210,9 +357,31 @@ class MicroWebSrv :
                 if ex.args and ex.args[0] == 113 :
                     break
                 continue
-            self._client(self, client, cliAddr)
+            if not self._workers :
+                self._client(self, client, cliAddr)
+            elif not self._workers.submit(self._client, (self, client, cliAddr)) :
+                self._rejectClient(client)
         self._started = False
 
+    # ----------------------------------------------------------------------------
+
+    def _rejectClient(self, client) :
+        # Answered from the accept thread without parsing the request, the
+        # head is only drained so that closing doesn't reset the connection.
+        try :
+            client.settimeout(0.1)
+            try :
+                client.recv(512)
+            except :
+                pass
+            client.send((self._rejectResponse % self.RetryAfterSec).encode())
+        except :
+            pass
+        try :
+            client.close()
+        except :
+            pass
+
     # ============================================================================
     # ===( Functions )============================================================
     # ============================================================================
@@ -225,6 +394,10 @@ class MicroWebSrv :
                                      1 )
             self._server.bind(self._srvAddr)
             self._server.listen(16)
+            if self.WorkersCount > 0 and not self._workers and 'WorkerPool' in globals() :
+                # the requests are served by a fixed number of threads, the
+                # accept thread only queues the connections
+                self._workers = WorkerPool(self.WorkersCount, self.AcceptQueueMaxLen)
             if threaded :
                 MicroWebSrv._startThread(self._serverProcess)
             else :
@@ -243,58 +416,144 @@ class MicroWebSrv :
 
     # ----------------------------------------------------------------------------
 
+    def GetWorkersStats(self) :
+        return self._workers.get_stats() if self._workers else None
+
+    # ----------------------------------------------------------------------------
+
+    def GetWebSocketsStats(self) :
+        return { 'connected' : self._wsCount,
+                 'max'       : self.MaxWebSockets,
+                 'rejected'  : self._wsRejected }
+
+    # ----------------------------------------------------------------------------
+
+    def _reserveWebSocket(self) :
+        with self._wsLock :
+            if self._wsCount >= self.MaxWebSockets :
+                self._wsRejected += 1
+                return False
+            self._wsCount += 1
+            return True
+
+    # ----------------------------------------------------------------------------
+
+    def _releaseWebSocket(self) :
+        with self._wsLock :
+            self._wsCount -= 1
+
+    # ----------------------------------------------------------------------------
+
     def SetNotFoundPageUrl(self, url=None) :
         self._notFoundUrl = url
 
     # ----------------------------------------------------------------------------
 
     def GetMimeTypeFromFilename(self, filename) :
-        filename = filename.lower()
-        for ext in self._mimeTypes :
-            if filename.endswith(ext) :
-                return self._mimeTypes[ext]
+        i = filename.rfind('.')
+        if i >= 0 and filename.find('/', i) < 0 :
+            return self._mimeTypes.get(filename[i:].lower())
         return None
 
     # ----------------------------------------------------------------------------
-    
-    def GetRouteHandler(self, resUrl, method) :
-        if self._routeHandlers :
-            #resUrl = resUrl.upper()
-            if resUrl.endswith('/') :
-                resUrl = resUrl[:-1]
-            method = method.upper()
-            for rh in self._routeHandlers :
-                if rh.method == method :
-                    m = rh.routeRegex.match(resUrl)
-                    if m :   # found matching route?
-                        if rh.routeArgNames :
-                            routeArgs = {}
-                            for i, name in enumerate(rh.routeArgNames) :
-                                value = m.group(i+1)
-                                try :
-                                    value = int(value)
-                                except :
-                                    pass
-                                routeArgs[name] = value
-                            return (rh.func, routeArgs)
-                        else :
-                            return (rh.func, None)
-        return (None, None)
+
+    def GetStaticFile(self, urlPath) :
+        """ Returns the MicroWebSrvStaticFile of an URL path or None, the file
+            system is only touched the first time a path is requested """
+        try :
+            return self._staticCache[urlPath]
+        except KeyError :
+            pass
+        sf = self._resolveStaticFile(urlPath)
+        if self.StaticCacheMaxEntries > 0 :
+            if len(self._staticCache) >= self.StaticCacheMaxEntries :
+                # one entry makes room, the oldest one on CPython, any one
+                # on MicroPython whose dicts are not ordered
+                try :
+                    del self._staticCache[next(iter(self._staticCache))]
+                except :
+                    self._staticCache = { }
+            self._staticCache[urlPath] = sf
+        return sf
 
     # ----------------------------------------------------------------------------
 
-    def _physPathFromURLPath(self, urlPath) :
+    def InvalidateStaticCache(self, physPath=None) :
+        """ Forgets the cached static files, eg. after files changed over FTP """
+        if physPath is None or physPath.startswith(self._webPath) :
+            self._staticCache = { }
+
+    # ----------------------------------------------------------------------------
+
+    def _resolveStaticFile(self, urlPath) :
         if urlPath == '/' :
-            for idxPage in self._indexPages :
-            	physPath = self._webPath + '/' + idxPage
-            	if MicroWebSrv._fileExists(physPath) :
-            		return physPath
+            physPaths = [ self._webPath + '/' + idxPage for idxPage in self._indexPages ]
         else :
-            physPath = self._webPath + urlPath
-            if MicroWebSrv._fileExists(physPath) :
-                return physPath
+            physPaths = [ self._webPath + urlPath ]
+        for physPath in physPaths :
+            st = MicroWebSrv._statFile(physPath)
+            if st :
+                gzPath = None
+                gzSize = 0
+                if self.ServeGzipContent :
+                    gzSt = MicroWebSrv._statFile(physPath + MicroWebSrv._gzipExt)
+                    if gzSt :
+                        gzPath = physPath + MicroWebSrv._gzipExt
+                        gzSize = gzSt[6]
+                # A strong ETag, the hash in a Quasar filename already names its
+                # content, other files are hashed once here.
+                etag      = MicroWebSrv._getFilenameHash(physPath)
+                immutable = etag is not None
+                if not immutable :
+                    try :
+                        etag = MicroWebSrv._hashFile(physPath)
+                    except :
+                        etag = '%x-%x' % (st[6], st[8])
+                return MicroWebSrvStaticFile( physPath,
+                                              st[6],
+                                              self.GetMimeTypeFromFilename(physPath),
+                                              etag,
+                                              immutable,
+                                              gzPath,
+                                              gzSize )
         return None
 
+    # ----------------------------------------------------------------------------
+    
+    def GetRouteHandler(self, resUrl, method) :
+        #resUrl = resUrl.upper()
+        if resUrl.endswith('/') :
+            resUrl = resUrl[:-1]
+        method = method.upper()
+        rh = self._routeIndex.get((method, resUrl))
+        if rh :
+            return (rh.func, None)
+        for rh in self._routeHandlers :
+            if rh.method == method :
+                m = rh.routeRegex.match(resUrl)
+                if m :   # found matching route?
+                    routeArgs = {}
+                    for i, name in enumerate(rh.routeArgNames) :
+                        value = m.group(i+1)
+                        try :
+                            value = int(value)
+                        except :
+                            pass
+                        routeArgs[name] = value
+                    return (rh.func, routeArgs)
+        return (None, None)
+
+    # ----------------------------------------------------------------------------
+
+    def GetRouteMethods(self, resUrl) :
+        """ Returns the methods routed for this URL, to tell 405 from 404 """
+        if resUrl.endswith('/') :
+            resUrl = resUrl[:-1]
+        methods = self._routeIndex.get(resUrl)
+        if methods is None :
+            methods = [ rh.method for rh in self._routeHandlers if rh.routeRegex.match(resUrl) ]
+        return methods
+
     # ============================================================================
     # ===( Class Client  )========================================================
     # ============================================================================
@@ -308,6 +567,21 @@ class MicroWebSrv :
             self._microWebSrv   = microWebSrv
             self._socket        = socket
             self._addr          = addr
+            self._requestsCount = 0
+            self._headerBuf     = bytearray(MicroWebSrv._headerBufSize)
+            self._detached      = False
+            self._resetRequest()
+
+            if hasattr(socket, 'readline'):   # MicroPython
+                self._socketfile = self._socket
+            else:   # CPython
+                self._socketfile = self._socket.makefile('rwb')
+
+            self._serveRequests()
+
+        # ------------------------------------------------------------------------
+
+        def _resetRequest(self) :
             self._method        = None
             self._path          = None
             self._httpVer       = None
@@ -317,74 +591,148 @@ class MicroWebSrv :
             self._headers       = { }
             self._contentType   = None
             self._contentLength = 0
-            
-            if hasattr(socket, 'readline'):   # MicroPython
-                self._socketfile = self._socket
-            else:   # CPython
-                self._socketfile = self._socket.makefile('rwb')
-                        
-            self._processRequest()
+            self._contentRead   = 0
+            self._keepAlive     = False
+
+        # ------------------------------------------------------------------------
+
+        def _serveRequests(self) :
+            while True :
+                keepAlive = self._processRequest()
+                if keepAlive is None :
+                    return      # the socket has been handed over (websocket)
+                if not keepAlive or not self._waitNextRequest() :
+                    break
+                self._resetRequest()
+            try :
+                if self._socketfile is not self._socket:
+                    self._socketfile.close()
+                self._socket.close()
+            except :
+                pass
+
+        # ------------------------------------------------------------------------
+
+        def _waitNextRequest(self) :
+            srv = self._microWebSrv
+            # Requests are served by few threads, so an idle keep-alive
+            # connection is dropped as soon as another client is waiting in
+            # the accept backlog or in the workers queue.
+            try :
+                if self._socketfile is not self._socket :
+                    # CPython: the next request may already sit in the file
+                    # buffer, where the socket can't be polled for it.
+                    self._socket.settimeout(0)
+                    if self._socketfile.peek(1) :
+                        self._socket.settimeout(2)
+                        return True
+                # CPython polls return file descriptors, MicroPython ones the sockets
+                cli = self._socket if self._socketfile is self._socket else self._socket.fileno()
+                p = select.poll()
+                p.register(self._socket, select.POLLIN)
+                if not srv._workers :
+                    p.register(srv._server, select.POLLIN)
+                timeout = int(srv.KeepAliveTimeout * 1000)
+                while timeout > 0 :
+                    events = p.poll(min(timeout, 250))
+                    if events :
+                        if events[0][0] == cli :
+                            self._socket.settimeout(2)
+                            return True
+                        break
+                    if srv._workers and srv._workers.get_queue_depth() :
+                        break
+                    timeout -= 250
+            except :
+                pass
+            return False
+
+        # ------------------------------------------------------------------------
+
+        def _newResponse(self) :
+            return MicroWebSrv._response(self)
+
+        # ------------------------------------------------------------------------
+
+        def _acceptWebSocket(self, response) :
+            srv = self._microWebSrv
+            if 'MicroWebSocket' not in globals() or not srv.AcceptWebSocketCallback :
+                response.WriteResponseNotImplemented()
+                return False
+            if not srv._reserveWebSocket() :
+                # refused before the handshake, as the connections over the workers queue
+                self._keepAlive = False
+                response.WriteResponseError(503, { "Retry-After" : str(srv.RetryAfterSec) })
+                return False
+            MicroWebSocket( socket          = self._socket,
+                            httpClient      = self,
+                            httpResponse    = response,
+                            maxRecvLen      = srv.MaxWebSocketRecvLen,
+                            threaded        = srv.WebSocketThreaded,
+                            acceptCallback  = srv.AcceptWebSocketCallback,
+                            sendTimeout     = srv.WebSocketSendTimeout,
+                            releaseCallback = srv._releaseWebSocket )
+            return True
+
+        # ------------------------------------------------------------------------
+
+        def _canKeepAlive(self) :
+            srv = self._microWebSrv
+            if srv.KeepAliveTimeout <= 0 or \
+               self._requestsCount >= srv.MaxRequestsPerConnection or \
+               self._httpVer != 'HTTP/1.1' :
+                return False
+            return 'close' not in self._headers.get('connection', '').lower()
 
         # ------------------------------------------------------------------------
 
         def _processRequest(self) :
             try :
-                response = MicroWebSrv._response(self)
+                response = self._newResponse()
                 if self._parseFirstLine(response) :
+                    self._requestsCount += 1
                     if self._parseHeader(response) :
                         upg = self._getConnUpgrade()
-                        if not upg :
+                        if self._contentLength > self._microWebSrv.MaxRequestContentLength :
+                            self._keepAlive = False
+                            response.WriteResponseError(413)
+                        elif not upg :
+                            self._keepAlive = self._canKeepAlive()
                             routeHandler, routeArgs = self._microWebSrv.GetRouteHandler(self._resPath, self._method)
                             if routeHandler :
                                 if routeArgs is not None:
                                     routeHandler(self, response, routeArgs)
                                 else:
                                     routeHandler(self, response)
-                            elif self._method.upper() == "GET" :
-                                filepath = self._microWebSrv._physPathFromURLPath(self._resPath)
-                                if filepath :
-                                    if MicroWebSrv._isPyHTMLFile(filepath) :
-                                        response.WriteResponsePyHTMLFile(filepath)
-                                    else :
-                                        contentType = self._microWebSrv.GetMimeTypeFromFilename(filepath)
-                                        if contentType :
-                                            if self._microWebSrv.LetCacheStaticContentLevel > 0 :
-                                                if self._microWebSrv.LetCacheStaticContentLevel > 1 and \
-                                                   'if-modified-since' in self._headers :
-                                                    response.WriteResponseNotModified()
-                                                else:
-                                                    headers = { 'Last-Modified' : 'Fri, 1 Jan 2018 23:42:00 GMT', \
-                                                                'Cache-Control' : 'max-age=315360000' }
-                                                    response.WriteResponseFile(filepath, contentType, headers)
-                                            else :
-                                                response.WriteResponseFile(filepath, contentType)
-                                        else :
-                                            response.WriteResponseForbidden()
-                                else :
-                                    response.WriteResponseNotFound()
+                                if self._detached :
+                                    return None
                             else :
-                                response.WriteResponseMethodNotAllowed()
-                        elif upg == 'websocket' and 'MicroWebSocket' in globals() \
-                             and self._microWebSrv.AcceptWebSocketCallback :
-                                MicroWebSocket( socket         = self._socket,
-                                                httpClient     = self,
-                                                httpResponse   = response,
-                                                maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
-                                                threaded       = self._microWebSrv.WebSocketThreaded,
-                                                acceptCallback = self._microWebSrv.AcceptWebSocketCallback )
-                                return
+                                routeMethods = self._microWebSrv.GetRouteMethods(self._resPath)
+                                if routeMethods :
+                                    response.WriteResponseMethodNotAllowed(routeMethods)
+                                elif self._method.upper() == "GET" :
+                                    self._writeStaticContent(response)
+                                else :
+                                    response.WriteResponseMethodNotAllowed()
+                        elif upg == 'websocket' :
+                            if self._acceptWebSocket(response) :
+                                return None
                         else :
                             response.WriteResponseNotImplemented()
                     else :
                         response.WriteResponseBadRequest()
             except :
+                self._keepAlive = False
                 response.WriteResponseInternalServerError()
-            try :
-                if self._socketfile is not self._socket:
-                    self._socketfile.close()
-                self._socket.close()
-            except :
-                pass
+            # an unread request body would be parsed as the next request
+            if self._contentRead < self._contentLength :
+                self._keepAlive = False
+            if self._keepAlive and self._socketfile is not self._socket :
+                try :
+                    self._socketfile.flush()
+                except :
+                    self._keepAlive = False
+            return self._keepAlive
 
         # ------------------------------------------------------------------------
 
@@ -428,6 +776,65 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def _writeStaticContent(self, response) :
+            sf = self._microWebSrv.GetStaticFile(self._resPath)
+            if sf :
+                if MicroWebSrv._isPyHTMLFile(sf.physPath) :
+                    response.WriteResponsePyHTMLFile(sf.physPath)
+                elif sf.contentType :
+                    headers = { }
+                    filepath, size = self._getEncodedFile(sf, headers)
+                    cacheLevel = self._microWebSrv.LetCacheStaticContentLevel
+                    if cacheLevel > 0 :
+                        # a strong ETag differs between the encodings of a file
+                        etag = '"%s%s"' % (sf.etag, '-gz' if filepath is sf.gzPath else '')
+                        headers['ETag'] = etag
+                        if sf.immutable :
+                            headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+                        else :
+                            headers['Cache-Control'] = 'max-age=%d' % self._microWebSrv.StaticContentMaxAge
+                        if cacheLevel > 1 and self._matchesETag(etag) :
+                            headers.pop('Content-Encoding', None)
+                            response.WriteResponseNotModified(headers)
+                            return
+                    response.WriteResponseFile(filepath, sf.contentType, headers, size)
+                else :
+                    response.WriteResponseForbidden()
+            else :
+                response.WriteResponseNotFound()
+
+        # ------------------------------------------------------------------------
+
+        def _matchesETag(self, etag) :
+            ifNoneMatch = self._headers.get('if-none-match')
+            if ifNoneMatch :
+                for tag in ifNoneMatch.split(',') :
+                    tag = tag.strip()
+                    if tag.startswith('W/') :
+                        tag = tag[2:]
+                    if tag == etag or tag == '*' :
+                        return True
+            return False
+
+        # ------------------------------------------------------------------------
+
+        def _acceptsGzip(self) :
+            return 'gzip' in self._headers.get('accept-encoding', '').lower()
+
+        # ------------------------------------------------------------------------
+
+        def _getEncodedFile(self, staticFile, headers) :
+            # Serves the precompressed "<file>.gz" sibling when there is one and
+            # the client accepts it, the Content-Type stays the original one.
+            if staticFile.gzPath :
+                headers['Vary'] = 'Accept-Encoding'
+                if self._acceptsGzip() :
+                    headers['Content-Encoding'] = 'gzip'
+                    return (staticFile.gzPath, staticFile.gzSize)
+            return (staticFile.physPath, staticFile.size)
+
+        # ------------------------------------------------------------------------
+
         def _getConnUpgrade(self) :
             if 'upgrade' in self._headers.get('connection', '').lower() :
                 return self._headers.get('upgrade', '').lower()
@@ -435,6 +842,14 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def DetachSocket(self) :
+            """ Takes the connection out of the server, which won't read nor close it anymore """
+            self._detached  = True
+            self._keepAlive = False
+            return self._socket
+
+        # ------------------------------------------------------------------------
+
         def GetServer(self) :
             return self._microWebSrv
 
@@ -495,18 +910,45 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def _readContentInto(self, buf) :
+            # The content may come in several TCP segments, so the reads loop
+            # until the buffer is full, within RequestContentTimeout overall.
+            buf = buf[:self._contentLength - self._contentRead]
+            n   = 0
+            if len(buf) > 0 :
+                deadline = time() + self._microWebSrv.RequestContentTimeout
+                try :
+                    while n < len(buf) :
+                        timeout = deadline - time()
+                        if timeout <= 0 :
+                            break
+                        self._socket.settimeout(timeout)
+                        x = self._socketfile.readinto(buf[n:])
+                        if not x :
+                            break
+                        n += x
+                except :
+                    pass
+                self._socket.settimeout(2)
+                self._contentRead += n
+            return n
+
+        # ------------------------------------------------------------------------
+
         def ReadRequestContent(self, size=None) :
-            self._socket.setblocking(False)
-            b = None
-            try :
-                if not size :
-                    b = self._socketfile.read(self._contentLength)
-                elif size > 0 :
-                    b = self._socketfile.read(size)
-            except :
-                pass
-            self._socket.setblocking(True)
-            return b if b else b''
+            remaining = self._contentLength - self._contentRead
+            if size is None or size < 0 or size > remaining :
+                size = remaining
+            if size <= 0 :
+                return b''
+            buf = bytearray(size)
+            n   = self._readContentInto(memoryview(buf))
+            return buf if n == size else buf[:n]
+
+        # ------------------------------------------------------------------------
+
+        def GetRequestContentStream(self) :
+            return MicroWebSrvContentStream(self)
 
         # ------------------------------------------------------------------------
 
@@ -525,8 +967,10 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def ReadRequestContentAsJSON(self) :
+            # decoded straight from the socket, the raw content is never
+            # held in RAM as a whole
             try :
-                return loads(self.ReadRequestContent())
+                return load(self.GetRequestContentStream())
             except :
                 return None
         
@@ -539,7 +983,9 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def __init__(self, client) :
-            self._client = client
+            self._client  = client
+            self._bufLen  = 0
+            self._chunked = False
 
         # ------------------------------------------------------------------------
 
@@ -552,14 +998,36 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def _bufWrite(self, data) :
+            # Appends to the header buffer of the connection, which is reused
+            # from a request to the next and only grows when it is too small.
+            if type(data) == str :
+                data = data.encode()
+            buf = self._client._headerBuf
+            end = self._bufLen + len(data)
+            if end > len(buf) :
+                buf.extend(bytes(end - len(buf)))
+            buf[self._bufLen:end] = data
+            self._bufLen = end
+
+        # ------------------------------------------------------------------------
+
+        def _bufFlush(self) :
+            if self._bufLen :
+                self._write(memoryview(self._client._headerBuf)[:self._bufLen])
+                self._bufLen = 0
+
+        # ------------------------------------------------------------------------
+
         def _writeFirstLine(self, code) :
             reason = self._responseCodes.get(code, ('Unknown reason', ))[0]
-            self._write("HTTP/1.1 %s %s\r\n" % (code, reason))
+            self._bufLen = 0
+            self._bufWrite("HTTP/1.1 %s %s\r\n" % (code, reason))
 
         # ------------------------------------------------------------------------
 
         def _writeHeader(self, name, value) :
-            self._write("%s: %s\r\n" % (name, value))
+            self._bufWrite("%s: %s\r\n" % (name, value))
 
         # ------------------------------------------------------------------------
 
@@ -574,16 +1042,30 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def _writeServerHeader(self) :
-            self._writeHeader("Server", "MicroWebSrv by JC`zic")
+            self._bufWrite(b"Server: MicroWebSrv by JC`zic\r\n")
+
+        # ------------------------------------------------------------------------
+
+        def _writeConnectionHeader(self) :
+            if self._client._keepAlive :
+                srv = self._client._microWebSrv
+                self._bufWrite(b"Connection: keep-alive\r\n")
+                self._writeHeader("Keep-Alive", "timeout=%d, max=%d" % (
+                    srv.KeepAliveTimeout,
+                    srv.MaxRequestsPerConnection - self._client._requestsCount ))
+            else :
+                self._bufWrite(b"Connection: close\r\n")
 
         # ------------------------------------------------------------------------
 
         def _writeEndHeader(self) :
-            self._write("\r\n")
+            self._bufWrite(b"\r\n")
 
         # ------------------------------------------------------------------------
 
-        def _writeBeforeContent(self, code, headers, contentType, contentCharset, contentLength) :
+        def _writeBeforeContent(self, code, headers, contentType, contentCharset, contentLength, content=None) :
+            # The whole header goes out in a single write, together with the
+            # content when it is given.
             self._writeFirstLine(code)
             if isinstance(headers, dict) :
                 for header in headers :
@@ -591,9 +1073,15 @@ class MicroWebSrv :
             if contentLength > 0 :
                 self._writeContentTypeHeader(contentType, contentCharset)
                 self._writeHeader("Content-Length", contentLength)
+            elif self._client._keepAlive and code >= 200 and code not in (204, 304) :
+                # the client needs the length to find the end of the response
+                self._bufWrite(b"Content-Length: 0\r\n")
             self._writeServerHeader()
-            self._writeHeader("Connection", "close")
+            self._writeConnectionHeader()
             self._writeEndHeader()
+            if content :
+                self._bufWrite(content)
+            self._bufFlush()
 
         # ------------------------------------------------------------------------
 
@@ -606,6 +1094,25 @@ class MicroWebSrv :
                     self._writeHeader(header, headers[header])
             self._writeServerHeader()
             self._writeEndHeader()
+            self._bufFlush()
+            if self._client._socketfile is not self._client._socket :
+                self._client._socketfile.flush()   # CPython needs flush to continue protocol
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseEventStream(self, headers=None) :
+            """ Starts a text/event-stream response, the events are then written on the detached socket """
+            self._client._keepAlive = False
+            self._writeFirstLine(200)
+            if isinstance(headers, dict) :
+                for header in headers :
+                    self._writeHeader(header, headers[header])
+            self._writeContentTypeHeader("text/event-stream", "UTF-8")
+            self._bufWrite(b"Cache-Control: no-cache\r\n")
+            self._writeServerHeader()
+            self._writeConnectionHeader()
+            self._writeEndHeader()
+            self._bufFlush()
             if self._client._socketfile is not self._client._socket :
                 self._client._socketfile.flush()   # CPython needs flush to continue protocol
 
@@ -619,8 +1126,10 @@ class MicroWebSrv :
                     contentLength = len(content)
                 else :
                     contentLength = 0
-                self._writeBeforeContent(code, headers, contentType, contentCharset, contentLength)
-                if content :
+                if contentLength <= self._client._microWebSrv.SmallContentMaxLen :
+                    self._writeBeforeContent(code, headers, contentType, contentCharset, contentLength, content)
+                else :
+                    self._writeBeforeContent(code, headers, contentType, contentCharset, contentLength)
                     self._write(content)
                 return True
             except :
@@ -649,19 +1158,28 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseFile(self, filepath, contentType=None, headers=None) :
+        def WriteResponseFile(self, filepath, contentType=None, headers=None, size=None) :
             try :
-                size = stat(filepath)[6]
+                if size is None :
+                    size = stat(filepath)[6]
                 if size > 0 :
                     with open(filepath, 'rb') as file :
+                        if size <= self._client._microWebSrv.SmallContentMaxLen :
+                            self._writeBeforeContent(200, headers, contentType, None, size, file.read())
+                            return True
                         self._writeBeforeContent(200, headers, contentType, None, size)
                         try :
-                            buf = bytearray(1024)
+                            buf = memoryview(bytearray(1024))
                             while size > 0 :
-                                x = file.readinto(buf)
-                                if x < len(buf) :
-                                    buf = memoryview(buf)[:x]
-                                self._write(buf)
+                                # never past the declared length, the file
+                                # may have changed since it was cached
+                                x = file.readinto(buf[:min(len(buf), size)])
+                                if not x :
+                                    # shorter than declared, the connection
+                                    # can't carry another response
+                                    self._client._keepAlive = False
+                                    break
+                                self._write(buf[:x])
                                 size -= x
                             return True
                         except :
@@ -688,7 +1206,81 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def WriteResponseJSONOk(self, obj=None, headers=None) :
-            return self.WriteResponse(200, headers, "application/json", "UTF-8", dumps(obj))
+            return self.WriteResponseJSON(200, obj, headers)
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseJSON(self, code, obj=None, headers=None) :
+            if not 'JSONWriter' in globals() :
+                return self.WriteResponse(code, headers, "application/json", "UTF-8", dumps(obj))
+            # The JSON is encoded straight into a fixed buffer: when the whole
+            # text fits, it goes out with its Content-Length, otherwise every
+            # full buffer is sent as a chunk.
+            try :
+                writer = JSONWriter(None, self._client._microWebSrv.SmallContentMaxLen)
+                def writeChunk(data) :
+                    if writer.written == 0 :
+                        self.WriteResponseChunkedStart(code, headers, "application/json", "UTF-8")
+                    self.WriteResponseChunk(data)
+                writer.write_func = writeChunk
+                writer.dump(obj)
+                if writer.written == 0 :
+                    data = writer.get_buffered()
+                    self._writeBeforeContent(code, headers, "application/json", "UTF-8", len(data), data)
+                else :
+                    writer.flush()
+                    self.WriteResponseChunkedEnd()
+                return True
+            except :
+                return False
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseChunkedStart(self, code, headers, contentType, contentCharset=None) :
+            """ Starts a response of unknown length, continue with WriteResponseChunk() """
+            self._chunked = self._client._httpVer == 'HTTP/1.1'
+            if not self._chunked :
+                # an HTTP/1.0 client reads the content until the connection closes
+                self._client._keepAlive = False
+            self._writeFirstLine(code)
+            if isinstance(headers, dict) :
+                for header in headers :
+                    self._writeHeader(header, headers[header])
+            self._writeContentTypeHeader(contentType, contentCharset)
+            if self._chunked :
+                self._bufWrite(b"Transfer-Encoding: chunked\r\n")
+            self._writeServerHeader()
+            self._writeConnectionHeader()
+            self._writeEndHeader()
+            self._bufFlush()
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseChunk(self, data) :
+            if data :
+                if self._chunked :
+                    self._bufWrite("%x\r\n" % len(data))
+                    self._bufWrite(data)
+                    self._bufWrite(b"\r\n")
+                    self._bufFlush()
+                else :
+                    self._write(data)
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseChunkedEnd(self) :
+            if self._chunked :
+                self._write(b"0\r\n\r\n")
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseChunkedIter(self, code, headers, contentType, contentCharset, chunks) :
+            """ Sends every bytes object of the chunks iterable as a chunk, the memory used
+                doesn't depend on the length of the content """
+            self.WriteResponseChunkedStart(code, headers, contentType, contentCharset)
+            for chunk in chunks :
+                self.WriteResponseChunk(chunk)
+            self.WriteResponseChunkedEnd()
 
         # ------------------------------------------------------------------------
 
@@ -698,10 +1290,10 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseError(self, code) :
+        def WriteResponseError(self, code, headers=None) :
             responseCode = self._responseCodes.get(code, ('Unknown reason', ''))
             return self.WriteResponse( code,
-                                       None,
+                                       headers,
                                        "text/html",
                                        "UTF-8",
                                        self._errCtnTmpl % {
@@ -721,8 +1313,9 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseNotModified(self) :
-            return self.WriteResponseError(304)
+        def WriteResponseNotModified(self, headers=None) :
+            # a 304 response never has a body
+            return self.WriteResponse(304, headers, None, None, None)
 
         # ------------------------------------------------------------------------
 
@@ -744,8 +1337,9 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseMethodNotAllowed(self) :
-            return self.WriteResponseError(405)
+        def WriteResponseMethodNotAllowed(self, allowedMethods=None) :
+            headers = { "Allow" : ", ".join(allowedMethods) } if allowedMethods else None
+            return self.WriteResponseError(405, headers)
 
         # ------------------------------------------------------------------------
 
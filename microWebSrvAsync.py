@@ -0,0 +1,318 @@
+"""
+The MIT License (MIT)
+Copyright © 2018 Jean-Christophe Bos & HC² (www.hc2.fr)
+
+asyncio engine for MicroWebSrv: every connection is served by its own task,
+so a slow client never stalls the others.  Routes declared with
+MicroWebSrv.route and the _client / _response handler API are unchanged.
+Runs with uasyncio on MicroPython and with asyncio on CPython.
+
+Note that the route handlers themselves are still plain functions running
+on the event loop, only the network I/O is concurrent.
+"""
+
+from    os          import stat
+from    microWebSrv import MicroWebSrv
+import  gc
+
+try :
+    import uasyncio as asyncio
+except :
+    import asyncio
+
+class MicroWebSrvAsync(MicroWebSrv) :
+
+    # ============================================================================
+    # ===( Constructor )==========================================================
+    # ============================================================================
+
+    def __init__( self,
+                  routeHandlers = [],
+                  port          = 80,
+                  bindIP        = '0.0.0.0',
+                  webPath       = "/flash/www" ) :
+        super().__init__(routeHandlers, port, bindIP, webPath)
+        self.RequestTimeout   = 5
+        self.MaxActiveClients = 8
+        self._activeClients   = 0
+        self._rejectedCount   = 0
+
+    # ============================================================================
+    # ===( Server Process )=======================================================
+    # ============================================================================
+
+    async def _handleConnection(self, reader, writer) :
+        if self._activeClients >= self.MaxActiveClients :
+            # every connection task holds its buffers, shed the load instead
+            self._rejectedCount += 1
+            try :
+                writer.write((self._rejectResponse % self.RetryAfterSec).encode())
+                await writer.drain()
+            except :
+                pass
+        else :
+            self._activeClients += 1
+            try :
+                await MicroWebSrvAsync._client(self, reader, writer).Serve()
+            except :
+                pass
+            self._activeClients -= 1
+        try :
+            writer.close()
+            await writer.wait_closed()
+        except :
+            pass
+        gc.collect()
+
+    # ----------------------------------------------------------------------------
+
+    async def Serve(self) :
+        """ Coroutine serving the clients until Stop() is called """
+        self._server  = await asyncio.start_server( self._handleConnection,
+                                                    self._srvAddr[0],
+                                                    self._srvAddr[1],
+                                                    backlog = 16 )
+        self._started = True
+        try :
+            await self._server.wait_closed()
+        finally :
+            self._started = False
+
+    # ============================================================================
+    # ===( Functions )============================================================
+    # ============================================================================
+
+    def Start(self, threaded=False) :
+        if not self._started :
+            if threaded :
+                MicroWebSrv._startThread(asyncio.run, (self.Serve(), ))
+            else :
+                asyncio.run(self.Serve())
+
+    # ----------------------------------------------------------------------------
+
+    def Stop(self) :
+        if self._started :
+            self._server.close()
+
+    # ----------------------------------------------------------------------------
+
+    def GetActiveClientsCount(self) :
+        return self._activeClients
+
+    # ----------------------------------------------------------------------------
+
+    def GetWorkersStats(self) :
+        return { 'activeClients'    : self._activeClients,
+                 'maxActiveClients' : self.MaxActiveClients,
+                 'rejected'         : self._rejectedCount }
+
+    # ============================================================================
+    # ===( Class Stream )=========================================================
+    # ============================================================================
+
+    class _stream :
+        """ File like object handed to the synchronous request parser """
+
+        def __init__(self, writer, headLines, content) :
+            self._writer    = writer
+            self._headLines = headLines
+            self._content   = content
+            self._pos       = 0
+
+        def readline(self) :
+            return self._headLines.pop(0) if self._headLines else b''
+
+        def read(self, size=-1) :
+            if size is None or size < 0 :
+                size = len(self._content) - self._pos
+            b = self._content[self._pos:self._pos+size]
+            self._pos += len(b)
+            return b
+
+        def write(self, data) :
+            if type(data) != bytes :
+                data = bytes(data)
+            self._writer.write(data)
+            return len(data)
+
+        def flush(self) :
+            pass
+
+    # ============================================================================
+    # ===( Class Client  )========================================================
+    # ============================================================================
+
+    class _client(MicroWebSrv._client) :
+
+        # ------------------------------------------------------------------------
+
+        def __init__(self, microWebSrv, reader, writer) :
+            self._microWebSrv   = microWebSrv
+            self._reader        = reader
+            self._writer        = writer
+            self._socket        = None
+            self._socketfile    = None
+            self._pendingFile   = None
+            self._pendingChunks = None
+            self._requestsCount = 0
+            self._headerBuf     = bytearray(MicroWebSrv._headerBufSize)
+            self._detached      = False
+            try :
+                self._addr = writer.get_extra_info('peername')
+            except :
+                self._addr = ('0.0.0.0', 0)
+            self._resetRequest()
+
+        # ------------------------------------------------------------------------
+
+        async def _readLine(self, timeout) :
+            return await asyncio.wait_for(self._reader.readline(), timeout)
+
+        # ------------------------------------------------------------------------
+
+        async def _readContent(self, size) :
+            content = b''
+            while len(content) < size :
+                b = await asyncio.wait_for( self._reader.read(size - len(content)),
+                                            self._microWebSrv.RequestTimeout )
+                if not b :
+                    break
+                content += b
+            return content
+
+        # ------------------------------------------------------------------------
+
+        async def _readRequest(self, timeout) :
+            """ Reads the request head and body, returns False on a closed connection """
+            line = await self._readLine(timeout)
+            if not line :
+                return False
+            headLines     = [ line ]
+            isPost        = line.split(b' ', 1)[0].upper() in (b'POST', b'PUT')
+            contentLength = 0
+            while True :
+                line = await self._readLine(self._microWebSrv.RequestTimeout)
+                headLines.append(line)
+                if not line or not line.strip() :
+                    break
+                if isPost and line.lower().startswith(b'content-length:') :
+                    try :
+                        contentLength = int(line.split(b':', 1)[1])
+                    except :
+                        pass
+            if contentLength > self._microWebSrv.MaxRequestContentLength :
+                contentLength = 0       # answered with a 413, never read
+            content = await self._readContent(contentLength) if contentLength > 0 else b''
+            self._socketfile = MicroWebSrvAsync._stream(self._writer, headLines, content)
+            return True
+
+        # ------------------------------------------------------------------------
+
+        async def _sendPendingFile(self) :
+            filepath, size = self._pendingFile
+            self._pendingFile = None
+            await self._writer.drain()
+            with open(filepath, 'rb') as file :
+                buf = bytearray(1024)
+                while size > 0 :
+                    x = file.readinto(buf)
+                    if not x :
+                        break
+                    self._writer.write(bytes(buf[:x]))
+                    await self._writer.drain()
+                    size -= x
+
+        # ------------------------------------------------------------------------
+
+        async def _sendPendingChunks(self) :
+            response, chunks = self._pendingChunks
+            self._pendingChunks = None
+            for chunk in chunks :
+                response.WriteResponseChunk(chunk)
+                await self._writer.drain()
+            response.WriteResponseChunkedEnd()
+
+        # ------------------------------------------------------------------------
+
+        async def Serve(self) :
+            srv     = self._microWebSrv
+            timeout = srv.RequestTimeout
+            while await self._readRequest(timeout) :
+                keepAlive = self._processRequest()
+                if self._pendingFile :
+                    await self._sendPendingFile()
+                if self._pendingChunks :
+                    await self._sendPendingChunks()
+                await self._writer.drain()
+                if not keepAlive :
+                    break
+                self._resetRequest()
+                timeout = srv.KeepAliveTimeout
+
+        # ------------------------------------------------------------------------
+
+        def _newResponse(self) :
+            return MicroWebSrvAsync._response(self)
+
+        # ------------------------------------------------------------------------
+
+        def _acceptWebSocket(self, response) :
+            response.WriteResponseNotImplemented()
+            return False
+
+        # ------------------------------------------------------------------------
+
+        def DetachSocket(self) :
+            # the connection belongs to the event loop, it can't be handed over
+            return None
+
+        # ------------------------------------------------------------------------
+
+        def _readContentInto(self, buf) :
+            # the content has already been read by the connection task
+            buf = buf[:self._contentLength - self._contentRead]
+            b   = self._socketfile.read(len(buf))
+            buf[:len(b)] = b
+            self._contentRead += len(b)
+            return len(b)
+
+    # ============================================================================
+    # ===( Class Response  )======================================================
+    # ============================================================================
+
+    class _response(MicroWebSrv._response) :
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseFile(self, filepath, contentType=None, headers=None, size=None) :
+            # Only the headers are written here, the content is streamed by
+            # the connection task once the handler has returned.
+            try :
+                if size is None :
+                    size = stat(filepath)[6]
+                if size > 0 :
+                    if size <= self._client._microWebSrv.SmallContentMaxLen :
+                        with open(filepath, 'rb') as file :
+                            self._writeBeforeContent(200, headers, contentType, None, size, file.read())
+                    else :
+                        self._writeBeforeContent(200, headers, contentType, None, size)
+                        self._client._pendingFile = (filepath, size)
+                    return True
+            except :
+                pass
+            self.WriteResponseNotFound()
+            return False
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseChunkedIter(self, code, headers, contentType, contentCharset, chunks) :
+            # Only the headers are written here, the chunks are sent by the
+            # connection task, which waits for each one to drain.
+            self.WriteResponseChunkedStart(code, headers, contentType, contentCharset)
+            self._client._pendingChunks = (self, chunks)
+
+    # ============================================================================
+    # ============================================================================
+    # ============================================================================
+
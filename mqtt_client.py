@@ -1,7 +1,9 @@
 import machine
 import ubinascii
+import ustruct
 
 from umqtt.robust import MQTTClient
+from jsonwriter import JSONWriter
 from logger import init_logger
 
 
@@ -9,7 +11,17 @@ logger = init_logger(__name__)
 
 class MQTT:
     def __init__(self, user_settings_dict):
-        settings = user_settings_dict.get('mqtt')
+        """
+        :param user_settings_dict: dict or Settings; the user settings, only the 'mqtt' key is used
+        """
+        self.client = None
+        self.apply_settings(user_settings_dict.get('mqtt'))
+
+    def apply_settings(self, settings):
+        """
+        (Re)configure the client, called again when the MQTT settings have been updated
+        :param settings: dict; the 'mqtt' part of the user settings
+        """
         server = settings.get('brokerAddr')
         port = settings.get('brokerPort')
         username = settings.get('username')
@@ -20,6 +32,7 @@ class MQTT:
         self.topic = settings.get('topic')
         if self.topic.endswith('/'):
             self.topic = self.topic[:-1]
+        # the connection is only opened while publishing, so the client can simply be replaced
         self.client = MQTTClient(client_id, server, port, username, password)
 
     def is_enabled(self):
@@ -52,3 +65,38 @@ class MQTT:
             logger.debug('Data have been published to the MQTT broker.')
             self.client.publish(self.topic, str_msg)
             self.disconnect()
+
+    def publish_json(self, obj):
+        """
+        Publish obj as a JSON message, the payload is streamed to the socket
+        instead of being built as a string first.
+        """
+        try:
+            self.connect()
+        except Exception:
+            logger.warning('Failed to publish the data to the MQTT broker.')
+        else:
+            logger.debug('Data have been published to the MQTT broker.')
+            self._write_publish_header(JSONWriter.measure(obj))
+            JSONWriter(self.client.sock.write).dump(obj).flush()
+            self.disconnect()
+
+    def _write_publish_header(self, msg_size):
+        """
+        Write the fixed header & the topic of a QoS 0 PUBLISH packet,
+        the same way as umqtt's MQTTClient.publish()
+        :param msg_size: int; payload length in bytes
+        """
+        topic = self.topic.encode()
+        pkt = bytearray(b'\x30\0\0\0\0')
+        size = 2 + len(topic) + msg_size
+        i = 1
+        while size > 0x7f:
+            pkt[i] = (size & 0x7f) | 0x80
+            size >>= 7
+            i += 1
+        pkt[i] = size
+        sock = self.client.sock
+        sock.write(memoryview(pkt)[:i + 1])
+        sock.write(ustruct.pack('!H', len(topic)))
+        sock.write(topic)
@@ -1,8 +1,9 @@
+import _thread
 import utime
 import machine
-import ujson
 
 from logger import init_logger
+from schedule import Schedule
 
 logger = init_logger(__name__)
 
@@ -11,11 +12,14 @@ class Process:
     """
     Process.stage_run() -> start timer -> control temp & check progress -> start next stage -> end of final stage
     """
-    def __init__(self, fermenter_temp_ctrl_obj, control_timer_obj, crash_recovery_obj, wifi_obj, mqtt_obj):
+    def __init__(self, fermenter_temp_ctrl_obj, control_timer_obj, crash_recovery_obj, wifi_obj, mqtt_obj,
+                 telemetry_obj=None, datalog_obj=None):
         """
         Initialize the fermenter process
         :param fermenter_temp_ctrl_obj: Class; the instance of FermenterTempControl class
         :param control_timer_obj: Class; the instance of the Timer class
+        :param telemetry_obj: Class; the instance of Telemetry, sampled by the control loop
+        :param datalog_obj: Class; the instance of DataLog, every sample of a batch is logged on the SD card
         """
         self.beer_name = None
         self.fermentation_steps = None
@@ -27,13 +31,15 @@ class Process:
         self.last_backup = None
         self.mqtt = mqtt_obj
         self.last_publish = None
-        self.total_steps = len(self.fermentation_steps) if self.fermentation_steps is not None else 0
+        self.telemetry = telemetry_obj
+        self.datalog = datalog_obj
+        self.schedule = None
+        self.total_steps = 0
         self.start_time = None
         self.elapsed_time = None
         self.elapsed_before_recovery = 0
         self.is_completed = False
         self.current_step_index = None
-        self.step_hours = None
         self.step_target_temp = None
         self.hydrometer_data = {
             'temperature': None,
@@ -47,6 +53,10 @@ class Process:
             'update_interval_ms': None,
             'last_time': None,
         }
+        # guards the state read by refresh_snapshot() against the updates of the other threads
+        self.lock = _thread.allocate_lock()
+        self.sensor_temps = (None, None)
+        self.snapshot = None
 
     def set_beer_name(self, beer_name):
         self.beer_name = beer_name
@@ -55,15 +65,16 @@ class Process:
         # 传入数据有updateIntervalSec代表数据来自比重计
         if hydrometer_dict_data.get('updateIntervalMs'):
             logger.info('Hydrometer data received.')
-            self.hydrometer_status['is_online'] = True
-            self.hydrometer_status['update_interval_ms'] = hydrometer_dict_data.get('updateIntervalMs')
-            self.hydrometer_status['last_time'] = utime.ticks_ms()
-            self.hydrometer_data['temperature'] = hydrometer_dict_data.get('temperature')
-            self.hydrometer_data['currentGravity'] = hydrometer_dict_data.get('currentGravity')
-            self.hydrometer_data['batteryVoltage'] = hydrometer_dict_data.get('battery')
-            self.hydrometer_data['batteryLevel'] = hydrometer_dict_data.get('batteryLevel')
-            if not self.hydrometer_data.get('originalGravity'):
-                self.hydrometer_data['originalGravity'] = hydrometer_dict_data.get('currentGravity')
+            with self.lock:
+                self.hydrometer_status['is_online'] = True
+                self.hydrometer_status['update_interval_ms'] = hydrometer_dict_data.get('updateIntervalMs')
+                self.hydrometer_status['last_time'] = utime.ticks_ms()
+                self.hydrometer_data['temperature'] = hydrometer_dict_data.get('temperature')
+                self.hydrometer_data['currentGravity'] = hydrometer_dict_data.get('currentGravity')
+                self.hydrometer_data['batteryVoltage'] = hydrometer_dict_data.get('battery')
+                self.hydrometer_data['batteryLevel'] = hydrometer_dict_data.get('batteryLevel')
+                if not self.hydrometer_data.get('originalGravity'):
+                    self.hydrometer_data['originalGravity'] = hydrometer_dict_data.get('currentGravity')
         # 否则代表传入数据来自于意外重启的恢复数据
         else:
             if hydrometer_dict_data.get('originalGravity'):
@@ -78,29 +89,37 @@ class Process:
             last_time = self.hydrometer_status.get('last_time')
             if utime.ticks_diff(utime.ticks_ms(), last_time) > timeout:
                 logger.info('The communication with the Hydrometer has lost.')
-                self.hydrometer_status['is_online'] = False
-                self.hydrometer_data['currentGravity'] = None
-                self.hydrometer_data['batteryLevel'] = None
+                with self.lock:
+                    self.hydrometer_status['is_online'] = False
+                    self.hydrometer_data['currentGravity'] = None
+                    self.hydrometer_data['batteryLevel'] = None
 
     def _step_progress_check(self):
         """
         check the stage progress
         """
         now = utime.time()
-        self.elapsed_time = now - self.start_time + self.elapsed_before_recovery
+        schedule = self.schedule
+        with self.lock:
+            self.elapsed_time = now - self.start_time + self.elapsed_before_recovery
+            # follows the ramps, constant for the other steps
+            self.step_target_temp = schedule.target_temp(self.current_step_index, self.elapsed_time)
         # keep the PID temp control logic going even after all steps have been completed
         self.fermenter_temp_ctrl.run(self.step_target_temp)
-        # if stage time is up
-        if self.elapsed_time >= (self.step_hours * 3600):
+        gravity = self.hydrometer_data.get('currentGravity') if self.hydrometer_status.get('is_online') else None
+        # if stage time is up, or the gravity has been reached
+        if schedule.is_step_done(self.current_step_index, self.elapsed_time, gravity):
             # if this is not the final stage
             if self.current_step_index < (self.total_steps - 1):
                 # then proceed to next stage
                 new_step_index = self.current_step_index + 1
-                self.start(step_index=new_step_index)
+                # the batch carries on, with the same log segment
+                self._enter_step(new_step_index)
                 logger.info('The previous step has completed, now proceeding to the next step.')
             # if this is the end of the final stage
             else:
-                self.is_completed = True
+                with self.lock:
+                    self.is_completed = True
                 self.fermenter_temp_ctrl.accomplished()
                 logger.info('All fermentation stages have completed.')
 
@@ -140,22 +159,19 @@ class Process:
                 "total_percentage": total_percentage
             }
             if self.hydrometer_status.get('is_online'):
-                combined_msg = basic_msg.copy()
-                combined_msg.update({
+                basic_msg.update({
                     "original_gravity": round(og, 3),
                     "specific_gravity": round(sg, 3),
                     "battery_percentage": battery
                 })
-                mqtt_msg = ujson.dumps(combined_msg)
-            else:
-                mqtt_msg = ujson.dumps(basic_msg)
+            mqtt_msg = basic_msg
 
             if not self.last_publish:
-                self.mqtt.publish(mqtt_msg)
+                self.mqtt.publish_json(mqtt_msg)
                 self.last_publish = utime.ticks_ms()
             else:
                 if utime.ticks_diff(utime.ticks_ms(), self.last_publish) >= self.mqtt.get_update_interval_ms():
-                    self.mqtt.publish(mqtt_msg)
+                    self.mqtt.publish_json(mqtt_msg)
                     self.last_publish = utime.ticks_ms()
                     # 如果全部发酵步骤完成，则关闭mqtt
                     # 此处确保mqtt会在发送完100%的进度后才关闭
@@ -167,6 +183,13 @@ class Process:
         self._step_progress_check()
         # 2. 检查比重计状态
         self._check_hydrometer_status()
+        # 备份和MQTT使用最新的发酵进度，温度沿用上次的测量值
+        snapshot = self.refresh_snapshot(read_sensors=False)
+        # 记录历史数据，逐级汇总为1分钟/15分钟/1小时数据
+        if self.telemetry:
+            self.telemetry.sample(snapshot)
+        if self.datalog:
+            self.datalog.sample(snapshot)
         # 3. 发酵过程备份（每5分钟）
         self._process_backup()
         # 4. 发送数据至MQTT（每15分钟：用户可设置）
@@ -178,27 +201,55 @@ class Process:
     def load_steps(self, fermentation_steps):
         """
         fermentation_stages: nested list; eg.[{'days': 2, 'temp': 18.6}, {'days': 14, 'temp': 21.5}, ..., {'days': 5, 'temp': 23.0}]
+        see Schedule for the ramp & gravity steps
+        """
+        schedule = Schedule(fermentation_steps)
+        with self.lock:
+            self.fermentation_steps = fermentation_steps
+            self.schedule = schedule
+            self.total_steps = schedule.count
+
+    def _enter_step(self, step_index, step_elapsed=0):
+        """
+        make a step the current one
+        :param step_index: int;
+        :param step_elapsed: int; seconds of the step done before a crash
         """
-        self.fermentation_steps = fermentation_steps
-        self.total_steps = len(self.fermentation_steps)
+        with self.lock:
+            self.current_step_index = step_index
+            self.elapsed_before_recovery = step_elapsed
+            self.step_target_temp = self.schedule.target_temp(step_index, step_elapsed)
+            self.elapsed_time = step_elapsed
+            self.start_time = utime.time()
 
-    def start(self, step_index=0, step_hours_left=None):
+    def start(self, step_index=0):
         """
         pass stage index to get stage settings and start the timer
         the timer calls temperature control & stage check function
+        called when the user starts a batch, a new log segment is opened
 
         stage_index: int;
         """
+        self._start(step_index, 0, resume=False)
+
+    def resume(self, total_hours_left):
+        """
+        carry on with a batch after a crash, the step is found from the overall progress of the backup
+        :param total_hours_left: float; 'totalHoursLeft' of the backup
+        """
+        if self.schedule:
+            elapsed = max(self.schedule.total_seconds - int(float(total_hours_left) * 3600), 0)
+            step_index = self.schedule.step_at(elapsed)
+            self._start(step_index, elapsed - self.schedule.offsets[step_index], resume=True)
+        else:
+            logger.info('Pls load fermentation steps before starting the process.')
+
+    def _start(self, step_index, step_elapsed, resume):
         if self.fermentation_steps:
-            self.current_step_index = step_index
-            step_settings = self.fermentation_steps[step_index]
-            self.step_hours = float(step_settings['days'] * 24)
-            self.step_target_temp = float(step_settings['temp'])
-            if step_hours_left:
-                self.elapsed_before_recovery = int((self.step_hours - float(step_hours_left)) * 3600)
-            else:
-                self.elapsed_before_recovery = 0
-            self.start_time = utime.time()
+            self._enter_step(step_index, step_elapsed)
+            if self.datalog:
+                # a recovered batch carries on with its log segment
+                self.datalog.open_batch(resume=resume)
             self.tim.deinit()
             utime.sleep_ms(100)
             self.tim.init(period=5000, mode=machine.Timer.PERIODIC, callback=self.job_queue)
@@ -206,13 +257,36 @@ class Process:
         else:
             logger.info('Pls load fermentation steps before starting the process.')
 
+    def set_target_temp(self, temp):
+        """
+        change the target temperature of the current step,
+        the step is updated too so the change survives a crash recovery
+        :param temp: float; target temperature in Celsius
+        """
+        if not self.has_started() or self.has_completed():
+            raise ValueError('No fermentation step in progress.')
+        # the steps are copied, not modified: a published snapshot may still refer to them
+        steps = list(self.fermentation_steps)
+        step = steps[self.current_step_index].copy()
+        step['temp'] = float(temp)
+        steps[self.current_step_index] = step
+        schedule = Schedule(steps)
+        with self.lock:
+            self.fermentation_steps = steps
+            self.schedule = schedule
+            self.step_target_temp = schedule.target_temp(self.current_step_index, self.elapsed_time)
+        logger.info('The target temperature of the current step has been set to ' + str(self.step_target_temp))
+
     def abort(self):
         self.tim.deinit()
-        self.start_time = None
-        self.is_completed = False
-        self.elapsed_time = None
+        with self.lock:
+            self.start_time = None
+            self.is_completed = False
+            self.elapsed_time = None
         self.fermenter_temp_ctrl.reset()
         self.recovery.remove_backup()
+        if self.datalog:
+            self.datalog.close_batch()
         logger.info('The fermentation process has been terminated by the user.')
 
     def has_started(self):
@@ -246,32 +320,48 @@ class Process:
         """
         return self.is_completed
 
+    def refresh_snapshot(self, read_sensors=True):
+        """
+        Build the process info once and publish it to all the readers (HTTP, MQTT, backup, event hub)
+        A snapshot is replaced as a whole and never modified afterwards, so the readers need no lock
+        and never see a half updated state.
+        :param read_sensors: bool; take the latest readings of the sensors, False keeps the temperatures of the last snapshot
+        :return: dict; the new snapshot
+        """
+        if read_sensors or self.snapshot is None:
+            self.sensor_temps = (self.fermenter_temp_ctrl.wort_sensor.read_temp(),
+                                 self.fermenter_temp_ctrl.chamber_sensor.read_temp())
+        with self.lock:
+            snapshot = self._build_process_info(*self.sensor_temps)
+        self.snapshot = snapshot
+        return snapshot
+
     def get_process_info(self):
         """
         get fermentation stage info, for API
+        this is the last published snapshot, it must not be modified
         """
+        return self.snapshot or self.refresh_snapshot()
+
+    def _build_process_info(self, wort_temp, chamber_temp):
         is_heating = self.fermenter_temp_ctrl.heater.is_on()
         is_cooling = self.fermenter_temp_ctrl.cooler.is_on()
-        wort_temp = self.fermenter_temp_ctrl.wort_sensor.read_temp()
-        chamber_temp = self.fermenter_temp_ctrl.chamber_sensor.read_temp()
+        hydrometer_data = self.hydrometer_data.copy()
         # if fermentation in progress
         if self.has_started():
             machine_status = 'done' if self.is_completed else 'running'
             target_temp = round(self.step_target_temp, 1)
             total_steps = self.total_steps
             current_step = self.current_step_index + 1
-            step_percentage = int((self.elapsed_time / (self.step_hours * 3600)) * 100)
-            total_percentage = int((sum([step['days'] for step in self.fermentation_steps[:self.current_step_index]]) * 24 * 3600 + self.elapsed_time) / (sum([step['days'] for step in self.fermentation_steps]) * 24 * 3600) * 100)
-            step_hours_left = round((self.step_hours * 3600 - self.elapsed_time) / 3600, 2)
-            total_hours_left = round((sum([step['days'] for step in self.fermentation_steps[self.current_step_index:]]) * 24 * 3600 - self.elapsed_time) / 3600, 2)
-            if step_percentage > 100:
-                step_percentage = 100
-            if total_percentage > 100:
-                total_percentage = 100
+            schedule = self.schedule
+            step_percentage = schedule.step_percentage(self.current_step_index, self.elapsed_time)
+            total_percentage = schedule.total_percentage(self.current_step_index, self.elapsed_time)
+            step_hours_left = schedule.step_hours_left(self.current_step_index, self.elapsed_time)
+            total_hours_left = schedule.total_hours_left(self.current_step_index, self.elapsed_time)
             return {
                 'machineStatus': machine_status,  # str
                 'setTemp': target_temp,  # float
-                'wortTemp': wort_temp if wort_temp is not None else self.hydrometer_data.get('temperature'),  # float
+                'wortTemp': wort_temp if wort_temp is not None else hydrometer_data.get('temperature'),  # float
                 'chamberTemp': chamber_temp,  # float
                 'isHeating': is_heating,  # bool
                 'isCooling': is_cooling,  # bool
@@ -284,7 +374,7 @@ class Process:
                 'totalHoursLeft': total_hours_left,  # float
                 'currentFermentationStepPercentage': step_percentage,  # int
                 'totalFermentationStepPercentage': total_percentage,  # int
-                'hydrometerData': self.hydrometer_data
+                'hydrometerData': hydrometer_data
             }
         else:
             machine_status = 'standby'
@@ -304,5 +394,26 @@ class Process:
                 'totalHoursLeft': None,
                 'currentFermentationStepPercentage': None,
                 'totalFermentationStepPercentage': None,
-                'hydrometerData': self.hydrometer_data
+                'hydrometerData': hydrometer_data
             }
+
+    def get_live_state(self):
+        """
+        compact realtime state, pushed to the front end by the event hub whenever it changes
+        """
+        process_info = self.get_process_info()
+        hydrometer_data = process_info.get('hydrometerData')
+        return {
+            'machineStatus': process_info.get('machineStatus'),  # str
+            'setTemp': process_info.get('setTemp'),  # float
+            'wortTemp': process_info.get('wortTemp'),  # float
+            'chamberTemp': process_info.get('chamberTemp'),  # float
+            'isHeating': process_info.get('isHeating'),  # bool
+            'isCooling': process_info.get('isCooling'),  # bool
+            'currentFermentationStepIndex': process_info.get('currentFermentationStepIndex'),  # int
+            'currentFermentationStepPercentage': process_info.get('currentFermentationStepPercentage'),  # int
+            'totalFermentationStepPercentage': process_info.get('totalFermentationStepPercentage'),  # int
+            'hydrometerIsOnline': self.hydrometer_status.get('is_online'),  # bool
+            'currentGravity': hydrometer_data.get('currentGravity'),  # float
+            'batteryLevel': hydrometer_data.get('batteryLevel')  # float
+        }
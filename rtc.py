@@ -31,6 +31,7 @@ class RealTimeClock:
         self.period_ms = update_period * 1000
         self.last_time = None
         self.rtc_tim = None
+        self.is_syncing = False
 
     def _time(self):
         NTP_QUERY = bytearray(48)
@@ -86,11 +87,23 @@ class RealTimeClock:
         if self.period_ms >= 300000 and not self.rtc_tim:
             this = self
             def rtc_tim_cb(t):
-                import _thread
-                rtc_th = _thread.start_new_thread(this._ntp_sync, ())
+                # a sync still running (eg. ntp servers unreachable) is not stacked with another thread
+                if not this.is_syncing:
+                    import _thread
+                    this.is_syncing = True
+                    try:
+                        _thread.start_new_thread(this._periodic_sync, ())
+                    except Exception:
+                        this.is_syncing = False
             self.rtc_tim = machine.Timer(-1)
             self.rtc_tim.init(period=self.period_ms, mode=machine.Timer.PERIODIC, callback=rtc_tim_cb)
 
+    def _periodic_sync(self):
+        try:
+            self._ntp_sync()
+        finally:
+            self.is_syncing = False
+
     def is_synced(self):
         return self.last_time is not None
 
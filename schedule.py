@@ -0,0 +1,103 @@
+STEP_HOLD = 'hold'
+STEP_RAMP = 'ramp'
+STEP_GRAVITY = 'gravity'
+
+
+class Schedule:
+    """
+    Fermentation steps compiled once into prefix-summed offsets, in seconds from the start of the first step
+    Every progress query is then O(1), and finding the step active at a given time is a binary search.
+
+    Step kinds, 'type' defaults to 'hold':
+    {'days': 2, 'temp': 18.6}  # hold the temperature for 2 days
+    {'type': 'ramp', 'days': 1, 'temp': 21.0}  # from the temperature of the previous step (or 'fromTemp') to 21.0 in 1 day
+    {'type': 'gravity', 'days': 10, 'temp': 20.0, 'gravity': 1.012}  # hold until the gravity drops to 1.012, 10 days at most
+    """
+    def __init__(self, steps):
+        """
+        :param steps: list; the fermentation steps, eg. [{'days': 2, 'temp': 18.6}, {'days': 14, 'temp': 21.5}]
+        """
+        self.steps = steps
+        self.count = len(steps)
+        self.kinds = []
+        self.temps = []
+        self.from_temps = []
+        self.gravities = []
+        # offsets[i] is the start of step i, offsets[i + 1] its end
+        self.offsets = [0]
+        prev_temp = None
+        for i, step in enumerate(steps):
+            kind = step.get('type', STEP_HOLD)
+            if kind not in (STEP_HOLD, STEP_RAMP, STEP_GRAVITY):
+                raise ValueError('Step %d: unknown type %s' % (i + 1, kind))
+            try:
+                days = float(step['days'])
+                temp = float(step['temp'])
+                from_temp = float(step.get('fromTemp', prev_temp if prev_temp is not None else temp))
+                gravity = float(step['gravity']) if kind == STEP_GRAVITY else None
+            except (KeyError, TypeError, ValueError):
+                raise ValueError('Step %d: days, temp (and gravity) must be numbers' % (i + 1))
+            if days <= 0:
+                raise ValueError('Step %d: days must be positive' % (i + 1))
+            self.kinds.append(kind)
+            self.temps.append(temp)
+            # a ramp starts from the previous target, the first one from its own target
+            self.from_temps.append(from_temp if kind == STEP_RAMP else temp)
+            self.gravities.append(gravity)
+            self.offsets.append(self.offsets[-1] + int(days * 86400))
+            prev_temp = temp
+        self.total_seconds = self.offsets[-1]
+
+    def step_seconds(self, index):
+        return self.offsets[index + 1] - self.offsets[index]
+
+    def step_at(self, seconds):
+        """
+        Find the step active at a time, by binary search
+        :param seconds: int; elapsed time since the start of the first step
+        :return: int; step index, the last step once the schedule is over
+        """
+        lo = 0
+        hi = self.count - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.offsets[mid] <= seconds:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def target_temp(self, index, step_elapsed):
+        """
+        :param step_elapsed: int; seconds since the start of the step
+        :return: float; the target temperature, interpolated along a ramp
+        """
+        temp = self.temps[index]
+        if self.kinds[index] != STEP_RAMP:
+            return temp
+        from_temp = self.from_temps[index]
+        ratio = min(max(step_elapsed / self.step_seconds(index), 0), 1)
+        return from_temp + (temp - from_temp) * ratio
+
+    def is_step_done(self, index, step_elapsed, gravity=None):
+        """
+        :param gravity: float; current specific gravity, None if the hydrometer is offline
+        :return: bool; whether the step is over, by time or by gravity
+        """
+        if step_elapsed >= self.step_seconds(index):
+            return True
+        target_gravity = self.gravities[index]
+        return target_gravity is not None and gravity is not None and gravity <= target_gravity
+
+    def step_percentage(self, index, step_elapsed):
+        return min(int(step_elapsed * 100 / self.step_seconds(index)), 100)
+
+    def total_percentage(self, index, step_elapsed):
+        elapsed = self.offsets[index] + min(step_elapsed, self.step_seconds(index))
+        return min(int(elapsed * 100 / self.total_seconds), 100)
+
+    def step_hours_left(self, index, step_elapsed):
+        return round((self.step_seconds(index) - step_elapsed) / 3600, 2)
+
+    def total_hours_left(self, index, step_elapsed):
+        return round((self.total_seconds - self.offsets[index] - step_elapsed) / 3600, 2)
@@ -0,0 +1,191 @@
+import _thread
+import uos
+import ujson
+
+from jsonwriter import JSONWriter
+from logger import init_logger
+
+logger = init_logger(__name__)
+
+
+class SettingsConflict(Exception):
+    pass
+
+
+class Settings:
+    """
+    User settings, loaded once from user_settings.json and read from RAM afterwards
+    An update is validated, gets a new version, is written to a temp file renamed over the
+    settings file, and is handed to the subscribers of the changed keys, so eg. new PID gains
+    apply without a reboot.
+
+    Usage example:
+
+    settings = Settings()
+    settings.subscribe('pid', lambda pid: fermenter_pid.set_gains(pid['kp'], pid['ki'], pid['kd']))
+    settings.update({'pid': {'kp': 3}}, version=settings.version)
+    """
+    # expected type of every key, nested dicts are merged key by key on update
+    SCHEMA = {
+        'breweryName': str,
+        'wortSensorDev': str,
+        'chamberSensorDev': str,
+        'wortSensorResolution': int,
+        'chamberSensorResolution': int,
+        'apSsid': str,
+        'wifi': {
+            'ssid': str,
+            'pass': str
+        },
+        'mqtt': {
+            'enabled': bool,
+            'brokerAddr': str,
+            'brokerPort': int,
+            'username': str,
+            'password': str,
+            'topic': str,
+            'pubIntervalMs': int
+        },
+        'pid': {
+            'kp': float,
+            'ki': float,
+            'kd': float
+        }
+    }
+
+    def __init__(self, filename='user_settings.json'):
+        """
+        :param filename: str; the settings file, filename + '.tmp' is used while saving
+        """
+        self.filename = filename
+        self.tmp_filename = filename + '.tmp'
+        self.lock = _thread.allocate_lock()
+        self.subscribers = {}
+        self.data = self._load()
+        self.version = self.data.pop('version', 0)
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                return ujson.load(f)
+        except Exception:
+            # the device went down between removing the old file and renaming the new one
+            logger.warning('Failed to load ' + self.filename + ', trying the temp file.')
+            with open(self.tmp_filename, 'r') as f:
+                return ujson.load(f)
+
+    def _save(self, new_data, version):
+        data = new_data.copy()
+        data['version'] = version
+        with open(self.tmp_filename, 'wb') as f:
+            JSONWriter(f.write).dump(data).flush()
+        try:
+            uos.rename(self.tmp_filename, self.filename)
+        except OSError:
+            # FAT doesn't rename over an existing file, _load() falls back to the temp file meanwhile
+            uos.remove(self.filename)
+            uos.rename(self.tmp_filename, self.filename)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def get_all(self):
+        """
+        :return: dict; a copy of all the settings, with their version
+        """
+        all_settings = {key: value.copy() if isinstance(value, dict) else value for key, value in self.data.items()}
+        all_settings['version'] = self.version
+        return all_settings
+
+    def subscribe(self, key, callback):
+        """
+        :param key: str; a top level key, eg. 'pid'
+        :param callback: callable; called with the new value of the key whenever it changes
+        """
+        self.subscribers.setdefault(key, []).append(callback)
+
+    def _validate(self, schema, new_dict, path=''):
+        """
+        Keep the known keys of new_dict only, with their values checked against the schema
+        :return: dict; the valid settings
+        """
+        valid = {}
+        for key, expected in schema.items():
+            if key not in new_dict:
+                continue
+            value = new_dict[key]
+            if isinstance(expected, dict):
+                if not isinstance(value, dict):
+                    raise ValueError(path + key + ' must be an object')
+                valid[key] = self._validate(expected, value, path + key + '.')
+            elif expected is float and type(value) in (int, float):
+                valid[key] = float(value)
+            elif type(value) is expected:
+                valid[key] = value
+            else:
+                raise ValueError(path + key + ' has a wrong type')
+        return valid
+
+    def validate(self, new_dict):
+        valid = self._validate(self.SCHEMA, new_dict)
+        mqtt = valid.get('mqtt', {})
+        if not 0 < mqtt.get('brokerPort', 1883) < 65536:
+            raise ValueError('mqtt.brokerPort is out of range')
+        if mqtt.get('pubIntervalMs', 1000) < 1000:
+            raise ValueError('mqtt.pubIntervalMs must be at least 1000')
+        for key in ('wortSensorDev', 'chamberSensorDev'):
+            if valid.get(key):
+                try:
+                    int(valid[key], 16)
+                except ValueError:
+                    raise ValueError(key + ' must be a hex ROM code')
+        for key in ('wortSensorResolution', 'chamberSensorResolution'):
+            if key in valid and not 9 <= valid[key] <= 12:
+                raise ValueError(key + ' must be 9 to 12 bits')
+        return valid
+
+    def update(self, new_dict, version=None):
+        """
+        Validate, save and apply new settings, unknown keys are ignored
+        :param new_dict: dict; all or part of the settings
+        :param version: int; the version the changes are based on, None to skip the check
+        :return: list; the keys which have changed
+        """
+        valid = self.validate(new_dict)
+        with self.lock:
+            if version is not None and version != self.version:
+                raise SettingsConflict('Settings have been changed meanwhile')
+            changed = []
+            new_data = self.data.copy()
+            for key, value in valid.items():
+                if isinstance(value, dict):
+                    merged = new_data.get(key, {}).copy()
+                    merged.update(value)
+                    value = merged
+                if new_data.get(key) != value:
+                    new_data[key] = value
+                    changed.append(key)
+            if changed:
+                # saved first, so the RAM never holds settings the file doesn't have
+                self._save(new_data, self.version + 1)
+                self.data = new_data
+                self.version += 1
+        for key in changed:
+            for callback in self.subscribers.get(key, []):
+                try:
+                    callback(self.data[key])
+                except Exception as e:
+                    logger.exception(e, 'Failed to apply the new settings of ' + key)
+        if changed:
+            logger.info('Settings updated to version ' + str(self.version))
+        return changed
+
+    def needs_reboot(self, keys):
+        """
+        :param keys: list; changed keys
+        :return: bool; whether some of them are only applied at boot
+        """
+        return any(key not in self.subscribers for key in keys if key != 'breweryName')
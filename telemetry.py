@@ -0,0 +1,296 @@
+import _thread
+import utime
+from array import array
+
+# sample flags
+FLAG_HEATING = 0x01
+FLAG_COOLING = 0x02
+
+# temperatures are stored in 1/100 °C, gravities in 1/10000 SG, duty cycles in %
+TEMP_SCALE = 100
+GRAVITY_SCALE = 10000
+# stored for a missing reading
+NO_TEMP = -32768
+NO_GRAVITY = 0
+
+# temperature channels of a bucket, in this order
+CHANNELS = ('setTemp', 'wortTemp', 'chamberTemp')
+
+
+def to_temp(temp):
+    """
+    :return: int; the temperature in fixed-point, NO_TEMP if unknown
+    """
+    if temp is None:
+        return NO_TEMP
+    return max(-32767, min(32767, int(round(temp * TEMP_SCALE))))
+
+
+def to_gravity(gravity):
+    """
+    :return: int; the gravity in fixed-point, NO_GRAVITY if unknown
+    """
+    if not gravity:
+        return NO_GRAVITY
+    return max(1, min(65535, int(round(gravity * GRAVITY_SCALE))))
+
+
+def sample_values(process_info):
+    """
+    The values recorded from a snapshot of Process
+    :return: tuple; set temp, wort temp, chamber temp, gravity & flags
+    """
+    flags = 0
+    if process_info.get('isHeating'):
+        flags |= FLAG_HEATING
+    if process_info.get('isCooling'):
+        flags |= FLAG_COOLING
+    hydrometer_data = process_info.get('hydrometerData') or {}
+    return (process_info.get('setTemp'), process_info.get('wortTemp'), process_info.get('chamberTemp'),
+            hydrometer_data.get('currentGravity'), flags)
+
+
+class RollupTier:
+    """
+    Ring buffer of fixed-length buckets, each one summarising the inputs of its period:
+    min, max, mean and last of every temperature channel, heater & cooler duty cycles and the last gravity
+    Every field is a fixed-point column in an array, a bucket takes 32 bytes.
+    """
+    def __init__(self, period_s, capacity):
+        """
+        :param period_s: int; length of a bucket in seconds
+        :param capacity: int; number of buckets kept, the oldest ones are overwritten
+        """
+        self.period = period_s
+        self.capacity = capacity
+        self.times = array('I', bytes(4 * capacity))  # start of the bucket, utime.time()
+        # channel c of bucket i is at index i * 3 + c
+        self.mins = array('h', bytes(2 * 3 * capacity))
+        self.maxs = array('h', bytes(2 * 3 * capacity))
+        self.means = array('h', bytes(2 * 3 * capacity))
+        self.lasts = array('h', bytes(2 * 3 * capacity))
+        self.heating = bytearray(capacity)
+        self.cooling = bytearray(capacity)
+        self.gravities = array('H', bytes(2 * capacity))
+        # number of buckets closed so far, bucket n is at index n % capacity
+        self.seq = 0
+        self.start = None
+        self._reset(None)
+
+    def _reset(self, start):
+        # accumulators of the open bucket
+        self.start = start
+        self.acc_min = [32767, 32767, 32767]
+        self.acc_max = [-32767, -32767, -32767]
+        self.acc_sum = [0, 0, 0]
+        self.acc_count = [0, 0, 0]
+        self.acc_last = [NO_TEMP, NO_TEMP, NO_TEMP]
+        self.acc_heating = 0
+        self.acc_cooling = 0
+        self.acc_weight = 0
+        self.acc_gravity = NO_GRAVITY
+
+    def add(self, timestamp, mins, maxs, means, lasts, heating, cooling, gravity, weight=1):
+        """
+        Merge a sample, or a bucket of the finer tier, into the open bucket
+        :param timestamp: int; seconds, utime.time()
+        :param mins, maxs, means, lasts: list; fixed-point temps of the 3 channels
+        :param heating, cooling: int; duty cycles in %
+        :param gravity: int; fixed-point gravity
+        :param weight: int; number of samples merged in the input
+        :return: tuple; the bucket closed by this input, to be merged into the coarser tier, None if still open
+        """
+        start = timestamp - timestamp % self.period
+        closed = None
+        if self.start is not None and start != self.start:
+            if start < self.start:
+                # the clock has been set back, keep filling the open bucket
+                start = self.start
+            else:
+                closed = self._close()
+        if self.start is None:
+            self._reset(start)
+        for c in range(3):
+            if means[c] == NO_TEMP:
+                continue
+            if mins[c] < self.acc_min[c]:
+                self.acc_min[c] = mins[c]
+            if maxs[c] > self.acc_max[c]:
+                self.acc_max[c] = maxs[c]
+            self.acc_sum[c] += means[c] * weight
+            self.acc_count[c] += weight
+            self.acc_last[c] = lasts[c]
+        self.acc_heating += heating * weight
+        self.acc_cooling += cooling * weight
+        self.acc_weight += weight
+        if gravity != NO_GRAVITY:
+            self.acc_gravity = gravity
+        return closed
+
+    def _close(self):
+        i = self.seq % self.capacity
+        self.times[i] = self.start
+        means = []
+        for c in range(3):
+            count = self.acc_count[c]
+            if count:
+                mean = int(round(self.acc_sum[c] / count))
+                self.mins[i * 3 + c] = self.acc_min[c]
+                self.maxs[i * 3 + c] = self.acc_max[c]
+            else:
+                mean = NO_TEMP
+                self.mins[i * 3 + c] = self.maxs[i * 3 + c] = NO_TEMP
+            self.means[i * 3 + c] = mean
+            self.lasts[i * 3 + c] = self.acc_last[c]
+            means.append(mean)
+        heating = self.acc_heating // self.acc_weight
+        cooling = self.acc_cooling // self.acc_weight
+        self.heating[i] = heating
+        self.cooling[i] = cooling
+        self.gravities[i] = self.acc_gravity
+        self.seq += 1
+        bucket = (self.start, self.acc_min, self.acc_max, means, self.acc_last,
+                  heating, cooling, self.acc_gravity, self.acc_weight)
+        self.start = None
+        return bucket
+
+    def get_oldest_seq(self):
+        return max(self.seq - self.capacity, 0)
+
+    def find_seq(self, timestamp):
+        """
+        First bucket ending after a time, by binary search, the buckets are in chronological order
+        :return: int; sequence number, self.seq if there is none
+        """
+        lo = self.get_oldest_seq()
+        hi = self.seq
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid % self.capacity] + self.period <= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class Telemetry:
+    """
+    History of the fermenter kept in RAM, as cascading rollup tiers, eg. 1 min, 15 min & 1 hour buckets
+    Every sample of the control loop is merged into the open bucket of the finest tier, a closed bucket is
+    merged into the next tier, so the whole batch is always summarised by a few hundred buckets.
+    The buckets are stored in preallocated arrays, only a few small lists & tuples are allocated per sample.
+    Buckets are numbered by a sequence number per tier, a client asks for the buckets after the last one it has got.
+
+    Usage example:
+
+    telemetry = Telemetry(tiers=((60, 120), (900, 96), (3600, 504)))
+    telemetry.sample(process.get_process_info())  # called by the control loop
+    telemetry.get_history(telemetry.select_tier(86400, 200), start_time=utime.time() - 86400)  # for /history
+    """
+    def __init__(self, tiers=((60, 120), (900, 96), (3600, 504))):
+        """
+        :param tiers: tuple; (period_s, capacity) of every tier, from the finest to the coarsest
+        """
+        self.tiers = [RollupTier(period_s, capacity) for period_s, capacity in tiers]
+        self.lock = _thread.allocate_lock()
+
+    def add(self, timestamp, set_temp, wort_temp, chamber_temp, gravity, flags=0):
+        """
+        :param timestamp: int; seconds, utime.time()
+        :param set_temp, wort_temp, chamber_temp: float; °C, None if unknown
+        :param gravity: float; specific gravity, None if unknown
+        :param flags: int; FLAG_HEATING | FLAG_COOLING
+        """
+        temps = [to_temp(set_temp), to_temp(wort_temp), to_temp(chamber_temp)]
+        bucket = (timestamp, temps, temps, temps, temps,
+                  100 if flags & FLAG_HEATING else 0, 100 if flags & FLAG_COOLING else 0,
+                  to_gravity(gravity), 1)
+        with self.lock:
+            for tier in self.tiers:
+                bucket = tier.add(*bucket)
+                if bucket is None:
+                    break
+
+    def sample(self, process_info):
+        """
+        Add a sample of the process info
+        :param process_info: dict; a snapshot of Process
+        """
+        self.add(utime.time(), *sample_values(process_info))
+
+    def get_tier(self, period_s):
+        """
+        :return: Class; the tier of this period, None if there is none
+        """
+        for tier in self.tiers:
+            if tier.period == period_s:
+                return tier
+        return None
+
+    def get_oldest_time(self):
+        """
+        :return: int; start of the oldest bucket kept, None if there is none yet
+        """
+        tier = self.tiers[-1]
+        if tier.seq:
+            return tier.times[tier.get_oldest_seq() % tier.capacity]
+        return tier.start
+
+    def select_tier(self, window_s, points):
+        """
+        The finest tier which keeps the whole window in at most the given number of buckets
+        :param window_s: int; length of the requested time range
+        :param points: int; max number of buckets the client wants
+        :return: Class; the tier, the coarsest one if none fits
+        """
+        for tier in self.tiers:
+            if window_s <= tier.period * min(points, tier.capacity):
+                return tier
+        return self.tiers[-1]
+
+    def get_history(self, tier, since=0, start_time=0, end_time=None, limit=200):
+        """
+        Buckets of a tier as fixed-point columns: small ints take no heap, temps are to be divided
+        by tempScale, gravities by gravityScale, duty cycles are in %, null means unknown
+        :param tier: Class; the tier, see select_tier()
+        :param since: int; the 'next' of the previous call, 0 for all the buckets kept
+        :param start_time, end_time: int; time range, utime.time()
+        :param limit: int; max number of buckets returned, 'more' tells if some are left
+        :return: dict; the buckets
+        """
+        with self.lock:
+            if since > tier.seq:
+                # the device has rebooted since the client's last request
+                since = 0
+            start = max(since, tier.find_seq(start_time) if start_time else 0, tier.get_oldest_seq())
+            end = start
+            while end < tier.seq and end - start < limit:
+                if end_time is not None and tier.times[end % tier.capacity] > end_time:
+                    break
+                end += 1
+            indexes = [seq % tier.capacity for seq in range(start, end)]
+            history = {
+                'tier': tier.period,
+                'since': start,
+                'next': end,
+                'more': end - start == limit and end < tier.seq,
+                'now': utime.time(),
+                'tempScale': TEMP_SCALE,
+                'gravityScale': GRAVITY_SCALE,
+                'time': [tier.times[i] for i in indexes],
+                'heatingDuty': [tier.heating[i] for i in indexes],
+                'coolingDuty': [tier.cooling[i] for i in indexes],
+                'gravity': [self._column_value(tier.gravities[i], NO_GRAVITY) for i in indexes]
+            }
+            for c, channel in enumerate(CHANNELS):
+                history[channel] = {
+                    'min': [self._column_value(tier.mins[i * 3 + c], NO_TEMP) for i in indexes],
+                    'max': [self._column_value(tier.maxs[i * 3 + c], NO_TEMP) for i in indexes],
+                    'mean': [self._column_value(tier.means[i * 3 + c], NO_TEMP) for i in indexes],
+                    'last': [self._column_value(tier.lasts[i * 3 + c], NO_TEMP) for i in indexes]
+                }
+        return history
+
+    @staticmethod
+    def _column_value(value, missing):
+        return None if value == missing else value
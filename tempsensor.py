@@ -1,6 +1,7 @@
 import ds18x20
 import machine
 import onewire
+import utime
 
 from logger import init_logger
 
@@ -34,18 +35,309 @@ class RomCodeConvert:
 
 
 class Ds18Sensors(RomCodeConvert):
-    def __init__(self, pin):
+    """
+    The DS18B20 sensors of the OneWire bus, measured by a split-phase scheduler driven by a timer:
+    all the sensors are told to convert, the timer fires again once the conversion time of the resolution
+    has elapsed to collect the scratchpads, then the readings are published. Nothing waits on the bus,
+    and the readers only get the cached readings, so they never cause any OneWire traffic.
+    A reading is a tuple (temperature, ticks_ms of the measurement, CRC valid): after a failed read the last
+    valid temperature is kept with its age and the flag cleared, a reader decides what is fresh enough.
+    The ROM codes found on the bus are cached as a registry, numbered by a generation which changes whenever a
+    sensor is plugged or unplugged. The bus is searched again before a measurement only after a failed read,
+    with an exponential backoff while a registered sensor stays missing, or every rescan_interval_ms.
+    Every sensor may have its own resolution, written to its configuration register by the scheduler, and
+    the conversion lasts as long as the slowest sensor of the bus needs. The register is checked in every
+    scratchpad read, a sensor reset by a brown-out is configured again before the next measurement.
+
+    Usage example:
+
+    temp_sensors = Ds18Sensors(pin=25)
+    temp_sensors.start(machine.Timer(2), interval_ms=2000, on_update=publish)
+    temp_sensors.get_reading(romcode)
+    """
+    # conversion time by resolution, in ms
+    CONVERSION_MS = {9: 94, 10: 188, 11: 375, 12: 750}
+    # value of the configuration register by resolution
+    CONFIG_REGISTER = {9: 0x1f, 10: 0x3f, 11: 0x5f, 12: 0x7f}
+    # family code of the DS18S20, which has a fixed resolution
+    FAMILY_DS18S20 = 0x10
+
+    def __init__(self, pin, resolution=12, rescan_interval_ms=600000, backoff_min_ms=2000, backoff_max_ms=300000):
         """
         Initialize the DS18 temperature sensor
         :param pin: int; GPIO for OneWire
+        :param resolution: int; bits, 9 to 12, assumed for a sensor whose configuration register can't be read
+        :param rescan_interval_ms: int; the bus is searched this often for hot-plugged sensors
+        :param backoff_min_ms, backoff_max_ms: int; range of the delay before searching again after a failed read
         """
         self.ow = onewire.OneWire(machine.Pin(pin))
         self.ds = ds18x20.DS18X20(self.ow)
-        self.device_list = None
-        self.last_reading_available = False
+        self.resolution = resolution
+        self.conversion_ms = self.CONVERSION_MS[resolution]
+        # resolutions wanted by romcode, & the ones read from the configuration registers
+        self.resolutions = {}
+        self.device_resolutions = {}
+        self.configure_needed = True
+        # registry of the ROM codes found by the last search, as a list for the order & a set for the lookups
+        self.device_list = []
+        self.device_set = set()
+        self.generation = 0
+        self.scan_time = None
+        self.rescan_interval_ms = rescan_interval_ms
+        self.backoff_min_ms = backoff_min_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.backoff_ms = backoff_min_ms
+        self.rescan_needed = False
+        # romcodes of the SingleTempSensor instances, read even if a scan has missed them
+        self.romcodes = []
+        # latest reading by romcode, None until the first measurement
+        self.readings = None
+        self.tim = None
+        self.requested_interval_ms = 2000
+        self.interval_ms = 2000
+        # readings older than this are not used by SingleTempSensor.read_temp()
+        self.max_age_ms = 3 * self.interval_ms
+        self.on_update = None
+        self.cycle_start = None
+        self._scan()
+        self.backoff_ms = self.backoff_min_ms
+
+    def _scan(self):
+        """
+        Search the ROM codes of the bus, the generation changes if the sensors found differ from the last search
+        """
+        self.scan_time = utime.ticks_ms()
+        self.rescan_needed = False
+        try:
+            device_list = self.ds.scan()
+        except Exception as e:
+            logger.exception(e, 'Failed to scan the OneWire bus.')
+            device_list = None
+        else:
+            device_set = set(bytes(romcode) for romcode in device_list)
+            if device_set != self.device_set:
+                self.device_list = device_list
+                self.device_set = device_set
+                self.generation += 1
+                # a plugged sensor starts with the resolution saved in its EEPROM
+                self.configure_needed = True
+                logger.info('Found ' + str(len(device_list)) + ' DS18B20 sensors.')
+        missing = [romcode for romcode in self.romcodes if not self.is_present(romcode)]
+        if missing or not device_list:
+            # search less and less often while a sensor stays away
+            self.rescan_needed = True
+            self.backoff_ms = min(self.backoff_ms * 2, self.backoff_max_ms)
+        else:
+            self.backoff_ms = self.backoff_min_ms
+
+    def _rescan_due(self):
+        if self.scan_time is None:
+            return True
+        age = utime.ticks_diff(utime.ticks_ms(), self.scan_time)
+        if self.rescan_needed:
+            return age >= self.backoff_ms
+        return age >= self.rescan_interval_ms
+
+    def start(self, timer, interval_ms=2000, on_update=None):
+        """
+        :param timer: Class; the instance of the Timer class driving the measurements
+        :param interval_ms: int; time between the starts of two measurements
+        :param on_update: callable; called after every measurement, from the timer callback
+        """
+        self.tim = timer
+        self.requested_interval_ms = interval_ms
+        self._update_timing()
+        self.on_update = on_update
+        self._convert()
+
+    def _update_timing(self):
+        # the measurements can't be closer than the conversion time
+        self.interval_ms = max(self.requested_interval_ms, self.conversion_ms)
+        self.max_age_ms = 3 * self.interval_ms
+
+    def _configure(self):
+        """
+        Write the wanted resolutions into the configuration registers, and get the conversion time of the bus
+        """
+        self.configure_needed = False
+        resolutions = self.resolutions.copy()
+        device_resolutions = {}
+        for romcode in self.device_list:
+            key = bytes(romcode)
+            try:
+                if romcode[0] == self.FAMILY_DS18S20:
+                    device_resolutions[key] = 12
+                    continue
+                scratch = self.ds.read_scratch(romcode)
+                bits = self._get_resolution(scratch)
+                wanted = resolutions.get(key)
+                if wanted and wanted != bits:
+                    # TH & TL are written back unchanged
+                    self.ds.write_scratch(romcode, bytearray((scratch[2], scratch[3], self.CONFIG_REGISTER[wanted])))
+                    bits = wanted
+            except Exception as e:
+                logger.exception(e, 'Failed to configure DS18B20 ' + self.from_romcode_to_hex_string(romcode))
+                bits = self.resolution
+                self.rescan_needed = True
+            device_resolutions[key] = bits
+        self.device_resolutions = device_resolutions
+        self.conversion_ms = max([self.CONVERSION_MS[bits] for bits in device_resolutions.values()] or
+                                 [self.CONVERSION_MS[self.resolution]])
+        self._update_timing()
+
+    @staticmethod
+    def _get_resolution(scratch):
+        return ((scratch[4] >> 5) & 0x03) + 9
+
+    def _decode_temp(self, romcode, scratch):
+        """
+        The temperature of a scratchpad, as ds18x20.DS18X20.read_temp()
+        """
+        if romcode[0] == self.FAMILY_DS18S20:
+            if scratch[1]:
+                t = scratch[0] >> 1 | 0x80
+                t = -((~t + 1) & 0xff)
+            else:
+                t = scratch[0] >> 1
+            return t - 0.25 + (scratch[7] - scratch[6]) / scratch[7]
+        t = scratch[1] << 8 | scratch[0]
+        if t & 0x8000:
+            t = -((t ^ 0xffff) + 1)
+        return t / 16
+
+    def stop(self):
+        if self.tim:
+            self.tim.deinit()
+
+    def _schedule(self, delay_ms, callback):
+        self.tim.init(period=max(delay_ms, 1), mode=machine.Timer.ONE_SHOT, callback=callback)
+
+    def _convert(self, t=None):
+        """
+        Phase 1: start the conversion of all the sensors at once, and come back when it is done
+        """
+        self.cycle_start = utime.ticks_ms()
+        try:
+            if self._rescan_due():
+                self._scan()
+            if self.configure_needed:
+                self._configure()
+            self.ds.convert_temp()
+        except Exception as e:
+            # the readings get older until a conversion succeeds
+            logger.exception(e, 'Failed to start the conversion of the DS18B20 sensors.')
+            self.rescan_needed = True
+            self._schedule(self.interval_ms, self._convert)
+        else:
+            self._schedule(self.conversion_ms, self._collect)
+
+    def _collect(self, t=None):
+        """
+        Phase 2: read the scratchpads, publish the readings and wait for the next measurement
+        """
+        previous = self.readings or {}
+        readings = {}
+        for romcode in self._get_romcodes():
+            key = bytes(romcode)
+            try:
+                # the temperature & the configuration register in a single read
+                scratch = self.ds.read_scratch(romcode)
+                bits = self.device_resolutions.get(key)
+                if romcode[0] != self.FAMILY_DS18S20 and bits and self._get_resolution(scratch) != bits:
+                    # reset by a brown-out, back to the resolution of its EEPROM: the conversion may not be done
+                    logger.warning('DS18B20 ' + self.from_romcode_to_hex_string(romcode) + ' has been reset.')
+                    self.configure_needed = True
+                    raise ValueError('Wrong resolution')
+                readings[key] = (round(self._decode_temp(romcode, scratch), 1), utime.ticks_ms(), True)
+            except Exception:
+                # CRC error, disconnected or reset: a sensor coming back is configured again when the search
+                # finds it, or when its configuration register is read
+                self.rescan_needed = True
+                last = previous.get(key)
+                readings[key] = (last[0], last[1], False) if last else (None, utime.ticks_ms(), False)
+        # replaced as a whole, a reader never sees a half updated dict
+        self.readings = readings
+        if self.on_update:
+            try:
+                self.on_update()
+            except Exception as e:
+                logger.exception(e, 'Failed to publish the temperatures.')
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self.cycle_start)
+        self._schedule(self.interval_ms - elapsed, self._convert)
+
+    def _get_romcodes(self):
+        romcodes = list(self.device_list)
+        for romcode in self.romcodes:
+            if romcode not in romcodes:
+                romcodes.append(romcode)
+        return romcodes
+
+    def register(self, romcode, old_romcode=None, resolution=None):
+        """
+        Read a sensor at every measurement
+        :param romcode: bytearray; the new romcode of a SingleTempSensor
+        :param old_romcode: bytearray; its previous romcode, not read anymore
+        :param resolution: int; bits, 9 to 12, None to keep the one of the sensor
+        """
+        if old_romcode in self.romcodes:
+            self.romcodes.remove(old_romcode)
+            self.set_resolution(old_romcode, None)
+        if romcode:
+            self.romcodes.append(romcode)
+            self.set_resolution(romcode, resolution)
+
+    def set_resolution(self, romcode, resolution):
+        """
+        The configuration register is written by the scheduler before the next measurement
+        :param romcode: bytearray
+        :param resolution: int; bits, 9 to 12, None to keep the one of the sensor
+        """
+        if resolution is not None and resolution not in self.CONVERSION_MS:
+            raise ValueError('Resolution must be 9 to 12 bits')
+        key = bytes(romcode)
+        if resolution is None:
+            self.resolutions.pop(key, None)
+        else:
+            self.resolutions[key] = resolution
+        self.configure_needed = True
+
+    def get_max_sample_rate(self):
+        """
+        :return: float; measurements per second allowed by the conversion time of the slowest sensor
+        """
+        return round(1000 / self.conversion_ms, 2)
+
+    def get_reading(self, romcode):
+        """
+        :param romcode: bytearray
+        :return: tuple; (temperature in Celsius, ticks_ms of the measurement, CRC valid), None if never read
+        """
+        if not romcode or self.readings is None:
+            return None
+        return self.readings.get(bytes(romcode))
+
+    def has_measured(self):
+        return self.readings is not None
+
+    def is_present(self, romcode):
+        """
+        :param romcode: bytearray
+        :return: bool; whether the last search has found the sensor
+        """
+        return bool(romcode) and bytes(romcode) in self.device_set
+
+    def get_scan_age_ms(self):
+        """
+        :return: int; age of the ROM codes registry, None if the bus has never been searched
+        """
+        if self.scan_time is None:
+            return None
+        return utime.ticks_diff(utime.ticks_ms(), self.scan_time)
 
     def get_device_list(self):
-        self.device_list = self.ds.scan()
+        """
+        The sensors found by the last search, from the registry without any OneWire traffic
+        """
         return [
             {'value': self.from_romcode_to_hex_string(bytearray_romcode),
              'label': self.from_romcode_to_hex_string(bytearray_romcode)}
@@ -53,55 +345,69 @@ class Ds18Sensors(RomCodeConvert):
         ]
 
     def get_device_qty(self):
-        if not self.device_list:
-            self.device_list = self.ds.scan()
         return len(self.device_list)
-    
-    def get_realtime_temp(self):
-        """
-        Perform a measurement of the temperature and return the temperature
-        :return: float; realtime temperature in Celsius measured by the DS18 sensor
-        """
-        try:
-            self.ds.convert_temp()
-        except Exception as e:
-            logger.exception(e, 'Failed to read temp from DS18B20 sensors.')
-            self.last_reading_available = False
-        else:
-            self.last_reading_available = True
 
 
 class SingleTempSensor(RomCodeConvert):
-    def __init__(self, ds_obj, romcode_hex_string):
+    def __init__(self, ds_obj, romcode_hex_string, resolution=None):
+        """
+        :param ds_obj: Class; the instance of Ds18Sensors
+        :param romcode_hex_string: str; eg. '0x28aaec0119130238'
+        :param resolution: int; bits, 9 to 12, None to keep the one of the sensor
+        """
         self.romcode_hex_string = romcode_hex_string
         self.ds_obj = ds_obj
+        self.resolution = resolution
         self.is_connected = False
+        self.bytearray_romcode = None
         self.bytearray_romcode = self.update_romcode(romcode_hex_string)
 
-    def read_temp(self):
-        if not self.ds_obj.last_reading_available:
-            self.ds_obj.get_realtime_temp()
-        try:
-            temp = round(self.ds_obj.ds.read_temp(self.bytearray_romcode), 1)
-        except Exception as e:
+    def get_reading(self):
+        """
+        The cached reading, measured by Ds18Sensors
+        :return: tuple; (temperature in Celsius, age in ms, CRC valid), None if never read
+        """
+        reading = self.ds_obj.get_reading(self.bytearray_romcode)
+        if reading is None:
+            return None
+        temp, ticks, crc_ok = reading
+        return temp, utime.ticks_diff(utime.ticks_ms(), ticks), crc_ok
+
+    def get_age_ms(self):
+        """
+        :return: int; age of the cached temperature, None if never read
+        """
+        reading = self.get_reading()
+        return reading[1] if reading else None
+
+    def read_temp(self, max_age_ms=None):
+        """
+        :param max_age_ms: int; older readings are ignored, 3 measurement intervals by default
+        :return: float; the latest valid temperature measured by Ds18Sensors, None if not available
+        """
+        if not self.ds_obj.has_measured():
+            return None
+        reading = self.get_reading()
+        if max_age_ms is None:
+            max_age_ms = self.ds_obj.max_age_ms
+        if reading is None or not reading[2] or reading[1] > max_age_ms:
             if self.is_connected:
                 logger.warning('DS18B20 ' + str(self.romcode_hex_string) + ' was disconnected.  Check the wire.')
             self.is_connected = False
-            self.ds_obj.device_list = None
             return None
-        else:
-            self.is_connected = True
-            return temp
+        self.is_connected = True
+        return reading[0]
 
     def update_romcode(self, new_romcode_hex_string):
         self.romcode_hex_string = new_romcode_hex_string
-        self.ds_obj.last_reading_available = False
         try:
             new_romcode_bytearray = self.from_hex_string_to_romcode(new_romcode_hex_string)
         except Exception as e:
             logger.error('Invalid Romcode.')
             new_romcode_bytearray = None
-        if new_romcode_bytearray and new_romcode_bytearray in self.ds_obj.ds.scan():
+        self.ds_obj.register(new_romcode_bytearray, self.bytearray_romcode, self.resolution)
+        # the registry tells, without any OneWire traffic
+        if self.ds_obj.is_present(new_romcode_bytearray):
             self.is_connected = True
         else:
             self.is_connected = False
@@ -109,5 +415,13 @@ class SingleTempSensor(RomCodeConvert):
         self.bytearray_romcode = new_romcode_bytearray
         return new_romcode_bytearray
 
+    def set_resolution(self, resolution):
+        """
+        :param resolution: int; bits, 9 to 12, eg. 10 bits (188 ms) is enough for the chamber
+        """
+        if self.bytearray_romcode:
+            self.ds_obj.set_resolution(self.bytearray_romcode, resolution)
+        self.resolution = resolution
+
     def isconnected(self):
         return self.is_connected
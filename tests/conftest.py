@@ -0,0 +1,62 @@
+"""
+Run on the host with pytest, the MicroPython modules are replaced by minimal fakes
+"""
+import json
+import os
+import struct
+import sys
+import time
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Clock:
+    now = 700000000
+
+
+def _fake_module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules.setdefault(name, module)
+
+
+class _NullLogger:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Timer:
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, *args):
+        pass
+
+    def init(self, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+
+_fake_module('utime', time=lambda: Clock.now, localtime=time.gmtime, ticks_ms=lambda: Clock.now * 1000,
+             ticks_diff=lambda a, b: a - b, sleep_ms=lambda ms: None)
+_fake_module('machine', Timer=Timer)
+_fake_module('uos', listdir=os.listdir, stat=os.stat, mkdir=os.mkdir, remove=os.remove, rename=os.rename)
+_fake_module('ustruct', pack=struct.pack, unpack=struct.unpack, pack_into=struct.pack_into,
+             unpack_from=struct.unpack_from, calcsize=struct.calcsize)
+_fake_module('ujson', dumps=json.dumps, loads=json.loads, load=json.load)
+_fake_module('logger', init_logger=lambda name, filename=None: _NullLogger())
+
+
+@pytest.fixture
+def clock():
+    """
+    The time of utime.time(), restored after the test
+    """
+    now = Clock.now
+    yield Clock
+    Clock.now = now
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from datalog import DataLog, LogExport, CSV_HEADER, RECORD_SIZE, INDEX_SIZE
+
+
+@pytest.fixture
+def datalog(tmp_path, clock):
+    # 4 records per page, an index entry every 4 records
+    datalog = DataLog(str(tmp_path / 'log'), page_size=4 * RECORD_SIZE, index_every=4)
+    datalog.open_batch()
+    return datalog
+
+
+def _log(datalog, count):
+    for i in range(count):
+        datalog.append(datalog.batch + i * 10, 18.0, 18.0 + i / 100, None, 1.05 if i % 2 else None, i % 4)
+
+
+def test_append_writes_pages_and_index(datalog):
+    _log(datalog, 22)
+    batch = datalog.batch
+    assert datalog.get_batches() == [batch]
+    # 5 pages written, 2 records still buffered
+    assert os.path.getsize(datalog._filename(batch, 'bin')) == 20 * RECORD_SIZE
+    assert os.path.getsize(datalog._filename(batch, 'idx')) == 5 * INDEX_SIZE
+    assert datalog.get_count(batch) == 22
+    records = list(datalog.read_records(batch))
+    assert [values[0] - batch for values in records] == [i * 10 for i in range(22)]
+    assert records[21][1:] == (1800, 1821, -32768, 10500, 1)
+
+    datalog.close_batch()
+    assert datalog.get_count(batch) == 22
+
+
+def test_find_record_and_read_range(datalog):
+    _log(datalog, 22)
+    batch = datalog.batch
+    assert datalog.find_record(batch, batch) == 0
+    assert datalog.find_record(batch, batch + 55) == 6
+    assert datalog.find_record(batch, batch + 200) == 20
+    assert datalog.find_record(batch, batch + 1000) == 22
+    times = [values[0] - batch for values in datalog.read_range(batch, batch + 55, batch + 95)]
+    assert times == [60, 70, 80, 90]
+
+
+def test_resume_pads_a_cut_record(datalog):
+    _log(datalog, 8)
+    batch = datalog.batch
+    with open(datalog._filename(batch, 'bin'), 'ab') as f:
+        f.write(b'\x01' * 5)
+    datalog.open_batch(resume=True)
+    assert datalog.batch == batch
+    assert datalog.get_count(batch) == 9
+    datalog.append(batch + 90, 18.0, 18.0, None, None)
+    datalog.flush()
+    # the padding record is skipped, the next ones stay aligned
+    times = [values[0] - batch for values in datalog.read_range(batch)]
+    assert times == [0, 10, 20, 30, 40, 50, 60, 70, 90]
+
+
+@pytest.mark.parametrize('fmt', LogExport.FORMATS)
+def test_export_ranges(datalog, fmt):
+    _log(datalog, 22)
+    export = LogExport(datalog, datalog.batch, fmt)
+    text = b''.join(export.iter_chunks())
+    assert len(text) == export.get_length()
+    lines = text.splitlines(True)
+    if fmt == 'csv':
+        assert lines.pop(0) == CSV_HEADER
+    assert len(lines) == 22
+    assert len(set(len(line) for line in lines)) == 1
+    # a Range request resumes anywhere, even inside the header or a line
+    for start, end in ((0, 10), (5, 200), (len(CSV_HEADER) + 3, len(text) - 1), (100, 100), (len(text) - 7, None)):
+        chunks = list(export.iter_chunks(start, end, chunk_size=200))
+        assert all(len(chunk) <= 200 for chunk in chunks)
+        assert b''.join(chunks) == text[start:None if end is None else end + 1]
+
+
+def test_export_time_range(datalog):
+    _log(datalog, 22)
+    batch = datalog.batch
+    export = LogExport(datalog, batch, 'ndjson', start_time=batch + 55, end_time=batch + 95)
+    lines = b''.join(export.iter_chunks()).splitlines()
+    assert len(lines) == 4
+    assert lines[0].startswith(b'{"time":%10d,' % (batch + 60))
+    with pytest.raises(ValueError):
+        LogExport(datalog, batch, 'xml')
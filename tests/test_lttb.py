@@ -0,0 +1,41 @@
+import math
+
+import pytest
+
+from datalog import DataLog
+from lttb import downsample
+
+
+@pytest.fixture
+def datalog(tmp_path, clock):
+    datalog = DataLog(str(tmp_path / 'log'))
+    datalog.open_batch()
+    return datalog
+
+
+def test_downsample_keeps_the_endpoints_and_the_peaks(datalog):
+    batch = datalog.batch
+    for i in range(1000):
+        wort_temp = 20.0 + math.sin(i / 50) + (5.0 if i == 537 else 0)
+        # no set temp at the ends, no gravity at all
+        set_temp = 18.0 if 10 <= i < 990 else None
+        datalog.append(batch + i * 60, set_temp, wort_temp, 19.0, None)
+    chart = downsample(datalog, batch, 0, 1000, points=50)
+    wort = chart['wortTemp']
+    assert len(wort['time']) == 50
+    assert wort['time'][0] == batch and wort['time'][-1] == batch + 999 * 60
+    assert wort['time'] == sorted(wort['time'])
+    assert max(wort['value']) == int(round((20.0 + math.sin(537 / 50) + 5.0) * 100))
+    # endpoints of a series are its first & last values
+    assert chart['setTemp']['time'][0] == batch + 10 * 60
+    assert chart['setTemp']['time'][-1] == batch + 989 * 60
+    assert chart['gravity'] == {'time': [], 'value': []}
+
+
+def test_downsample_short_range(datalog):
+    batch = datalog.batch
+    for i in range(5):
+        datalog.append(batch + i * 60, 18.0, 20.0 + i, 19.0, 1.050)
+    chart = downsample(datalog, batch, 1, 4, points=50)
+    assert chart['wortTemp'] == {'time': [batch + 60, batch + 120, batch + 180], 'value': [2100, 2200, 2300]}
+    assert downsample(datalog, batch, 3, 3)['wortTemp'] == {'time': [], 'value': []}
@@ -0,0 +1,76 @@
+"""
+Process steps and recovery, see conftest.py for the fakes of the MicroPython modules
+"""
+import pytest
+
+from conftest import Timer
+from datalog import DataLog
+from process import Process
+
+
+class _Actuator:
+    def is_on(self):
+        return False
+
+
+class _Sensor:
+    def read_temp(self):
+        return 20.0
+
+
+class _TempControl:
+    heater = _Actuator()
+    cooler = _Actuator()
+    wort_sensor = _Sensor()
+    chamber_sensor = _Sensor()
+
+    def run(self, target_temp):
+        pass
+
+    def accomplished(self):
+        pass
+
+
+class _Recovery:
+    def get_interval_ms(self):
+        return 300000
+
+    def backing_up(self, process_info):
+        pass
+
+    def remove_backup(self):
+        pass
+
+
+class _MQTT:
+    def is_enabled(self):
+        return False
+
+
+@pytest.fixture
+def process(tmp_path):
+    datalog = DataLog(str(tmp_path / 'log'))
+    process = Process(_TempControl(), Timer(), _Recovery(), None, _MQTT(), datalog_obj=datalog)
+    process.load_steps([{'days': 1, 'temp': 18.0}, {'days': 2, 'temp': 20.0}])
+    return process
+
+
+def test_next_step_keeps_the_batch(process, clock):
+    process.start()
+    clock.now += 86400
+    process.job_queue(None)
+    assert process.current_step_index == 1
+    clock.now += 60
+    process.job_queue(None)
+    assert len(process.datalog.get_batches()) == 1
+
+
+def test_recovery_resumes_the_batch(process, clock):
+    process.start()
+    process.job_queue(None)
+    clock.now += 3600
+    # 6 hours into the 2nd step
+    process.resume(total_hours_left=42)
+    assert process.current_step_index == 1
+    assert process.elapsed_time == 6 * 3600
+    assert len(process.datalog.get_batches()) == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from schedule import Schedule
+
+
+def test_step_at_boundaries():
+    schedule = Schedule([{'days': 1, 'temp': 18.0}, {'days': 2, 'temp': 20.0}, {'days': 0.5, 'temp': 2.0}])
+    assert schedule.offsets == [0, 86400, 259200, 302400]
+    assert schedule.step_at(0) == 0
+    assert schedule.step_at(86399) == 0
+    assert schedule.step_at(86400) == 1
+    assert schedule.step_at(259199) == 1
+    assert schedule.step_at(259200) == 2
+    # the last step once the schedule is over
+    assert schedule.step_at(302400) == 2
+    assert schedule.step_at(10 ** 7) == 2
+
+
+def test_step_at_single_step():
+    schedule = Schedule([{'days': 1, 'temp': 18.0}])
+    assert schedule.step_at(0) == 0
+    assert schedule.step_at(86400) == 0
+
+
+def test_ramp_and_gravity_steps():
+    schedule = Schedule([{'days': 1, 'temp': 18.0}, {'type': 'ramp', 'days': 1, 'temp': 22.0},
+                         {'type': 'gravity', 'days': 10, 'temp': 22.0, 'gravity': 1.012}])
+    assert schedule.target_temp(1, 43200) == 20.0
+    assert schedule.target_temp(1, 86400 * 2) == 22.0
+    assert not schedule.is_step_done(2, 3600, gravity=1.020)
+    assert schedule.is_step_done(2, 3600, gravity=1.012)
+    assert schedule.is_step_done(2, 864000)
+    assert schedule.total_hours_left(1, 43200) == 252.0
+
+
+@pytest.mark.parametrize('step', [
+    {'days': 0, 'temp': 18.0},
+    {'days': 'two', 'temp': 18.0},
+    {'temp': 18.0},
+    {'type': 'gravity', 'days': 1, 'temp': 18.0},
+    {'type': 'cold crash', 'days': 1, 'temp': 2.0}
+])
+def test_invalid_steps(step):
+    with pytest.raises(ValueError):
+        Schedule([step])
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+from settings import Settings, SettingsConflict
+
+
+@pytest.fixture
+def filename(tmp_path):
+    filename = str(tmp_path / 'user_settings.json')
+    with open(filename, 'w') as f:
+        json.dump({'breweryName': 'Home', 'pid': {'kp': 1.0, 'ki': 0.5, 'kd': 0.0}, 'version': 3}, f)
+    return filename
+
+
+def _read(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def test_update_saves_and_notifies(filename):
+    settings = Settings(filename)
+    applied = []
+    settings.subscribe('pid', applied.append)
+    assert settings.update({'pid': {'kp': 2}, 'unknown': 1}, version=3) == ['pid']
+    assert settings.version == 4
+    assert applied == [{'kp': 2.0, 'ki': 0.5, 'kd': 0.0}]
+    assert _read(filename) == {'breweryName': 'Home', 'pid': {'kp': 2.0, 'ki': 0.5, 'kd': 0.0}, 'version': 4}
+    assert not os.path.exists(filename + '.tmp')
+    # nothing changed, nothing saved
+    assert settings.update({'breweryName': 'Home'}) == []
+    assert settings.version == 4
+
+
+def test_update_conflict(filename):
+    settings = Settings(filename)
+    settings.update({'breweryName': 'Garage'}, version=3)
+    with pytest.raises(SettingsConflict):
+        settings.update({'breweryName': 'Cellar'}, version=3)
+    assert settings['breweryName'] == 'Garage'
+    assert _read(filename)['version'] == 4
+
+
+def test_invalid_update_is_not_saved(filename):
+    settings = Settings(filename)
+    with pytest.raises(ValueError):
+        settings.update({'pid': {'kp': 'fast'}})
+    with pytest.raises(ValueError):
+        settings.update({'mqtt': {'pubIntervalMs': 10}})
+    assert _read(filename)['version'] == 3
+
+
+def test_load_falls_back_to_the_temp_file(filename):
+    # the device went down between removing the old file and renaming the new one
+    os.rename(filename, filename + '.tmp')
+    settings = Settings(filename)
+    assert settings.version == 3
+    settings.update({'breweryName': 'Garage'})
+    assert _read(filename)['breweryName'] == 'Garage'
+    assert not os.path.exists(filename + '.tmp')
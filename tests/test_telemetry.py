@@ -0,0 +1,69 @@
+from telemetry import Telemetry, FLAG_HEATING
+
+# the start of a 1 min & of a 3 min bucket
+START = 700000020
+
+
+def _telemetry():
+    return Telemetry(tiers=((60, 4), (180, 10)))
+
+
+def test_samples_roll_up_into_the_tiers():
+    telemetry = _telemetry()
+    telemetry.add(START, 18.0, 18.0, None, None, FLAG_HEATING)
+    telemetry.add(START + 30, 18.0, 20.0, None, 1.050)
+    telemetry.add(START + 60, 18.0, 19.0, None, None)
+    telemetry.add(START + 120, 18.0, 21.0, None, None)
+    # closes the 3rd minute, which closes the first 3 min bucket
+    telemetry.add(START + 180, 18.0, 19.0, None, None)
+    telemetry.add(START + 240, 18.0, 19.0, None, None)
+
+    history = telemetry.get_history(telemetry.get_tier(60))
+    assert history['time'] == [START, START + 60, START + 120, START + 180]
+    assert history['wortTemp']['min'][0] == 1800
+    assert history['wortTemp']['max'][0] == 2000
+    assert history['wortTemp']['mean'][0] == 1900
+    assert history['wortTemp']['last'][0] == 2000
+    assert history['chamberTemp']['mean'][0] is None
+    assert history['heatingDuty'][0] == 50
+    assert history['gravity'][0] == 10500
+
+    hours = telemetry.get_history(telemetry.get_tier(180))
+    assert hours['time'] == [START]
+    # weighted by the number of samples of every minute
+    assert hours['wortTemp']['mean'] == [1950]
+    assert hours['wortTemp']['min'] == [1800]
+    assert hours['wortTemp']['max'] == [2100]
+    assert hours['heatingDuty'] == [25]
+    assert hours['gravity'] == [10500]
+    assert telemetry.get_oldest_time() == START
+
+
+def test_history_is_paged_by_sequence_number():
+    telemetry = _telemetry()
+    tier = telemetry.get_tier(60)
+    for minute in range(10):
+        telemetry.add(START + minute * 60, 18.0, 20.0, 20.0, None)
+    # 9 buckets closed, only the last 4 are kept
+    history = telemetry.get_history(tier, limit=2)
+    assert (history['since'], history['next'], history['more']) == (5, 7, True)
+    assert history['time'] == [START + 5 * 60, START + 6 * 60]
+    history = telemetry.get_history(tier, since=history['next'], limit=2)
+    assert (history['since'], history['next'], history['more']) == (7, 9, False)
+    history = telemetry.get_history(tier, since=history['next'], limit=2)
+    assert (history['since'], history['next'], history['time']) == (9, 9, [])
+    # a client from before a reboot starts over
+    history = telemetry.get_history(tier, since=100, limit=2)
+    assert history['since'] == 5
+    # the first bucket ending after start_time
+    history = telemetry.get_history(tier, start_time=START + 6 * 60 + 30)
+    assert history['time'] == [START + 6 * 60, START + 7 * 60, START + 8 * 60]
+    history = telemetry.get_history(tier, start_time=START + 6 * 60 + 30, end_time=START + 7 * 60)
+    assert history['time'] == [START + 6 * 60, START + 7 * 60]
+
+
+def test_select_tier():
+    telemetry = _telemetry()
+    assert telemetry.select_tier(4 * 60, 200).period == 60
+    assert telemetry.select_tier(5 * 60, 200).period == 180
+    assert telemetry.select_tier(86400, 200).period == 180
@@ -0,0 +1,119 @@
+"""
+Host-side benchmark counting the socket writes per response of MicroWebSrv.
+
+Requests are fed through a fake socket, once with the former response writer
+(one write per header line, then the content) and once with the current one
+(header assembled in a single buffer, small content sent with it).  Run with
+CPython:
+
+    python tools/bench_response_writes.py
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from microWebSrv import MicroWebSrv  # noqa: E402
+
+CHART = {'timeMark': '2019/8/22 12:32', 'setTemp': 21.5, 'wortTemp': 21.9, 'chamberTemp': 22.2,
+         'gravitySg': 1.0123}
+REQUESTS = (
+    ('/connecttest', 'GET /connecttest HTTP/1.1\r\nHost: 192.168.4.1\r\nConnection: close\r\n\r\n'),
+    ('/chart', 'GET /chart HTTP/1.1\r\nHost: 192.168.4.1\r\nConnection: close\r\n\r\n'),
+    ('/ (index.html)', 'GET / HTTP/1.1\r\nHost: 192.168.4.1\r\nConnection: close\r\n\r\n'),
+    ('/js/app.js', 'GET /js/app.8a75066f.js HTTP/1.1\r\nHost: 192.168.4.1\r\nConnection: close\r\n\r\n'),
+)
+
+
+class FakeSocket:
+    """Stands for a MicroPython socket: readline() and write() on the socket itself"""
+
+    def __init__(self, request):
+        self._lines = [line + '\n' for line in request.split('\n') if line]
+        self.writes = 0
+        self.sent = 0
+
+    def readline(self):
+        return self._lines.pop(0).encode() if self._lines else b''
+
+    def write(self, data):
+        self.writes += 1
+        self.sent += len(data)
+        return len(data)
+
+    def settimeout(self, timeout):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def close(self):
+        pass
+
+
+class LegacyResponse(MicroWebSrv._response):
+    """The response writer as it was, every header line is a separate write"""
+
+    def _writeFirstLine(self, code):
+        reason = self._responseCodes.get(code, ('Unknown reason', ))[0]
+        self._write("HTTP/1.1 %s %s\r\n" % (code, reason))
+
+    def _writeHeader(self, name, value):
+        self._write("%s: %s\r\n" % (name, value))
+
+    def _writeServerHeader(self):
+        self._writeHeader("Server", "MicroWebSrv by JC`zic")
+
+    def _writeConnectionHeader(self):
+        self._writeHeader("Connection", "close")
+
+    def _writeEndHeader(self):
+        self._write("\r\n")
+
+    def _writeBeforeContent(self, code, headers, contentType, contentCharset, contentLength, content=None):
+        self._writeFirstLine(code)
+        if isinstance(headers, dict):
+            for header in headers:
+                self._writeHeader(header, headers[header])
+        if contentLength > 0:
+            self._writeContentTypeHeader(contentType, contentCharset)
+            self._writeHeader("Content-Length", contentLength)
+        self._writeServerHeader()
+        self._writeConnectionHeader()
+        self._writeEndHeader()
+        if content:
+            self._write(content)
+
+
+class LegacyClient(MicroWebSrv._client):
+    def _newResponse(self):
+        return LegacyResponse(self)
+
+
+def run(client_class, srv, request):
+    sock = FakeSocket(request)
+    client_class(srv, sock, ('127.0.0.1', 1234))
+    return sock.writes, sock.sent
+
+
+def main():
+    @MicroWebSrv.route('/connecttest')
+    def test_get(httpClient, httpResponse):
+        httpResponse.WriteResponseOk()
+
+    @MicroWebSrv.route('/chart')
+    def chart_get(httpClient, httpResponse):
+        httpResponse.WriteResponseJSONOk(obj=CHART, headers=None)
+
+    srv = MicroWebSrv(webPath=os.path.join(ROOT, 'www'))
+    srv.KeepAliveTimeout = 0
+    print('%-16s %16s %16s' % ('request', 'writes before', 'writes after'))
+    for name, request in REQUESTS:
+        before, sent_before = run(LegacyClient, srv, request)
+        after, sent_after = run(MicroWebSrv._client, srv, request)
+        print('%-16s %8d (%5d B) %8d (%5d B)' % (name, before, sent_before, after, sent_after))
+
+
+if __name__ == '__main__':
+    main()
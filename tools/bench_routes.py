@@ -0,0 +1,68 @@
+"""
+Host-side micro-benchmark of MicroWebSrv.GetRouteHandler.
+
+Compares the (method, path) index against the former linear regex scan for a
+growing number of literal routes.  Run with CPython:
+
+    python tools/bench_routes.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from microWebSrv import MicroWebSrv  # noqa: E402
+
+ROUTE_COUNTS = (4, 16, 64, 256)
+REPEAT = 20000
+
+
+def handler(httpClient, httpResponse):
+    pass
+
+
+def make_routes(count):
+    return [('/route%d' % i, 'GET' if i % 2 else 'POST', handler) for i in range(count)]
+
+
+def linear_table(routes):
+    """The routing table as it was built before the index"""
+    table = []
+    for route, method, func in routes:
+        regex = ''.join('/' + s for s in route.split('/') if s) + '$'
+        table.append((method, re.compile(regex), func))
+    return table
+
+
+def linear_lookup(table, resUrl, method):
+    if resUrl.endswith('/'):
+        resUrl = resUrl[:-1]
+    method = method.upper()
+    for rh_method, regex, func in table:
+        if rh_method == method and regex.match(resUrl):
+            return func, None
+    return None, None
+
+
+def main():
+    print('%8s  %-12s %12s %12s' % ('routes', 'lookup', 'linear (us)', 'index (us)'))
+    for count in ROUTE_COUNTS:
+        routes = make_routes(count)
+        srv = MicroWebSrv(routeHandlers=list(routes), webPath='.')
+        table = linear_table(routes)
+        last_url, last_method = routes[-1][0], routes[-1][1]
+        cases = (
+            ('last route', last_url, last_method),
+            ('static miss', '/js/vendor.3a06946c.js', 'GET'),
+        )
+        for name, url, method in cases:
+            t_linear = timeit.timeit(lambda: linear_lookup(table, url, method), number=REPEAT)
+            t_index = timeit.timeit(lambda: srv.GetRouteHandler(url, method), number=REPEAT)
+            assert linear_lookup(table, url, method)[0] is srv.GetRouteHandler(url, method)[0]
+            print('%8d  %-12s %12.3f %12.3f' % (count, name, t_linear / REPEAT * 1e6, t_index / REPEAT * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Host-side packer for the front end assets.
+
+Writes a precompressed "<file>.gz" sibling next to every compressible file of
+the www/ tree, MicroWebSrv then serves it with "Content-Encoding: gzip" to the
+browsers which accept it.  The original files are kept for the other clients.
+
+Usage:
+    python tools/gzip_www.py [www_dir] [--min-size 512] [--clean]
+
+Copy the whole www/ folder, including the .gz files, to /sd/www afterwards.
+"""
+import argparse
+import gzip
+import os
+
+COMPRESSIBLE_EXTS = ('.html', '.htm', '.js', '.css', '.json', '.svg', '.txt', '.xml', '.ico', '.ttf', '.otf')
+GZIP_EXT = '.gz'
+
+
+def iter_files(root):
+    for dir_path, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            yield os.path.join(dir_path, filename)
+
+
+def gzip_file(src_path, min_size):
+    """
+    Compress a single file
+    :return: tuple; (original size, compressed size) or None if skipped
+    """
+    size = os.path.getsize(src_path)
+    if size < min_size:
+        return None
+    with open(src_path, 'rb') as f:
+        data = f.read()
+    # mtime=0 keeps the output reproducible, so unchanged assets give unchanged .gz files
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) >= size:
+        return None
+    with open(src_path + GZIP_EXT, 'wb') as f:
+        f.write(compressed)
+    return size, len(compressed)
+
+
+def clean(root):
+    removed = 0
+    for path in iter_files(root):
+        if path.endswith(GZIP_EXT):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def pack(root, min_size):
+    total_raw = 0
+    total_gz = 0
+    for path in iter_files(root):
+        if path.endswith(GZIP_EXT) or not path.lower().endswith(COMPRESSIBLE_EXTS):
+            continue
+        result = gzip_file(path, min_size)
+        if result is None:
+            # drop a stale sibling so the device never serves outdated content
+            if os.path.exists(path + GZIP_EXT):
+                os.remove(path + GZIP_EXT)
+            continue
+        raw_size, gz_size = result
+        total_raw += raw_size
+        total_gz += gz_size
+        print('%-60s %9d -> %9d (%d%%)' % (os.path.relpath(path, root), raw_size, gz_size,
+                                           100 - gz_size * 100 // raw_size))
+    if total_raw:
+        print('Total: %d -> %d bytes, %d%% saved' % (total_raw, total_gz, 100 - total_gz * 100 // total_raw))
+
+
+def main():
+    default_root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'www')
+    parser = argparse.ArgumentParser(description='Write precompressed .gz siblings for the www/ tree.')
+    parser.add_argument('root', nargs='?', default=default_root, help='the www directory (default: %(default)s)')
+    parser.add_argument('--min-size', type=int, default=512, help='skip files smaller than this (bytes)')
+    parser.add_argument('--clean', action='store_true', help='remove all the .gz files instead')
+    args = parser.parse_args()
+    if args.clean:
+        print('Removed %d .gz files' % clean(args.root))
+    else:
+        pack(args.root, args.min_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Host-side load test for the MicroWebSrv engines.
+
+Starts the chosen engine on localhost (CPython), optionally opens a few slow
+clients which trickle their request headers, and measures the latency of
+concurrent fast clients hitting a JSON route.  With the threaded engine the
+slow clients stall everybody, with the async engine they don't.
+
+Usage:
+    python tools/http_loadtest.py --engine async --clients 8 --requests 50 --slow 2
+    python tools/http_loadtest.py --url http://192.168.4.1/connecttest --clients 4
+"""
+import argparse
+import http.client
+import os
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def serve(engine, port):
+    from microWebSrv import MicroWebSrv
+
+    @MicroWebSrv.route('/connecttest')
+    def test_get(httpClient, httpResponse):
+        httpResponse.WriteResponseJSONOk(obj={'ok': True})
+
+    if engine == 'async':
+        from microWebSrvAsync import MicroWebSrvAsync
+        app = MicroWebSrvAsync(port=port, bindIP='127.0.0.1', webPath=os.path.join(ROOT, 'www'))
+    else:
+        app = MicroWebSrv(port=port, bindIP='127.0.0.1', webPath=os.path.join(ROOT, 'www'))
+    app.Start(threaded=True)
+    for _ in range(50):
+        if app.IsStarted():
+            break
+        time.sleep(0.05)
+    return app
+
+
+def slow_client(host, port, stop_event, delay):
+    """Keeps a connection busy by sending the request headers one byte at a time"""
+    request = b'GET /connecttest HTTP/1.1\r\nHost: x\r\nX-Padding: ' + b'a' * 64 + b'\r\n\r\n'
+    while not stop_event.is_set():
+        try:
+            s = socket.create_connection((host, port))
+            for i in range(len(request)):
+                if stop_event.is_set():
+                    break
+                s.send(request[i:i + 1])
+                time.sleep(delay)
+            s.close()
+        except OSError:
+            time.sleep(delay)
+
+
+def fast_client(host, port, path, requests, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    for _ in range(requests):
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test for MicroWebSrv')
+    parser.add_argument('--engine', choices=('threaded', 'async'), default='async',
+                        help='engine started locally when no --url is given')
+    parser.add_argument('--url', help='test a running server instead, eg. http://192.168.4.1/connecttest')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='requests per client')
+    parser.add_argument('--slow', type=int, default=0, help='number of slow clients')
+    parser.add_argument('--slow-delay', type=float, default=0.05, help='seconds between the bytes of a slow client')
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlparse(args.url)
+        host, port, path = url.hostname, url.port or 80, url.path or '/'
+    else:
+        host, port, path = '127.0.0.1', args.port, '/connecttest'
+        serve(args.engine, port)
+
+    stop_event = threading.Event()
+    slow_threads = [threading.Thread(target=slow_client, args=(host, port, stop_event, args.slow_delay), daemon=True)
+                    for _ in range(args.slow)]
+    for t in slow_threads:
+        t.start()
+    time.sleep(0.2)
+
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=fast_client, args=(host, port, path, args.requests, latencies, errors))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+
+    print('engine      : %s' % (args.url or args.engine))
+    print('clients     : %d fast, %d slow' % (args.clients, args.slow))
+    print('requests    : %d ok, %d errors in %.2f s (%.1f req/s)' % (len(latencies), len(errors), elapsed,
+                                                                     len(latencies) / elapsed if elapsed else 0))
+    print('latency ms  : p50 %.1f  p95 %.1f  max %.1f' % (percentile(latencies, 50) * 1000,
+                                                         percentile(latencies, 95) * 1000,
+                                                         max(latencies or [0]) * 1000))
+
+
+if __name__ == '__main__':
+    main()
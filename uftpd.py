@@ -23,6 +23,7 @@ import uos
 import gc
 from time import sleep_ms, localtime
 from micropython import alloc_emergency_exception_buf
+from filechanges import callbacks as file_changed_callbacks
 
 # constant definitions
 _CHUNK_SIZE = const(1024)
@@ -311,6 +312,7 @@ class FTP_client:
                     cl.sendall('550 Fail\r\n')
                     if data_client is not None:
                         data_client.close()
+                notify_file_changed(path)
             elif command == "SIZE":
                 try:
                     cl.sendall('213 {}\r\n'.format(uos.stat(path)[6]))
@@ -332,6 +334,7 @@ class FTP_client:
             elif command == "DELE":
                 try:
                     uos.remove(path)
+                    notify_file_changed(path)
                     cl.sendall('250 OK\r\n')
                 except:
                     cl.sendall('550 Fail\r\n')
@@ -346,6 +349,8 @@ class FTP_client:
             elif command == "RNTO":
                     try:
                         uos.rename(self.fromname, path)
+                        notify_file_changed(self.fromname)
+                        notify_file_changed(path)
                         cl.sendall('250 OK\r\n')
                     except:
                         cl.sendall('550 Fail\r\n')
@@ -356,6 +361,7 @@ class FTP_client:
             elif command == "RMD" or command == "XRMD":
                 try:
                     uos.rmdir(path)
+                    notify_file_changed(path)
                     cl.sendall('250 OK\r\n')
                 except:
                     cl.sendall('550 Fail\r\n')
@@ -383,6 +389,15 @@ def log_msg(level, *args):
         print(*args)
 
 
+# let the registered callbacks know about a changed file
+def notify_file_changed(path):
+    for callback in file_changed_callbacks:
+        try:
+            callback(path)
+        except Exception as e:
+            log_msg(1, "File changed callback failed:", e)
+
+
 # close client and remove it from the list
 def close_client(cl):
     cl.setsockopt(socket.SOL_SOCKET, _SO_REGISTER_HANDLER, None)
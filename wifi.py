@@ -1,3 +1,4 @@
+import _thread
 import network
 import utime
 
@@ -7,7 +8,12 @@ logger = init_logger(__name__)
 
 
 class WiFi:
-    def __init__(self, rtc_obj=None):
+    def __init__(self, rtc_obj=None, scan_max_age_ms=300000, scan_min_interval_ms=10000):
+        """
+        :param rtc_obj: Class; the instance of RealTimeClock, synced once connected
+        :param scan_max_age_ms: int; older scan results are refreshed in the background when requested
+        :param scan_min_interval_ms: int; min time between two scans, even on explicit refresh
+        """
         self.ap_ip_addr = None
         self.sta_ip_addr = None
         self.ap = network.WLAN(network.AP_IF)  # Start AP mode
@@ -17,6 +23,11 @@ class WiFi:
         self.ssid = None
         self.pwd = None
         self.rtc = rtc_obj
+        self.scan_max_age_ms = scan_max_age_ms
+        self.scan_min_interval_ms = scan_min_interval_ms
+        self.scan_cache = []
+        self.scan_time = None
+        self.is_scanning = False
 
     def ap_start(self, ssid):
         """
@@ -59,12 +70,59 @@ class WiFi:
 
     def scan_wifi_list(self):
         """
-        Scan and return a list of available Access Points
+        Scan and return a list of available Access Points, this blocks for a few seconds
         return: list;
         """
         scanned_wifi = self.sta.scan()
         wifi_list = [str(wifi[0], 'utf8') for wifi in scanned_wifi]
-        return list(set(wifi_list))
+        self.scan_cache = list(set(wifi_list))
+        self.scan_time = utime.ticks_ms()
+        return self.scan_cache
+
+    def get_scan_age_ms(self):
+        """
+        :return: int; age of the cached scan results, None if there are none
+        """
+        if self.scan_time is None:
+            return None
+        return utime.ticks_diff(utime.ticks_ms(), self.scan_time)
+
+    def _background_scan(self):
+        try:
+            self.scan_wifi_list()
+        except Exception as e:
+            logger.warning('WiFi scan failed.')
+        finally:
+            self.is_scanning = False
+
+    def request_scan(self, force=False):
+        """
+        Start a scan in a background thread if the cached results are too old
+        :param force: bool; rescan even if the results are recent, scan_min_interval_ms still applies
+        :return: bool; whether a scan has been started
+        """
+        age = self.get_scan_age_ms()
+        if self.is_scanning:
+            return False
+        if age is not None:
+            if age < self.scan_min_interval_ms or (not force and age < self.scan_max_age_ms):
+                return False
+        self.is_scanning = True
+        try:
+            _thread.start_new_thread(self._background_scan, ())
+        except Exception:
+            self.is_scanning = False
+            return False
+        return True
+
+    def get_cached_wifi_list(self, refresh=False):
+        """
+        Return the cached list of Access Points at once, refreshing it in the background when needed
+        :param refresh: bool; ask for a rescan even if the cache is recent
+        :return: list;
+        """
+        self.request_scan(force=refresh)
+        return self.scan_cache
 
     def verify_ap(self, ap_ssid):
         return ap_ssid in self.scan_wifi_list()
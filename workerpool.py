@@ -0,0 +1,95 @@
+import _thread
+import utime
+
+from logger import init_logger
+
+logger = init_logger(__name__)
+
+
+class WorkerPool:
+    """
+    A fixed number of threads running the submitted jobs, behind a bounded queue
+    When the queue is full the job is refused instead of piling up, so a burst of work
+    can't exhaust the RAM.
+
+    Usage example:
+
+    pool = WorkerPool(workers=2, queue_len=4)
+    if not pool.submit(serve_client, (sock, addr)):
+        reject(sock)
+    """
+    def __init__(self, workers=2, queue_len=4):
+        """
+        :param workers: int; number of threads, each one takes a stack of _thread.stack_size()
+        :param queue_len: int; max number of jobs waiting for a free worker
+        """
+        self.workers = workers
+        self.queue_len = queue_len
+        self.queue = []
+        # wake-up locks of the idle workers, held until a job is submitted
+        self.idle = []
+        self.lock = _thread.allocate_lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.total_wait_ms = 0
+        self.max_wait_ms = 0
+        for _ in range(workers):
+            _thread.start_new_thread(self._worker, ())
+
+    def submit(self, func, args=()):
+        """
+        :return: bool; False if the queue is full and the job has been refused
+        """
+        with self.lock:
+            if len(self.queue) >= self.queue_len:
+                self.rejected += 1
+                return False
+            self.queue.append((func, args, utime.ticks_ms()))
+            self.submitted += 1
+            if len(self.queue) > self.max_depth:
+                self.max_depth = len(self.queue)
+            if self.idle:
+                self.idle.pop().release()
+        return True
+
+    def get_queue_depth(self):
+        return len(self.queue)
+
+    def get_stats(self):
+        """
+        :return: dict; counters since the pool has started
+        """
+        done = self.submitted - len(self.queue)
+        return {
+            'workers': self.workers,
+            'busy': self.workers - len(self.idle),
+            'queueDepth': len(self.queue),
+            'maxQueueDepth': self.max_depth,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'avgWaitMs': self.total_wait_ms // done if done else 0,
+            'maxWaitMs': self.max_wait_ms
+        }
+
+    def _worker(self):
+        wake = _thread.allocate_lock()
+        wake.acquire()
+        while True:
+            with self.lock:
+                job = self.queue.pop(0) if self.queue else None
+                if job is None:
+                    self.idle.append(wake)
+            if job is None:
+                # blocks until submit() releases the lock
+                wake.acquire()
+                continue
+            func, args, queued_at = job
+            wait_ms = utime.ticks_diff(utime.ticks_ms(), queued_at)
+            self.total_wait_ms += wait_ms
+            if wait_ms > self.max_wait_ms:
+                self.max_wait_ms = wait_ms
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error('WorkerPool: job failed (%s).' % e)